@@ -1,65 +1,170 @@
-import statistics
+from bisect import bisect_left
 from datetime import datetime
-from habit_manager import find_habit, check_if_streak_broken
+from habit_manager import HabitStore, find_habit, check_if_streak_broken, refresh_streaks, from_timestamp, datetime_to_timestamp
+from profiling import phase
 
 def calculate_median_completion_time(habits, task):
     """Calculate the median completion time of a specific habit"""
+    import statistics
+
     habit = find_habit(habits, task)
-    if habit is None or not habit.completion_history:
-        return None
-    
-    completion_times = []
-    for completion in habit.completion_history:
-        try:
-            time = datetime.strptime(completion['datetime'], '%Y-%m-%d %H:%M:%S')
-            completion_times.append(time)
-        except ValueError:
-            continue
-    
-    if not completion_times:
+    if habit is None or not habit.completion_count:
         return None
-    
-    completion_seconds = [
-        time.hour * 3600 + time.minute * 60 + time.second
-        for time in completion_times
-    ]
-    
-    median_time_seconds = statistics.median(completion_seconds)
+
+    with phase('analytics'):
+        completion_seconds = [timestamp % 86400 for timestamp in habit.completion_timestamps()]
+        median_time_seconds = statistics.median(completion_seconds)
     median_hour = int(median_time_seconds // 3600)
     median_minute = int((median_time_seconds % 3600) // 60)
     
     return f"{median_hour:02}:{median_minute:02}"
 
-def analyze_habit(habits, task):
+def analyze_habit(habits, task, now=None):
     habit = find_habit(habits, task)
     if habit:
-        return habit.task, habit.periodicity, habit.get_streak(), habit.highest_streak
+        return habit.task, habit.periodicity, habit.get_streak(now), habit.highest_streak
     return None
 
-def longest_streak_of_all_habits(habits):
+def top_streaks(habits, k, by='current', periodicity=None, now=None):
+    """Return the k habits with the longest current or highest streaks, longest first.
+
+    A HabitStore answers from its leaderboard, which only checks the habits
+    it ranks for broken streaks; other collections are scanned in full.
+    Ties keep the order of the habits in the collection.
+    """
+    import heapq
+
+    with phase('analytics'):
+        if isinstance(habits, HabitStore):
+            return habits.leaderboard.top(k, by, periodicity, now)
+        if periodicity:
+            habits = find_habits_by_periodicity(habits, periodicity)
+        if by == 'current':
+            refresh_streaks(habits, now)
+        return heapq.nlargest(k, habits, key=lambda habit: int(habit.current_streak if by == 'current' else habit.highest_streak))
+
+# --sort choices: key and whether the largest values come first
+SORT_KEYS = {
+    'task': (lambda habit: habit.task, False),
+    'streak': (lambda habit: int(habit.current_streak), True),
+    'highest': (lambda habit: int(habit.highest_streak), True),
+    # habits never completed go last
+    'last_completed': (lambda habit: (habit.last_completed_at is not None, habit.last_completed_at or datetime.min), True),
+}
+
+# Habits whose streaks iter_habits checks at a time
+STREAK_CHUNK = 1000
+
+def iter_habits(habits, sort=None, offset=0, limit=None, periodicity=None, now=None):
+    """Yield the habits of one page of a listing, resetting their broken streaks as they are reached.
+
+    Without sort the habits come in store order and are never copied. A
+    limited page by streak comes from the leaderboard and other limited
+    pages from a heap of offset + limit habits, so only a full sort by a
+    field holds every habit at once. Ties keep store order.
+    """
+    import heapq
+    from itertools import islice
+
+    now = now or datetime.now()
+    stop = None if limit is None else offset + limit
+    if sort in ('streak', 'highest'):
+        ranked = top_streaks(habits, len(habits) if stop is None else stop, 'current' if sort == 'streak' else 'highest', periodicity, now)
+    else:
+        if periodicity:
+            periodicity = periodicity.strip().lower()
+            habits = habits.by_periodicity(periodicity) if isinstance(habits, HabitStore) else (habit for habit in habits if habit.periodicity == periodicity)
+        if sort is None:
+            ranked = habits
+        else:
+            key, reverse = SORT_KEYS[sort]
+            if stop is None:
+                ranked = sorted(habits, key=key, reverse=reverse)
+            else:
+                ranked = (heapq.nlargest if reverse else heapq.nsmallest)(stop, habits, key=key)
+    page = islice(ranked, offset, stop)
+    while True:
+        chunk = list(islice(page, STREAK_CHUNK))
+        if not chunk:
+            break
+        refresh_streaks(chunk, now)
+        yield from chunk
+
+def habit_record(habit):
+    """The fields of a habit that a listing shows, for one ndjson line"""
+    return {'task': habit.task, 'periodicity': habit.periodicity, 'current_streak': int(habit.current_streak),
+            'highest_streak': int(habit.highest_streak), 'last_completed': habit.last_completed}
+
+def longest_streak_of_all_habits(habits, now=None):
     if not habits:
         return None
-    habit = max(habits, key=lambda h: h.get_streak())
-    return habit.task, habit.get_streak()
+    habit, = top_streaks(habits, 1, 'current', now=now)
+    return habit.task, habit.current_streak
 
 def list_completion_history(habits, task):
     """List the completion history for a given habit"""
     habit = find_habit(habits, task)
-    if habit and habit.completion_history:
-        return "\n".join([completion['datetime'] for completion in habit.completion_history])
+    if habit and habit.completion_count:
+        with phase('output'):
+            return "\n".join(iter_completion_history(habit))
     return None
 
-def list_all_habits(habits):
+def iter_completion_history(habit, since=None, until=None, offset=0, limit=None):
+    """Yield the completion times of habit from since (inclusive) to until (exclusive), oldest first.
+
+    since and until are datetimes or None for no bound. The window is found
+    by bisecting the sorted history, and offset and limit page through it,
+    so only the completions yielded are converted. Archived completions are
+    read only if the window starts before the archive boundary.
+    """
+    since = None if since is None else datetime_to_timestamp(since)
+    until = None if until is None else datetime_to_timestamp(until)
+    timestamps = habit.completion_timestamps(since, until)
+    start = 0 if since is None else bisect_left(timestamps, since)
+    stop = len(timestamps) if until is None else bisect_left(timestamps, until)
+    start += offset
+    if limit is not None:
+        stop = min(stop, start + limit)
+    for index in range(start, stop):
+        yield from_timestamp(timestamps[index])
+
+def completion_history_page(habits, task, since=None, until=None, offset=0, limit=None):
+    """Return (total, completions): the size of the history of task and one page of it as in iter_completion_history.
+
+    None if there is no such habit.
+    """
+    habit = find_habit(habits, task)
+    if habit is None:
+        return None
+    return habit.completion_count, list(iter_completion_history(habit, since, until, offset, limit))
+
+def format_habit(habit):
+    """The row of a habit in the list of all habits"""
+    return f"Task: '{habit.task}', Periodicity: '{habit.periodicity}', Streak: {habit.current_streak}, Last Completed: {habit.last_completed}"
+
+def format_habit_streak(habit):
+    """The row of a habit in a list of habits of one periodicity"""
+    return f"Task: '{habit.task}', Periodicity: '{habit.periodicity}', Streak: {habit.current_streak}"
+
+def format_analysis(habit):
+    """The analysis of a habit as a row, from the same fields analyze_habit returns"""
+    return f"Task: {habit.task}, Periodicity: {habit.periodicity}, Current Streak: {habit.current_streak}, Longest Streak: {habit.highest_streak}"
+
+def list_all_habits(habits, now=None):
     """Return a list of all habits"""
     if not habits:
         return "No habits found."
     else:
-        habit_list = [f"Task: '{habit.task}', Periodicity: '{habit.periodicity}', Streak: {habit.get_streak()}, Last Completed: {habit.last_completed}" for habit in habits]
-        return "\n".join(habit_list)
+        refresh_streaks(habits, now)
+        with phase('output'):
+            habit_list = [format_habit(habit) for habit in habits]
+            return "\n".join(habit_list)
 
 def find_habits_by_periodicity(habits, periodicity):
     """Return a list of habits that match the given periodicity"""
     periodicity = periodicity.strip().lower() 
+    if isinstance(habits, HabitStore):
+        return habits.by_periodicity(periodicity)
     return [habit for habit in habits if habit.periodicity == periodicity]
 
 def get_longest_streak_for_habit(habits, task):
@@ -69,23 +174,20 @@ def get_longest_streak_for_habit(habits, task):
         return None
     return habit.highest_streak
 
-def get_longest_streak_of_all_habits(habits):
+def get_longest_streak_of_all_habits(habits, now=None):
     """Return the habit with the longest streak"""
     if not habits:
         return None, 0
 
-    for habit in habits:
-        check_if_streak_broken(habit)
-
-    longest_streak_habit = max(habits, key=lambda habit: habit.highest_streak)
+    longest_streak_habit, = top_streaks(habits, 1, 'highest', now=now)
     return longest_streak_habit.task, longest_streak_habit.highest_streak
 
 
-def get_longest_streak_for_habit(habits, task):
+def get_longest_streak_for_habit(habits, task, now=None):
     """Return the longest streak for the given task"""
     habit = find_habit(habits, task)
     if habit is None:
         return None
 
-    check_if_streak_broken(habit)
+    check_if_streak_broken(habit, now)
     return habit.highest_streak
@@ -0,0 +1,244 @@
+"""Persistent cache of analytics results for a habits file.
+
+Results are kept in a SQLite file next to the store (habits.json.cache),
+keyed by analytics function, habit and arguments, together with the store
+version they were computed at: the inode, modification time and size of the
+snapshot and its journal. A lookup against a store whose version differs
+from the cache's drops every entry, so changes made behind the cache's back
+are never served stale. Writes through data_manager call invalidate(),
+which only drops the entries of the habits they touched (and the results
+over all habits) and moves the cache to the new version.
+
+Entries are evicted least recently used first once their values exceed
+max_bytes in total. Results that depend on current streaks expire at the
+moment the first streak involved would break.
+"""
+import json
+import os
+import time
+import zlib
+from datetime import datetime
+from habit_manager import find_habit, datetime_to_timestamp, streak_deadline
+
+CACHE_SUFFIX = '.cache'
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    task TEXT,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires INTEGER,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_task ON entries (task);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    task TEXT PRIMARY KEY,
+    fingerprint INTEGER NOT NULL
+);
+"""
+
+def cache_path(filename):
+    return os.fspath(filename) + CACHE_SUFFIX
+
+def store_version(filename):
+    """Identify the current contents of a habits file and its journal without reading them."""
+    from data_manager import journal_path
+
+    version = []
+    for path in (os.fspath(filename), journal_path(filename)):
+        try:
+            status = os.stat(path)
+            version.append([status.st_ino, status.st_mtime_ns, status.st_size])
+        except OSError:
+            version.append(None)
+    return json.dumps(version)
+
+def habit_fingerprint(habit):
+    """A checksum of everything saved about a habit, to tell whether a write changed it."""
+    header = json.dumps(habit.to_dict(history=False), sort_keys=True).encode()
+    return zlib.crc32(memoryview(habit.timestamps).cast('B'), zlib.crc32(header))
+
+def cache_key(function, task, args):
+    return json.dumps([function.__name__, task, list(args)], default=str)
+
+class AnalyticsCache:
+    """The analytics cache of one habits file."""
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES):
+        import sqlite3
+
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(cache_path(filename), timeout=30.0, isolation_level=None)
+        self.connection.executescript(CACHE_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _begin(self, version):
+        """Start a write transaction, emptying the cache if it was not built for version.
+
+        Returns whether the cache was built for version.
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        row = self.connection.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if row is not None and row[0] == version:
+            return True
+        self.clear(version)
+        return False
+
+    def clear(self, version):
+        self.connection.execute('DELETE FROM entries')
+        self.connection.execute('DELETE FROM fingerprints')
+        self.connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('version', ?)", (version,))
+
+    def lookup(self, key, version, now):
+        """Return (True, value) if key is cached for the store at version and has not expired, else (False, None)."""
+        with self.connection:
+            if not self._begin(version):
+                return False, None
+            row = self.connection.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return False, None
+            if row[1] is not None and datetime_to_timestamp(now) >= row[1]:
+                self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return False, None
+            self.connection.execute('UPDATE entries SET used = ? WHERE key = ?', (time.time_ns(), key))
+            return True, json.loads(row[0])
+
+    def store(self, key, task, value, version, fingerprint=None, expires=None):
+        """Cache value under key if the store is still at version, evicting the least recently used entries."""
+        text = json.dumps(value)
+        if len(text) > self.max_bytes:
+            return False
+        with self.connection:
+            if not self._begin(version):
+                return False
+            self.connection.execute('INSERT OR REPLACE INTO entries (key, task, value, size, expires, used) VALUES (?, ?, ?, ?, ?, ?)',
+                                    (key, task, text, len(text), expires, time.time_ns()))
+            if fingerprint is not None:
+                self.connection.execute('INSERT OR REPLACE INTO fingerprints (task, fingerprint) VALUES (?, ?)', (task, fingerprint))
+            self._evict()
+        return True
+
+    def _evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute('SELECT key, size FROM entries ORDER BY used').fetchall():
+            self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def invalidate(self, before, after, tasks=(), habits=None):
+        """Move the cache from store version before to after, dropping what the write in between changed.
+
+        tasks names the habits the write changed. habits is every habit a
+        snapshot write saved, whose fingerprints are compared with those of
+        the cached results. Results over all habits are always dropped.
+        """
+        with self.connection:
+            if not self._begin(before):
+                self.clear(after)
+                return
+            changed = set(tasks)
+            if habits is not None:
+                for task, fingerprint in self.connection.execute('SELECT task, fingerprint FROM fingerprints').fetchall():
+                    habit = find_habit(habits, task)
+                    if habit is None or habit_fingerprint(habit) != fingerprint:
+                        changed.add(task)
+            self.connection.execute('DELETE FROM entries WHERE task IS NULL')
+            for task in changed:
+                self.connection.execute('DELETE FROM entries WHERE task = ?', (task,))
+                self.connection.execute('DELETE FROM fingerprints WHERE task = ?', (task,))
+            self.connection.execute("UPDATE meta SET value = ? WHERE name = 'version'", (after,))
+
+def cached_call(filename, function, task, args, load, now=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Return function(habits, task, *args) for the habits of filename, from its cache when possible.
+
+    With task None the function is called as function(habits, *args) and
+    the result covers every habit. load() loads the habits on a miss. Pass
+    now for functions that take it and depend on current streaks, so their
+    results expire when the earliest streak involved would break. Results
+    come back as they read from JSON (tuples become lists), hit or miss.
+    None results are not cached.
+    """
+    from data_manager import log_error
+
+    key = cache_key(function, task, args)
+    version = store_version(filename)
+    cache = None
+    try:
+        cache = AnalyticsCache(filename, max_bytes)
+        hit, value = cache.lookup(key, version, now or datetime.now())
+        if hit:
+            return value
+    except Exception as e:
+        log_error(f"Error reading the analytics cache of '{filename}': {e}")
+
+    try:
+        habits = load()
+        habit = None if task is None else find_habit(habits, task)
+        fingerprint = None if habit is None else habit_fingerprint(habit)
+        call_args = (habits, *args) if task is None else (habits, task, *args)
+        value = function(*call_args, now=now) if now is not None else function(*call_args)
+        value = json.loads(json.dumps(value))
+
+        if value is None or (task is not None and habit is None) or store_version(filename) != version:
+            return value
+        expires = None
+        if now is not None:
+            # streaks whose deadline has passed are already broken and stay at 0
+            current = datetime_to_timestamp(now)
+            deadlines = (streak_deadline(habit) for habit in (habits if task is None else [habit]))
+            expires = min((deadline for deadline in deadlines if deadline is not None and deadline > current), default=None)
+        try:
+            if cache is not None:
+                cache.store(key, None if task is None else habit.task, value, version, fingerprint, expires)
+        except Exception as e:
+            log_error(f"Error writing the analytics cache of '{filename}': {e}")
+        return value
+    finally:
+        if cache is not None:
+            cache.close()
+
+def version_if_cached(filename):
+    """The store_version of filename if it has an analytics cache to keep up to date, else None."""
+    if not os.path.exists(cache_path(filename)):
+        return None
+    return store_version(filename)
+
+def invalidate(filename, before, tasks=(), habits=None):
+    """Update the analytics cache of filename after a write that changed it from version before.
+
+    before comes from version_if_cached and is None without a cache. See
+    AnalyticsCache.invalidate. Failures remove the cache file, so it is
+    rebuilt instead of ever serving a result the write made stale.
+    """
+    if before is None:
+        return
+    try:
+        with AnalyticsCache(filename) as cache:
+            cache.invalidate(before, store_version(filename), tasks, habits)
+    except Exception as e:
+        from data_manager import log_error
+
+        log_error(f"Error updating the analytics cache of '{filename}', discarding it: {e}")
+        try:
+            os.remove(cache_path(filename))
+        except OSError:
+            pass
@@ -0,0 +1,155 @@
+"""Cold storage for old completions.
+
+`archive` moves the completions before a boundary out of the store into
+gzip-compressed files of packed little-endian int64 timestamps, one per
+habit and year: habits.archive/<key>/<year>.gz next to habits.json (and
+habits.hbin, which shares it). The habit keeps a summary, e.g.
+
+    'archive': {'key': 'exercise', 'before': '2024-01-01 00:00:00', 'counts': {'2022': 340, '2023': 365}}
+
+The key is fixed when a habit is first archived, so renaming the habit
+keeps its files. Habits loaded from a file store get a loader for their
+archive (see Habit.defer_archive), which queries call only when they reach
+before the boundary.
+"""
+import gzip
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from functools import partial
+from urllib.parse import quote
+from habit_manager import to_timestamp, from_timestamp
+from locking import atomic_write
+
+ARCHIVE_SUFFIX = '.archive'
+YEAR_SUFFIX = '.gz'
+
+def archive_dir(filename):
+    """The directory holding the archive of a habits file, e.g. habits.json -> habits.archive."""
+    return os.path.splitext(os.fspath(filename))[0] + ARCHIVE_SUFFIX
+
+def year_path(directory, key, year):
+    return os.path.join(directory, key, f"{year}{YEAR_SUFFIX}")
+
+def read_year(directory, key, year, required=False):
+    """The sorted timestamps archived for one year, empty if there are none.
+
+    With required=True the year is listed in a habit's archive counts, so a
+    missing file means lost completions and raises FileNotFoundError.
+    """
+    timestamps = array('q')
+    try:
+        with gzip.open(year_path(directory, key, year), 'rb') as file:
+            timestamps.frombytes(file.read())
+    except FileNotFoundError:
+        if required:
+            raise FileNotFoundError(f"The archived completions of '{key}' for {year} are missing from '{directory}'")
+        return timestamps
+    if sys.byteorder != 'little':
+        timestamps.byteswap()
+    return timestamps
+
+def read_years(directory, key, years):
+    """The sorted timestamps archived for years, which must be in ascending order and all hold completions."""
+    timestamps = array('q')
+    for year in years:
+        timestamps.extend(read_year(directory, key, year, required=True))
+    return timestamps
+
+def write_year(directory, key, year, timestamps):
+    timestamps = array('q', timestamps)
+    if sys.byteorder != 'little':
+        timestamps.byteswap()
+    os.makedirs(os.path.join(directory, key), exist_ok=True)
+    atomic_write(year_path(directory, key, year), gzip.compress(timestamps.tobytes()))
+
+def _new_key(directory, task, taken):
+    """A file-name-safe key for task that no other habit's archive uses."""
+    base = quote(task, safe='') or '_'
+    key, number = base, 1
+    while key in taken or os.path.exists(os.path.join(directory, key)):
+        number += 1
+        key = f"{base}-{number}"
+    return key
+
+def _merge_years(directory, key, timestamps, counts):
+    """Merge the sorted timestamps into the year files of key, updating counts. Returns how many were new."""
+    added, start = 0, 0
+    while start < len(timestamps):
+        year = int(from_timestamp(timestamps[start])[:4])
+        end = bisect_left(timestamps, to_timestamp(f"{year + 1}-01-01 00:00:00"), start)
+        existing = read_year(directory, key, year)
+        merged = sorted(set(existing).union(timestamps[start:end]))
+        if len(merged) != len(existing):
+            write_year(directory, key, year, merged)
+            added += len(merged) - len(existing)
+        counts[str(year)] = len(merged)
+        start = end
+    return added
+
+def attach_archives(habits, filename):
+    """Give every archived habit of the file filename a loader for its cold completions."""
+    directory = archive_dir(filename)
+    for habit in habits:
+        if habit.archive:
+            habit.defer_archive(partial(read_years, directory, habit.archive['key']))
+    return habits
+
+def archive_completions(habits, filename, before):
+    """Move the completions of habits before the timestamp before into the archive of filename.
+
+    Year files are merged with what they already hold and written before
+    the caller saves the trimmed habits, so a crash in between leaves
+    completions in both places and running the archive again repairs it.
+    Returns {task: number of completions moved} for the habits that changed.
+    """
+    directory = archive_dir(filename)
+    taken = {habit.archive['key'] for habit in habits if habit.archive}
+    moved = {}
+    for habit in habits:
+        timestamps = habit.timestamps
+        cut = bisect_left(timestamps, before)
+        if not cut:
+            continue
+        archive = dict(habit.archive or {})
+        if 'key' not in archive:
+            archive['key'] = _new_key(directory, habit.task, taken)
+            taken.add(archive['key'])
+        counts = dict(archive.get('counts', {}))
+        _merge_years(directory, archive['key'], timestamps[:cut], counts)
+        previous = to_timestamp(archive['before']) if 'before' in archive else before
+        archive['before'] = from_timestamp(max(previous, before))
+        archive['counts'] = dict(sorted(counts.items()))
+        habit.archive = archive
+        habit.share_timestamps(array('q', timestamps[cut:]))
+        habit.defer_archive(partial(read_years, directory, archive['key']))
+        moved[habit.task] = cut
+    return moved
+
+def archive_imported(habits, filename, archived):
+    """Merge completions imported from before their habit's archive boundary into its year files.
+
+    archived maps tasks to sorted timestamps that the archive does not hold
+    yet, as import_completions reports them. Like archive_completions, the
+    files are written before the caller saves the updated counts.
+    """
+    from habit_manager import find_habit
+
+    directory = archive_dir(filename)
+    for task, timestamps in archived.items():
+        habit = find_habit(habits, task)
+        archive = dict(habit.archive)
+        counts = dict(archive['counts'])
+        _merge_years(directory, archive['key'], timestamps, counts)
+        archive['counts'] = dict(sorted(counts.items()))
+        habit.archive = archive
+
+def fold_archives(habits):
+    """Move the archived completions of habits back into their histories, for a store that cannot reach the archive."""
+    for habit in habits:
+        if habit.archive:
+            habit.share_timestamps(array('q', habit.completion_timestamps()))
+            habit.archive = None
+            habit.defer_archive(None)
+    return habits
@@ -0,0 +1,91 @@
+import json
+import shlex
+from datetime import datetime
+from habit_manager import add_habit, delete_habit, find_habit, mark_habit_as_completed, is_completed_today
+from analytics import analyze_habit
+from data_manager import journal_record
+
+BATCH_OPERATIONS = {'add': ('task', 'periodicity'), 'complete': ('task',), 'delete': ('task',), 'analyze': ('task',)}
+
+def parse_operation(line):
+    """Parse one batch line into an operation dict.
+
+    A line is either a JSON object such as {"op": "add", "task": "exercise",
+    "periodicity": "daily"} or shell-style words such as: add exercise daily
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        operation = json.loads(line)
+        if not isinstance(operation, dict):
+            raise ValueError("expected a JSON object")
+    else:
+        words = shlex.split(line)
+        if not words:
+            raise ValueError("empty operation")
+        if words[0].lower() not in BATCH_OPERATIONS:
+            raise ValueError(f"unknown operation '{words[0]}'")
+        fields = BATCH_OPERATIONS[words[0].lower()]
+        if len(words) - 1 != len(fields):
+            raise ValueError(f"'{words[0]}' expects {len(fields)} argument(s)")
+        operation = dict(zip(fields, words[1:]), op=words[0])
+
+    op = str(operation.get('op', '')).lower()
+    if op not in BATCH_OPERATIONS:
+        raise ValueError(f"unknown operation '{operation.get('op')}'")
+    missing = [field for field in BATCH_OPERATIONS[op] if not operation.get(field)]
+    if missing:
+        raise ValueError(f"'{op}' is missing {', '.join(missing)}")
+    invalid = [field for field in BATCH_OPERATIONS[op] if not isinstance(operation[field], str) or not operation[field].strip()]
+    if invalid:
+        raise ValueError(f"'{op}' needs text for {', '.join(invalid)}")
+    operation['op'] = op
+    return operation
+
+def apply_operation(habits, operation, now):
+    """Apply one parsed operation to habits.
+
+    Returns the result to report and the journal record to persist, or None
+    if nothing changed.
+    """
+    op, task = operation['op'], operation['task']
+    result = {'op': op, 'task': task.strip().lower()}
+    habit = find_habit(habits, task)
+
+    if op == 'add':
+        if habit is not None:
+            return dict(result, status='error', message=f"Habit '{task}' already exists"), None
+        add_habit(habits, task, operation['periodicity'])
+        return dict(result, status='ok'), journal_record('add', find_habit(habits, task))
+
+    if habit is None:
+        return dict(result, status='error', message=f"Habit '{task}' not found"), None
+
+    if op == 'delete':
+        delete_habit(habits, task)
+        return dict(result, status='ok'), journal_record('delete', habit)
+
+    if op == 'complete':
+        if is_completed_today(habit, now):
+            return dict(result, status='error', message=f"Habit '{task}' has already been completed today"), None
+        mark_habit_as_completed(habits, task, now)
+        return dict(result, status='ok', current_streak=habit.current_streak), journal_record('complete', habit)
+
+    task, periodicity, current_streak, highest_streak = analyze_habit(habits, task, now)
+    return dict(result, status='ok', periodicity=periodicity, current_streak=current_streak, highest_streak=highest_streak), None
+
+def run_batch(habits, lines, now=None):
+    """Apply every operation in lines to habits, yielding (result, record) per non-blank line.
+
+    Malformed lines produce an error result and do not stop the batch.
+    """
+    now = now or datetime.now()
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        try:
+            operation = parse_operation(line)
+        except ValueError as e:
+            yield {'line': line_number, 'status': 'error', 'message': str(e)}, None
+            continue
+        result, record = apply_operation(habits, operation, now)
+        yield {'line': line_number, **result}, record
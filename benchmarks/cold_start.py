@@ -0,0 +1,118 @@
+"""Measure the cold-start cost of every cli.py command.
+
+For each command this runs `python cli.py <command>` several times against a
+scratch copy of a habits file and records the median wall time. One more run
+with `python -X importtime` records how much of that is spent importing
+modules.
+
+    python benchmarks/cold_start.py --output startup.json
+    python benchmarks/cold_start.py --compare startup.json
+
+With --compare, commands that got slower than --threshold are reported and
+the script exits with status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(REPO_ROOT, 'cli.py')
+
+def default_commands(task):
+    return [
+        ['--help'],
+        ['list'],
+        ['list_by_periodicity', 'daily'],
+        ['analyze', task],
+        ['median', task],
+        ['history', task],
+        ['trend', task],
+        ['longest_streak_of_all_habits'],
+        ['stats', '--all'],
+        ['complete', task],
+    ]
+
+def run_cli(args, cwd, extra_flags=()):
+    return subprocess.run([sys.executable, *extra_flags, CLI, *args], cwd=cwd, capture_output=True, text=True)
+
+def parse_importtime(stderr):
+    """Return the total import time in ms and the slowest top-level imports."""
+    top_level = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            top_level.append((name.strip(), int(cumulative) / 1000))
+    top_level.sort(key=lambda item: item[1], reverse=True)
+    return sum(ms for _, ms in top_level), top_level[:5]
+
+def measure(args, store, runs):
+    wall_times = []
+    with tempfile.TemporaryDirectory() as scratch:
+        shutil.copy(store, os.path.join(scratch, 'habits.json'))
+        for _ in range(runs):
+            start = time.perf_counter()
+            run_cli(args, scratch)
+            wall_times.append((time.perf_counter() - start) * 1000)
+        import_ms, top_imports = parse_importtime(run_cli(args, scratch, ('-X', 'importtime')).stderr)
+    return {
+        'wall_ms': round(statistics.median(wall_times), 2),
+        'min_wall_ms': round(min(wall_times), 2),
+        'import_ms': round(import_ms, 2),
+        'top_imports': [[name, round(ms, 2)] for name, ms in top_imports],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--store', default=os.path.join(REPO_ROOT, 'habits.json'), help="habits file to copy for each command")
+    parser.add_argument('--task', default='exercise', help="habit used by the per-task commands")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="relative slowdown reported as a regression")
+    options = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': options.runs,
+        'commands': {},
+    }
+    baseline = None
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)['commands']
+
+    regressions = []
+    print(f"{'command':<34} {'wall ms':>9} {'import ms':>10}  slowest import")
+    for args in default_commands(options.task):
+        name = ' '.join(args)
+        result = measure(args, options.store, options.runs)
+        results['commands'][name] = result
+        slowest = f"{result['top_imports'][0][0]} ({result['top_imports'][0][1]:.1f})" if result['top_imports'] else ''
+        line = f"{name:<34} {result['wall_ms']:>9.1f} {result['import_ms']:>10.1f}  {slowest}"
+        if baseline and name in baseline:
+            change = result['wall_ms'] / baseline[name]['wall_ms'] - 1
+            line += f"  {change:+.0%}"
+            if change > options.threshold:
+                regressions.append(name)
+                line += " REGRESSION"
+        print(line)
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    if regressions:
+        print(f"{len(regressions)} command(s) slower than the baseline by more than {options.threshold:.0%}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Write a seeded synthetic habits.json for benchmarking.
+
+    python benchmarks/generate.py habits-large.json --habits 100000 --completions 100
+
+The same seed, sizes and end date always produce the same file. Habits are
+70% daily and 30% weekly. Each one has a preferred time of day with some
+jitter, skips about one period in ten, and has streak counters that match
+its history. The output uses the same layout as save_habits_to_file. It is
+written one habit at a time, so memory stays flat for any size.
+"""
+import argparse
+import json
+import random
+import textwrap
+from datetime import datetime, timedelta
+
+DEFAULT_SEED = 20241016
+DEFAULT_END = datetime(2024, 10, 16, 23, 59, 59)
+TASK_WORDS = ('exercise', 'reading', 'meditation', 'coding', 'yoga', 'journal', 'walk', 'stretch', 'piano', 'spanish')
+
+def generate_habit(rng, index, completions, end):
+    """Return one habit as the dict save_habits_to_file would write."""
+    periodicity = 'daily' if rng.random() < 0.7 else 'weekly'
+    period = timedelta(days=1 if periodicity == 'daily' else 7)
+    preferred_seconds = rng.randrange(5 * 3600, 23 * 3600)
+
+    history, streak, highest_streak = [], 0, 0
+    day = end.replace(hour=0, minute=0, second=0) - period * int(completions * 1.1)
+    while len(history) < completions:
+        day += period
+        if rng.random() < 0.1:
+            streak = 0
+            continue
+        seconds = min(max(int(rng.gauss(preferred_seconds, 2700)), 0), 86399)
+        history.append((day + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S'))
+        streak += 1
+        highest_streak = max(highest_streak, streak)
+
+    last_completed = history[-1] if history else "NA"
+    creation_date = (datetime.strptime(history[0], '%Y-%m-%d %H:%M:%S') - period) if history else end
+    return {
+        'task': f"{rng.choice(TASK_WORDS)} {index}",
+        'periodicity': periodicity,
+        'current_streak': streak,
+        'last_completed': last_completed,
+        'completed_today': False,
+        'completed_at': last_completed,
+        'highest_streak': highest_streak,
+        'creation_date': creation_date.strftime('%Y-%m-%d %H:%M:%S'),
+        'completion_history': [{'datetime': completed} for completed in history],
+    }
+
+def write_habits_file(path, habits, completions, seed=DEFAULT_SEED, end=DEFAULT_END):
+    """Write a synthetic habits file and return its number of completions."""
+    rng = random.Random(seed)
+    total = 0
+    with open(path, 'w') as file:
+        file.write('[')
+        for index in range(habits):
+            habit = generate_habit(rng, index, completions, end)
+            total += len(habit['completion_history'])
+            file.write(',\n' if index else '\n')
+            file.write(textwrap.indent(json.dumps(habit, indent=4), '    '))
+        file.write('\n]' if habits else ']')
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path')
+    parser.add_argument('--habits', type=int, default=1000)
+    parser.add_argument('--completions', type=int, default=100, help="completions per habit")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    options = parser.parse_args()
+    total = write_habits_file(options.path, options.habits, options.completions, options.seed)
+    print(f"Wrote {options.habits} habits with {total} completions to {options.path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Time the public functions and CLI commands on synthetic files of growing size.
+
+    python benchmarks/scale.py --sizes small,medium --output scale.json
+    python benchmarks/scale.py --sizes small --compare scale.json
+
+Each size is a number of habits times a number of completions per habit
+("large" is 100,000 x 100 = 10M completions), or a custom HABITSxCOMPLETIONS
+such as 5000x400. The files come from benchmarks/generate.py with a fixed
+seed, so runs on different commits measure the same data. Results are
+written as JSON. --compare prints the change against an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate import write_habits_file, DEFAULT_SEED, DEFAULT_END
+from habit_manager import find_habit, mark_habit_as_completed, refresh_streaks
+from analytics import (calculate_median_completion_time, analyze_habit, longest_streak_of_all_habits, list_completion_history,
+                       list_all_habits, find_habits_by_periodicity, get_longest_streak_for_habit, get_longest_streak_of_all_habits,
+                       top_streaks, iter_habits, format_habit)
+from data_manager import load_habits_from_file, save_habits_to_file
+
+SIZES = {
+    'small': (100, 100),
+    'medium': (10000, 100),
+    'large': (100000, 100),
+    'deep': (1000, 10000),
+}
+NOW = DEFAULT_END + (DEFAULT_END - DEFAULT_END.replace(hour=0, minute=0, second=0))
+
+def parse_size(name):
+    if name in SIZES:
+        return SIZES[name]
+    habits, completions = name.lower().split('x')
+    return int(habits), int(completions)
+
+def best_of(function, repeat):
+    """Median wall time of repeat calls to function, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def time_functions(path, repeat):
+    habits = load_habits_from_file(path)
+    tasks = [habit.task for habit in habits]
+    task = tasks[len(tasks) // 2]
+    pending = iter(tasks)
+    scratch = path + '.save'
+    binary = os.path.splitext(path)[0] + '.hbin'
+    save_habits_to_file(habits, binary)
+
+    def complete_next():
+        mark_habit_as_completed(habits, next(pending), NOW)
+
+    def compute_stats():
+        from completion_stats import compute_completion_stats
+        compute_completion_stats(habits)
+
+    def compute_all_streaks():
+        from streaks import compute_streaks
+        compute_streaks(habits)
+
+    def report_lazily():
+        from report import build_report
+        build_report(load_habits_from_file(path, lazy=True), NOW)
+
+    benchmarks = {
+        'load_habits_from_file': lambda: load_habits_from_file(path),
+        'load_habits_from_file(lazy)': lambda: load_habits_from_file(path, lazy=True),
+        'load_habits_from_file(binary)': lambda: load_habits_from_file(binary),
+        'save_habits_to_file(binary)': lambda: save_habits_to_file(habits, binary),
+        'save_habits_to_file': lambda: save_habits_to_file(habits, scratch),
+        'find_habit': lambda: find_habit(habits, task),
+        'find_habits_by_periodicity': lambda: find_habits_by_periodicity(habits, 'daily'),
+        'mark_habit_as_completed': complete_next,
+        'refresh_streaks': lambda: refresh_streaks(habits, NOW),
+        'list_all_habits': lambda: list_all_habits(habits, NOW),
+        'iter_habits(first page)': lambda: [format_habit(habit) for habit in iter_habits(habits, 'streak', 0, 50, now=NOW)],
+        'analyze_habit': lambda: analyze_habit(habits, task, NOW),
+        'calculate_median_completion_time': lambda: calculate_median_completion_time(habits, task),
+        'list_completion_history': lambda: list_completion_history(habits, task),
+        'longest_streak_of_all_habits': lambda: longest_streak_of_all_habits(habits, NOW),
+        'get_longest_streak_for_habit': lambda: get_longest_streak_for_habit(habits, task, NOW),
+        'get_longest_streak_of_all_habits': lambda: get_longest_streak_of_all_habits(habits, NOW),
+        'top_streaks': lambda: top_streaks(habits, 10, 'current', now=NOW),
+        'compute_completion_stats': compute_stats,
+        'compute_streaks': compute_all_streaks,
+        'build_report(lazy load)': report_lazily,
+    }
+    results = {name: best_of(function, repeat) for name, function in benchmarks.items()}
+    for leftover in (scratch, binary):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return results, task
+
+def time_cli(path, task, repeat):
+    commands = [
+        ['list'], ['list_by_periodicity', 'daily'], ['analyze', task], ['median', task], ['history', task],
+        ['longest_streak_of_all_habits'], ['stats', '--all'], ['complete', task], ['batch'],
+    ]
+    results = {}
+    for args in commands:
+        def run():
+            subprocess.run([sys.executable, os.path.join(REPO_ROOT, 'cli.py'), '--store', path, *args],
+                           input=f"complete {task}\n", capture_output=True, text=True, check=True)
+        results[' '.join('TASK' if arg == task else arg for arg in args)] = best_of(run, repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='small,medium', help=f"comma-separated sizes: {', '.join(SIZES)} or HABITSxCOMPLETIONS")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--no-cli', action='store_true', help="skip timing the CLI commands")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    options = parser.parse_args()
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)['sizes']
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': options.seed,
+        'repeat': options.repeat,
+        'sizes': {},
+    }
+    with tempfile.TemporaryDirectory() as scratch:
+        for size in options.sizes.split(','):
+            habits, completions = parse_size(size)
+            path = os.path.join(scratch, f'{size}.json')
+            start = time.perf_counter()
+            total = write_habits_file(path, habits, completions, options.seed)
+            print(f"\n{size}: {habits} habits, {total} completions, {os.path.getsize(path) / 1e6:.1f} MB "
+                  f"(generated in {time.perf_counter() - start:.1f}s)")
+
+            functions, task = time_functions(path, options.repeat)
+            cli = {} if options.no_cli else time_cli(path, task, options.repeat)
+            results['sizes'][size] = {
+                'habits': habits,
+                'completions': total,
+                'file_bytes': os.path.getsize(path),
+                'functions': functions,
+                'cli': cli,
+            }
+
+            previous = baseline.get(size, {})
+            for group, timings in (('functions', functions), ('cli', cli)):
+                for name, seconds in timings.items():
+                    line = f"  {group + ':' + name:<52} {seconds * 1000:>11.3f} ms"
+                    before = previous.get(group, {}).get(name)
+                    if before:
+                        line += f"  {seconds / before - 1:+.0%}"
+                    print(line)
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=4)
+
+if __name__ == '__main__':
+    main()
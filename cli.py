@@ -1,123 +1,770 @@
+import sys
+
+# Hand the command to a running `serve` daemon before paying for any other import
+if __name__ == "__main__" and len(sys.argv) > 1:
+    from daemon import forward_to_daemon
+
+    _exit_code = forward_to_daemon(sys.argv[1:])
+    if _exit_code is not None:
+        sys.exit(_exit_code)
+
+# Commands import what they use when they run, so `--help` and the simple
+# commands only pay for the modules they need.
+import os
 import click
-from habit_manager import add_habit, delete_habit, find_habit, mark_habit_as_completed, find_habit, is_completed_today
-from analytics import list_completion_history, list_all_habits, find_habits_by_periodicity, get_longest_streak_for_habit, get_longest_streak_of_all_habits, analyze_habit, calculate_median_completion_time
-from data_manager import load_habits_from_file, save_habits_to_file
+
+STORE = 'habits.json'
+# The --store value before --user picked a shard of it, and the user
+BASE_STORE = 'habits.json'
+USER = None
+# The daemon.HabitDaemon holding the habits in memory while `serve` runs
+RESIDENT = None
+# The StoreWriteLock held by the running command, if any
+WRITE_LOCK = None
+# Completions printed per write by `history`
+HISTORY_CHUNK = 1000
+# Rows printed per write by `list` and `list_by_periodicity`
+LIST_CHUNK = 1000
+# Whether analytics commands may answer from the store's analytics cache
+CACHE = True
+
+def parse_store(store):
+    """Split a --store value into its backend and path, e.g. 'sqlite:habits.db'."""
+    if store.startswith('sqlite:'):
+        return 'sqlite', store[len('sqlite:'):]
+    return 'json', store
+
+def load_store(store):
+    """Load every habit of the store spec, deferring completion histories."""
+    from data_manager import load_habits_from_file, load_habits_from_sqlite
+
+    backend, path = parse_store(store)
+    if backend == 'sqlite':
+        return load_habits_from_sqlite(path, lazy=True)
+    return load_habits_from_file(path, lazy=True)
 
 def load_habits():
-    return load_habits_from_file('habits.json')
+    if RESIDENT is not None:
+        return RESIDENT.habits
+    return load_store(STORE)
+
+def _register_shard():
+    """List the current user in the manifest the first time their shard is written."""
+    from data_manager import journal_path
+    from shards import register_user
+
+    if USER is None:
+        return lambda: None
+    path = parse_store(STORE)[1]
+    if os.path.exists(path) or os.path.exists(journal_path(path)):
+        return lambda: None
+    return lambda: register_user(BASE_STORE, USER)
+
+def load_habit(task):
+    """Load the single habit TASK, reading only its rows when the backend allows it."""
+    from habit_manager import find_habit
+    from data_manager import load_habit_from_sqlite
+
+    backend, path = parse_store(STORE)
+    if backend == 'sqlite' and RESIDENT is None:
+        return load_habit_from_sqlite(path, task)
+    return find_habit(load_habits(), task)
+
+def load_period_counts(task, period, keys):
+    """Completion counts of TASK in the periods keys (ascending), or None if there is no such habit.
+
+    A sqlite store reads its rollup rows and the daemon its resident
+    rollups. File stores count each period by bisecting the sorted history
+    instead of building rollups over the habit's whole lifetime.
+    """
+    from data_manager import load_rollups_from_sqlite
+    from rollups import count_in_periods, day_start, period_start, period_end
+
+    backend, path = parse_store(STORE)
+    if backend == 'sqlite' and RESIDENT is None:
+        return load_rollups_from_sqlite(path, task, period, keys)
+    habit = load_habit(task)
+    if habit is None:
+        return None
+    if RESIDENT is not None or not keys:
+        return habit.period_counts(period, keys)
+    since, until = day_start(period_start(period, keys[0])), day_start(period_end(period, keys[-1]))
+    return count_in_periods(habit.completion_timestamps(since, until), period, keys)
+
+def cached_analytics(function, task, *args, now=None):
+    """Call function(habits, task, *args) (function(habits, *args) for task None) on the store's habits.
+
+    JSON and binary file stores answer from their analytics cache while the
+    habits involved are unchanged. Pass now to functions whose result
+    depends on current streaks.
+    """
+    backend, path = parse_store(STORE)
+    if RESIDENT is None and CACHE and backend == 'json':
+        from analytics_cache import cached_call
+
+        return cached_call(path, function, task, args, load_habits, now)
+    if task is None:
+        call_args = (load_habits(), *args)
+    else:
+        habit = load_habit(task)
+        call_args = ([habit] if habit else [], task, *args)
+    return function(*call_args, now=now) if now is not None else function(*call_args)
 
 def save_habits(habits):
-    save_habits_to_file(habits, 'habits.json')
+    from data_manager import save_habits_to_file, save_habits_to_sqlite
+
+    if RESIDENT is not None:
+        RESIDENT.save_habits(habits)
+        return
+    register = _register_shard()
+    backend, path = parse_store(STORE)
+    if backend == 'sqlite':
+        save_habits_to_sqlite(habits, path)
+    else:
+        save_habits_to_file(habits, path)
+    register()
+
+def save_change(op, habit, **fields):
+    """Persist a single change without rewriting the whole store."""
+    from data_manager import journal_record
+
+    save_records([journal_record(op, habit, **fields)])
+
+def save_records(records):
+    """Persist journal records in one write, or one transaction for SQLite."""
+    from data_manager import append_to_journal, write_change_to_sqlite
+
+    if RESIDENT is not None:
+        RESIDENT.save_records(records)
+        return
+    register = _register_shard()
+    backend, path = parse_store(STORE)
+    if backend == 'sqlite':
+        write_change_to_sqlite(path, *records)
+    elif WRITE_LOCK is not None:
+        WRITE_LOCK.defer_sync(append_to_journal(path, *records, sync=False))
+    else:
+        append_to_journal(path, *records)
+    register()
+
+class StoreWriteLock:
+    """Hold the store's lock across a command's read-modify-write.
+
+    Concurrent commands therefore apply their changes one after another
+    instead of overwriting each other. Journal appends made under the lock
+    are flushed to disk after it is released, so writers arriving together
+    share one fsync (group commit).
+    """
+
+    def __init__(self):
+        self.lock = None
+        self.positions = []
+
+    def __enter__(self):
+        from locking import FileLock, lock_path
+        global WRITE_LOCK
+
+        # the daemon serializes its commands itself and locks when it flushes
+        if RESIDENT is None and WRITE_LOCK is None:
+            self.lock = FileLock(lock_path(parse_store(STORE)[1])).__enter__()
+            WRITE_LOCK = self
+        return self
+
+    def __exit__(self, *exc_info):
+        from data_manager import sync_journal
+        global WRITE_LOCK
+
+        if self.lock is None:
+            return False
+        WRITE_LOCK = None
+        self.lock.__exit__(*exc_info)
+        for position in self.positions:
+            sync_journal(parse_store(STORE)[1], position)
+        return False
+
+    def defer_sync(self, position):
+        if position is not None:
+            self.positions.append(position)
+
+def _report_profile(profile_format):
+    import profiling
+
+    session = profiling.stop()
+    if session is None:
+        return
+    metrics = session.metrics()
+    if profile_format == 'json':
+        import json
+        click.echo(json.dumps(metrics, indent=4), err=True)
+    else:
+        click.echo(profiling.format_metrics(metrics), err=True)
+    if session.dump_path:
+        click.echo(f"cProfile statistics written to {session.dump_path}", err=True)
 
 @click.group()
-def cli():
+@click.option('--store', default='habits.json', show_default=True, help="Habit storage: a JSON file path, a binary .hbin file path or sqlite:PATH.")
+@click.option('--user', default=None, help="Use this user's own shard of the store, e.g. habits.alice.json.")
+@click.option('--profile', is_flag=True, help="Print the time spent in each phase of the command to stderr.")
+@click.option('--profile-format', type=click.Choice(['text', 'json']), default='text', show_default=True, help="Format of the --profile report.")
+@click.option('--profile-dump', type=click.Path(dir_okay=False), default=None, help="Also write cProfile statistics to this file (implies --profile).")
+@click.option('--no-cache', is_flag=True, help="Compute analytics from the store instead of its analytics cache.")
+@click.pass_context
+def cli(ctx, store, user, profile, profile_format, profile_dump, no_cache):
     """A command-line interface for managing habits"""
-    pass
+    global STORE, BASE_STORE, USER, CACHE
+    BASE_STORE, STORE, USER, CACHE = store, store, None, not no_cache
+    if user is not None:
+        from shards import normalize_user, shard_store
+
+        try:
+            USER = normalize_user(user)
+            STORE = shard_store(store, USER)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'--user'")
+    if profile or profile_dump:
+        import profiling
+
+        profiling.start(profile_dump)
+        ctx.call_on_close(lambda: _report_profile(profile_format))
 
 @click.command(name="add")
 @click.argument('task')
 @click.argument('periodicity')
 def add(task, periodicity):
     """Add a new habit with TASK and PERIODICITY"""
-    habits = load_habits()
+    from habit_manager import HabitStore, add_habit, find_habit
 
-    if find_habit(habits, task):
-        click.echo(f"Habit '{task}' already exists. Cannot add a duplicate")
-    else:
-        add_habit(habits, task, periodicity)
-        save_habits(habits)
-        click.echo(f"Added new habit: {task} with periodicity: {periodicity}")
+    with StoreWriteLock():
+        if load_habit(task):
+            click.echo(f"Habit '{task}' already exists. Cannot add a duplicate")
+        else:
+            habits = HabitStore()
+            add_habit(habits, task, periodicity)
+            save_change('add', find_habit(habits, task))
+            click.echo(f"Added new habit: {task} with periodicity: {periodicity}")
 
 @click.command(name="delete")
 @click.argument('task')
 def delete(task):
     """Delete a habit with the given TASK name"""
-    habits = load_habits()
-    habit = find_habit(habits, task)
+    with StoreWriteLock():
+        habit = load_habit(task)
 
-    if habit:
-        delete_habit(habits, task)
-        save_habits(habits)
-        click.echo(f"Deleted habit: {task}")
-    else:
-        click.echo(f"Habit '{task}' not found")
+        if habit:
+            save_change('delete', habit)
+            click.echo(f"Deleted habit: {task}")
+        else:
+            click.echo(f"Habit '{task}' not found")
+
+@click.command(name="rename")
+@click.argument('task')
+@click.argument('new_task')
+def rename(task, new_task):
+    """Rename the habit TASK to NEW_TASK"""
+    from habit_manager import find_habit, rename_habit
+
+    with StoreWriteLock():
+        habits = load_habits()
+
+        if find_habit(habits, task) is None:
+            click.echo(f"Habit '{task}' not found")
+        elif not new_task.strip():
+            click.echo(f"Habit name cannot be blank. Cannot rename '{task}'")
+        elif not rename_habit(habits, task, new_task):
+            click.echo(f"Habit '{new_task}' already exists. Cannot rename '{task}'")
+        else:
+            save_change('rename', find_habit(habits, new_task), task=task.strip().lower(), new_task=new_task.strip().lower())
+            click.echo(f"Renamed habit '{task}' to '{new_task}'")
+
+def watch_habits(select, row, empty, interval):
+    """Show row(habit) for each habit select(habits) picks and redraw the rows that change until Ctrl+C."""
+    from watch import StoreWatcher, watch_rows
+
+    backend, path = parse_store(STORE)
+    watcher = StoreWatcher(path, lambda: load_store(STORE), journal=backend == 'json')
+    try:
+        watch_rows(watcher, select, row, lambda text: click.echo(text, nl=False), sys.stdout.isatty(), empty, interval)
+    except KeyboardInterrupt:
+        pass
+
+def watch_options(command):
+    """Add --watch and --interval to a listing command."""
+    command = click.option('--interval', type=click.FloatRange(min=0.01), default=1.0, show_default=True,
+                           help="Seconds between checks of the store with --watch.")(command)
+    return click.option('--watch', is_flag=True, help="Keep running and redraw the rows that change when the store changes.")(command)
+
+def listing_options(command):
+    """Add paging, sorting and the output format to a listing command."""
+    command = click.option('--format', 'output_format', type=click.Choice(['table', 'ndjson']), default='table', show_default=True,
+                           help="Output format: one line per habit, as text or as JSON.")(command)
+    command = click.option('--sort', type=click.Choice(['task', 'streak', 'highest', 'last_completed']), default=None,
+                           help="Order by task, current or highest streak (longest first) or last completion (latest first) instead of store order.")(command)
+    command = click.option('--offset', type=click.IntRange(min=0), default=0, help="Skip this many habits.")(command)
+    return click.option('--limit', type=click.IntRange(min=0), default=None, help="Show at most this many habits.")(command)
+
+def list_habits(row, empty, periodicity, sort, offset, limit, output_format, watch, interval):
+    """Print one page of habits as row(habit) or as ndjson, streaming the rows as they are built."""
+    import json
+    from itertools import islice
+    from analytics import iter_habits, habit_record
+    from profiling import phase
+
+    if output_format == 'ndjson':
+        row, empty = lambda habit: json.dumps(habit_record(habit)), None
+    if watch:
+        watch_habits(lambda habits: list(iter_habits(habits, sort, offset, limit, periodicity)), row, empty or '', interval)
+        return
+
+    rows = map(row, iter_habits(load_habits(), sort, offset, limit, periodicity))
+    with phase('output'):
+        # the first row goes out on its own so it shows before the rest are built
+        first = next(rows, None)
+        if first is None:
+            if empty is not None:
+                click.echo(empty)
+            return
+        click.echo(first)
+        while True:
+            chunk = list(islice(rows, LIST_CHUNK))
+            if not chunk:
+                break
+            click.echo("\n".join(chunk))
 
 @click.command(name="list")
-def list_command():
+@listing_options
+@watch_options
+def list_command(limit, offset, sort, output_format, watch, interval):
     """List all habits."""
-    habits = load_habits()
-    habit_details = list_all_habits(habits)
-    click.echo(habit_details)
+    from analytics import format_habit
+
+    list_habits(format_habit, "No habits found.", None, sort, offset, limit, output_format, watch, interval)
 
 @click.command(name="complete")
 @click.argument('task')
 def complete(task):
     """Mark a habit with TASK as completed"""
-    habits = load_habits()
-    habit = find_habit(habits, task)
+    from datetime import datetime
+    from habit_manager import mark_habit_as_completed, is_completed_today
 
-    if habit is None:
-        click.echo(f"Habit '{task}' not found")
+    with StoreWriteLock():
+        habit = load_habit(task)
+
+        if habit is None:
+            click.echo(f"Habit '{task}' not found")
+            return
+
+        habits = [habit]
+
+        now = datetime.now()
+        if is_completed_today(habit, now):
+            click.echo(f"Habit '{task}' has already been completed today")
+        else:
+            mark_habit_as_completed(habits, task, now)
+            save_change('complete', habit)
+            click.echo(f"Marked habit '{task}' as completed")
+
+@click.command(name="compact")
+@click.option('--threshold', type=int, help="Journal size in bytes above which it is folded into the snapshot (default: 64 KiB).")
+@click.option('--force', is_flag=True, help="Compact even if the journal is below the threshold.")
+def compact(threshold, force):
+    """Fold the change journal back into the habits file"""
+    from data_manager import compact_journal, JOURNAL_COMPACT_THRESHOLD
+
+    if threshold is None:
+        threshold = JOURNAL_COMPACT_THRESHOLD
+    backend, path = parse_store(STORE)
+    if backend != 'json':
+        click.echo(f"The {backend} store has no journal to compact")
+    elif compact_journal(path, threshold=0 if force else threshold):
+        click.echo(f"Compacted the journal into '{path}'")
+    else:
+        click.echo("Journal is below the compaction threshold, nothing to do")
+
+@click.command(name="migrate")
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+def migrate(source):
+    """Copy every habit from the JSON file SOURCE into a sqlite store"""
+    from data_manager import migrate_json_to_sqlite
+
+    backend, path = parse_store(STORE)
+    if backend != 'sqlite':
+        click.echo("Choose a sqlite store to migrate into, e.g. --store sqlite:habits.db")
+        return
+    with StoreWriteLock():
+        count = migrate_json_to_sqlite(source, path)
+        click.echo(f"Migrated {count} habits from '{source}' to '{path}'")
+
+@click.command(name="convert")
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.argument('destination', type=click.Path(dir_okay=False))
+def convert(source, destination):
+    """Copy the habits file SOURCE to DESTINATION, converting between JSON and the binary (.hbin) format"""
+    from data_manager import convert_snapshot
+    from locking import FileLock, lock_path
+
+    with FileLock(lock_path(source)), FileLock(lock_path(destination)):
+        count = convert_snapshot(source, destination)
+    click.echo(f"Converted {count} habits from '{source}' to '{destination}'")
+
+@click.command(name="archive")
+@click.option('--older-than', 'days', type=click.IntRange(min=1), required=True, help="Archive the completions from before this many days ago.")
+def archive_command(days):
+    """Move old completions into compressed per-habit, per-year archive files"""
+    from datetime import date, timedelta
+    from habit_manager import to_timestamp
+    from archive import archive_completions, archive_dir
+
+    backend, path = parse_store(STORE)
+    if backend != 'json':
+        click.echo(f"The {backend} store keeps completions indexed, nothing to archive")
         return
+    boundary = (date.today() - timedelta(days=days)).isoformat()
+    with StoreWriteLock():
+        habits = load_habits()
+        moved = archive_completions(habits, path, to_timestamp(f"{boundary} 00:00:00"))
+        if moved:
+            save_habits(habits)
+    click.echo(f"Archived {sum(moved.values())} completions of {len(moved)} habits from before {boundary} into '{archive_dir(path)}'")
+
+@click.command(name="batch")
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--dry-run', is_flag=True, help="Report the results without saving any change.")
+def batch(source, dry_run):
+    """Apply operations from SOURCE (default: stdin) under a single load and save.
+
+    Each line is either NDJSON, e.g. {"op": "complete", "task": "exercise"},
+    or words such as 'add exercise daily', 'complete exercise',
+    'delete exercise' or 'analyze exercise'. One JSON result is printed per
+    operation.
+    """
+    import json
+    from datetime import datetime
+    from batch import run_batch
+
+    with StoreWriteLock():
+        habits = load_habits()
+        records = []
+        for result, record in run_batch(habits, source, datetime.now()):
+            click.echo(json.dumps(result))
+            if record is not None:
+                records.append(record)
+
+        if records and not dry_run:
+            save_records(records)
+
+@click.command(name="recompute")
+@click.option('--dry-run', is_flag=True, help="Report the changes without saving them.")
+def recompute(dry_run):
+    """Rebuild every streak from the completion histories and repair the store"""
+    from datetime import datetime
+    from streaks import recompute_streaks
+
+    with StoreWriteLock():
+        habits = load_habits()
+        changes = recompute_streaks(habits, datetime.now())
+        for habit, before, after in changes:
+            fields = ", ".join(f"{name} {before[name]} -> {after[name]}" for name in after if before[name] != after[name])
+            click.echo(f"Habit '{habit.task}': {fields}")
+        click.echo(f"Recomputed the streaks of {len(habits)} habits, {len(changes)} changed")
+        if changes and not dry_run:
+            save_habits(habits)
+
+@click.command(name="import")
+@click.argument('source', type=click.Path(exists=True, dir_okay=False, allow_dash=True), default='-')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), help="Row format (default: from the file extension, else csv).")
+@click.option('--periodicity', default='daily', show_default=True, help="Periodicity of new habits whose rows name none.")
+@click.option('--dry-run', is_flag=True, help="Report the results without saving them.")
+def import_command(source, file_format, periodicity, dry_run):
+    """Merge completions from the CSV or NDJSON file SOURCE (default: stdin)
+
+    Each row has a task, a datetime and optionally a periodicity. Missing
+    habits are created, completions already recorded are skipped, and the
+    streaks of changed habits are rebuilt from their histories.
+    """
+    import time
+    from datetime import datetime
+    from transfer import detect_format, read_rows, import_completions
+    from archive import archive_imported
+    from streaks import recompute_streaks
 
-    if is_completed_today(habit):
-        click.echo(f"Habit '{task}' has already been completed today")
+    started = time.perf_counter()
+    file_format = file_format or detect_format(source)
+    with StoreWriteLock():
+        habits = load_habits()
+        with (sys.stdin if source == '-' else open(source, 'r', newline='')) as file:
+            try:
+                result = import_completions(habits, read_rows(file, file_format), periodicity)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        if result['archived'] and not dry_run:
+            # only file stores archive, so the habits came from the file at STORE
+            archive_imported(habits, parse_store(STORE)[1], result['archived'])
+        recompute_streaks(result['changed'], datetime.now())
+        if result['changed'] and not dry_run:
+            save_habits(habits)
+    elapsed = time.perf_counter() - started
+
+    for line_number, reason in result['errors']:
+        click.echo(f"Skipped line {line_number}: {reason}", err=True)
+    click.echo(f"Imported {result['rows']} rows in {elapsed:.2f}s ({result['rows'] / max(elapsed, 1e-9):,.0f} rows/s): "
+               f"{result['added']} completions added, {result['duplicates']} duplicates, {result['skipped']} skipped, "
+               f"{len(result['created'])} habits created")
+
+@click.command(name="export")
+@click.argument('destination', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']), help="Row format (default: from the file extension, else csv).")
+@click.option('--task', 'tasks', multiple=True, help="Only export this habit, may be repeated.")
+def export(destination, file_format, tasks):
+    """Write every completion as CSV or NDJSON rows to DESTINATION (default: stdout)"""
+    import time
+    from habit_manager import find_habit
+    from transfer import detect_format, iter_export_rows, write_rows
+
+    started = time.perf_counter()
+    habits = load_habits()
+    if tasks:
+        habits = [habit for habit in (find_habit(habits, task) for task in tasks) if habit is not None]
+    file_format = file_format or detect_format(destination)
+    if destination == '-':
+        count = write_rows(sys.stdout, iter_export_rows(habits), file_format)
+        sys.stdout.flush()
     else:
-        mark_habit_as_completed(habits, task)
-        save_habits(habits)
-        click.echo(f"Marked habit '{task}' as completed")
+        with open(destination, 'w', newline='') as file:
+            count = write_rows(file, iter_export_rows(habits), file_format)
+    elapsed = time.perf_counter() - started
+    click.echo(f"Exported {count} rows of {len(habits)} habits in {elapsed:.2f}s ({count / max(elapsed, 1e-9):,.0f} rows/s)", err=True)
+
+@click.command(name="serve")
+@click.option('--flush-interval', default=1.0, show_default=True, type=click.FloatRange(min=0), help="Seconds to collect changes before writing them to the store.")
+def serve(flush_interval):
+    """Keep the habits in memory and answer commands over a Unix socket.
+
+    While the daemon runs, `python cli.py <command>` for the same store is
+    handed to it instead of loading the store again.
+    """
+    import asyncio
+    import signal
+    from daemon import HabitDaemon
+
+    if not hasattr(asyncio, 'start_unix_server'):
+        raise click.UsageError("serve needs Unix domain sockets, which this platform does not support")
+
+    daemon = HabitDaemon(sys.modules[__name__], flush_interval)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, daemon.stop)
+        await daemon.serve()
+
+    click.echo(f"Serving '{daemon.path}' on {daemon.socket_path}")
+    asyncio.run(run())
 
 @click.command(name="analyze")
 @click.argument('task')
-def analyze(task):
+@watch_options
+def analyze(task, watch, interval):
     """Analyze a specific habit with TASK name"""
-    habits = load_habits()
-    habit = find_habit(habits, task)
+    from datetime import datetime
+    from habit_manager import find_habit
+    from analytics import analyze_habit, format_analysis
 
-    if habit is None:
+    if watch:
+        watch_habits(lambda habits: [habit for habit in [find_habit(habits, task)] if habit], format_analysis, f"Habit '{task}' not found", interval)
+        return
+
+    analysis = cached_analytics(analyze_habit, task, now=datetime.now())
+
+    if analysis is None:
         click.echo(f"Habit '{task}' not found")
         return
 
-    task, periodicity, current_streak, highest_streak = analyze_habit(habits, task)
+    task, periodicity, current_streak, highest_streak = analysis
     click.echo(f"Task: {task}, Periodicity: {periodicity}, Current Streak: {current_streak}, Longest Streak: {highest_streak}")
 
 @click.command(name="median")
 @click.argument('task')
 def median(task):
     """Calculate the median time of the completion of a TASK"""
-    habits = load_habits()
-    habit = find_habit(habits, task)
+    from analytics import calculate_median_completion_time
 
-    if habit is None:
+    median = cached_analytics(calculate_median_completion_time, task)
+    if median is None and load_habit(task) is None:
         click.echo(f"Habit '{task}' not found")
-        return
-
-    median = calculate_median_completion_time(habits, task)
-    if median is None:
+    elif median is None:
         click.echo(f"No completion records for habit '{task}'")
     else:
         click.echo(f"Habit '{task}' is completed at a median time of '{median}'")
 
+@click.command(name="stats")
+@click.argument('task', required=False)
+@click.option('--all', 'all_habits', is_flag=True, help="Show statistics for every habit.")
+@click.option('--percentile', '-p', 'percentiles', type=click.FloatRange(0, 100), multiple=True, help="Extra percentile to report, may be repeated.")
+def stats(task, all_habits, percentiles):
+    """Show completion time statistics for TASK or for every habit"""
+    from completion_stats import compute_completion_stats, format_time_of_day, DEFAULT_PERCENTILES
+
+    if all_habits == bool(task):
+        raise click.UsageError("Pass either a TASK or --all")
+
+    if all_habits:
+        habits = load_habits()
+    else:
+        habit = load_habit(task)
+        if habit is None:
+            click.echo(f"Habit '{task}' not found")
+            return
+        habits = [habit]
+
+    if not habits:
+        click.echo("No habits found")
+        return
+
+    for name, habit_stats in compute_completion_stats(habits, percentiles or DEFAULT_PERCENTILES).items():
+        if not habit_stats['count']:
+            click.echo(f"No completion records for habit '{name}'")
+            continue
+        percentile_text = ", ".join(f"p{percentile:g}: {format_time_of_day(value)}" for percentile, value in habit_stats['percentiles'].items())
+        click.echo(f"Habit '{name}': {habit_stats['count']} completions, median {format_time_of_day(habit_stats['median'])}, "
+                   f"{percentile_text}, spread {habit_stats['spread'] / 60:.0f} min")
+        for hour, count in enumerate(habit_stats['hour_histogram']):
+            if count:
+                click.echo(f"  {hour:02}:00 {'#' * min(count, 50)} {count}")
+
+@click.command(name="trend")
+@click.argument('task')
+@click.option('--period', type=click.Choice(['day', 'week', 'month']), default='week', show_default=True, help="Length of each period.")
+@click.option('--last', 'count', type=click.IntRange(min=1), default=12, show_default=True, help="Number of periods to show, ending with the current one.")
+def trend(task, period, count):
+    """Show how often TASK was completed in each recent day, week or month"""
+    from datetime import date
+    from rollups import period_keys, period_label
+
+    keys = period_keys(period, date.today().toordinal(), count)
+    counts = load_period_counts(task, period, keys)
+    if counts is None:
+        click.echo(f"Habit '{task}' not found")
+        return
+
+    click.echo(f"Completions of '{task}' per {period}:")
+    for key, completions in zip(keys, counts):
+        click.echo(f"  {period_label(period, key):<10} {'#' * min(completions, 50):<7} {completions}")
+
+@click.command(name="calendar")
+@click.argument('task')
+@click.option('--weeks', type=click.IntRange(min=1), default=12, show_default=True, help="Number of weeks to show, ending with the current one.")
+def calendar(task, weeks):
+    """Show a heatmap of the daily completions of TASK over recent weeks"""
+    from datetime import date
+    from rollups import period_key, period_label
+
+    today = date.today().toordinal()
+    first = period_key('week', today) - 7 * (weeks - 1)
+    days = list(range(first, first + 7 * weeks))
+    counts = load_period_counts(task, 'day', days)
+    if counts is None:
+        click.echo(f"Habit '{task}' not found")
+        return
+
+    levels = ".+*#"
+    busiest = max(counts) or 1
+    click.echo(f"Completions of '{task}' in the weeks from {period_label('week', first)} to {period_label('week', days[-1])}:")
+    for weekday, name in enumerate(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']):
+        cells = []
+        for week in range(weeks):
+            index = week * 7 + weekday
+            if days[index] > today:
+                cells.append(' ')
+            else:
+                cells.append(levels[-(-counts[index] * (len(levels) - 1) // busiest)])
+        click.echo(f"  {name} {' '.join(cells)}")
+    click.echo(f"  '.' none, '#' {busiest} completion(s)")
+
+def _parse_history_bound(ctx, param, value):
+    """Parse a --since/--until date or datetime; a bare --until date includes that whole day."""
+    from datetime import datetime, timedelta
+
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter(f"'{value}' is not a date (YYYY-mm-dd) or datetime (YYYY-mm-dd HH:MM:SS)")
+    if param.name == 'until':
+        moment += timedelta(days=1) if len(value) <= 10 else timedelta(seconds=1)
+    return moment
+
 @click.command(name="history")
 @click.argument('task')
-def history(task):
+@click.option('--since', callback=_parse_history_bound, help="Only completions at or after this date or datetime.")
+@click.option('--until', callback=_parse_history_bound, help="Only completions at or before this date or datetime.")
+@click.option('--offset', type=click.IntRange(min=0), default=0, help="Skip this many completions of the range.")
+@click.option('--limit', type=click.IntRange(min=0), default=None, help="Show at most this many completions.")
+def history(task, since, until, offset, limit):
     """Return the list of completion dates of a TASK"""
-    habits = load_habits()
-    habit = find_habit(habits, task)
+    from itertools import islice
+    from analytics import iter_completion_history, completion_history_page
 
-    if habit is None:
+    if limit is not None and limit <= HISTORY_CHUNK:
+        # short pages, as dashboards request them, come from the analytics cache
+        page = cached_analytics(completion_history_page, task, since, until, offset, limit)
+        total, completions = (None, None) if page is None else (page[0], iter(page[1]))
+    else:
+        habit = load_habit(task)
+        total = None if habit is None else habit.completion_count
+        completions = None if habit is None else iter_completion_history(habit, since, until, offset, limit)
+
+    if total is None:
         click.echo(f"Habit '{task}' not found")
         return
 
-    history_list = list_completion_history(habits, task)
-    if history_list is None:
+    if not total:
         click.echo(f"There is no history of completion for the habit {task}")
+        return
+
+    first = next(completions, None)
+    if first is None:
+        click.echo(f"No completions of the habit {task} in the requested range")
+        return
+
+    click.echo(f"The completion history for {task}: \n{first}")
+    # Print in chunks so memory stays flat however long the history is
+    while True:
+        chunk = list(islice(completions, HISTORY_CHUNK))
+        if not chunk:
+            break
+        click.echo("\n".join(chunk))
+
+@click.command(name="report")
+@click.option('--workers', type=click.IntRange(min=1), default=None, help="Worker processes (default: one per CPU).")
+@click.option('--format', 'output_format', type=click.Choice(['table', 'json']), default='table', show_default=True, help="Output format.")
+def report(workers, output_format):
+    """Show the streaks, completion count and median time of every habit, computed in parallel"""
+    from datetime import datetime
+    from report import build_report, longest, format_table
+
+    rows = build_report(load_habits(), datetime.now(), workers)
+    current, highest = longest(rows, 'current_streak'), longest(rows, 'highest_streak')
+    if output_format == 'json':
+        import json
+
+        summary = {
+            'longest_current_streak': current and {'task': current['task'], 'streak': current['current_streak']},
+            'longest_streak': highest and {'task': highest['task'], 'streak': highest['highest_streak']},
+        }
+        click.echo(json.dumps({'habits': rows, **summary}, indent=4))
+    elif not rows:
+        click.echo("No habits found")
     else:
-        click.echo(f"The completion history for {task}: \n{history_list}")
+        click.echo(format_table(rows))
+        click.echo(f"The habit with the longest current streak is '{current['task']}' with a streak of {current['current_streak']}")
+        click.echo(f"The habit with the longest streak is '{highest['task']}' with a streak of {highest['highest_streak']}")
 
 @click.command(name="longest_streak")
 def longest_streak():
     """Display the habit with the longest current streak"""
+    from analytics import longest_streak_of_all_habits
+
     habits = load_habits()
     longest = longest_streak_of_all_habits(habits)
 
@@ -126,25 +773,43 @@ def longest_streak():
     else:
         click.echo(f"The habit with the longest streak is '{longest[0]}' with a streak of {longest[1]}")
 
+@click.command(name="leaderboard")
+@click.option('--top', 'count', type=click.IntRange(min=1), default=10, show_default=True, help="Number of habits to show.")
+@click.option('--by', type=click.Choice(['current', 'highest']), default='current', show_default=True, help="Rank by the current or the highest streak.")
+@click.option('--periodicity', default=None, help="Only rank habits with this periodicity.")
+def leaderboard(count, by, periodicity):
+    """Show the habits with the longest current or highest streaks"""
+    from datetime import datetime
+    from analytics import top_streaks
+
+    ranked = top_streaks(load_habits(), count, by, periodicity, datetime.now())
+    if not ranked:
+        click.echo("No habits found" if periodicity is None else f"No habits found with periodicity: {periodicity}")
+        return
+
+    for rank, habit in enumerate(ranked, 1):
+        streak = habit.current_streak if by == 'current' else habit.highest_streak
+        click.echo(f"{rank}. Task: '{habit.task}', Periodicity: '{habit.periodicity}', {by.capitalize()} Streak: {streak}")
+
 @cli.command(name="list_by_periodicity")
 @click.argument('periodicity')
-def list_by_periodicity(periodicity):
+@listing_options
+@watch_options
+def list_by_periodicity(periodicity, limit, offset, sort, output_format, watch, interval):
     """List all habits with the given periodicity (daily or weekly)"""
-    habits = load_habits()
-    matching_habits = find_habits_by_periodicity(habits, periodicity)
-    
-    if matching_habits:
-        habit_list = [f"Task: '{habit.task}', Periodicity: '{habit.periodicity}', Streak: {habit.get_streak()}" for habit in matching_habits]
-        click.echo("\n".join(habit_list))
-    else:
-        click.echo(f"No habits found with periodicity: {periodicity}")
+    from analytics import format_habit_streak
+
+    list_habits(format_habit_streak, f"No habits found with periodicity: {periodicity}", periodicity, sort, offset, limit, output_format, watch, interval)
 
 @cli.command("longest_streak")
 @click.argument('task')
 def longest_streak(task):
     """Display the longest streak for a specific habit"""
+    from datetime import datetime
+    from analytics import get_longest_streak_for_habit
+
     habits = load_habits()
-    streak = get_longest_streak_for_habit(habits, task)
+    streak = get_longest_streak_for_habit(habits, task, datetime.now())
 
     if streak is None:
         click.echo(f"Habit '{task}' not found")
@@ -155,22 +820,59 @@ def longest_streak(task):
 @cli.command("longest_streak_of_all_habits")
 def longest_streak_of_all_habits():
     """Display the habit with the longest current streak among all habits"""
-    habits = load_habits()
-    task, streak = get_longest_streak_of_all_habits(habits)
+    from analytics import get_longest_streak_of_all_habits
+
+    task, streak = cached_analytics(get_longest_streak_of_all_habits, None)
 
     if task is None:
         click.echo("No habits defined")
     else:
         click.echo(f"The habit with the longest streak is '{task}' with a streak of {streak}")
 
+@click.command(name="users")
+def users():
+    """Summarize the habits of every user, loading one shard at a time"""
+    from datetime import datetime
+    from habit_manager import refresh_streaks, is_completed_today
+    from shards import iter_shards
+
+    now = datetime.now()
+    found = False
+    for user, store in iter_shards(BASE_STORE):
+        found = True
+        habits = load_store(store)
+        refresh_streaks(habits, now)
+        best = max(habits, key=lambda habit: habit.current_streak, default=None)
+        longest = f"'{best.task}' with a streak of {best.current_streak}" if best else "none"
+        completed = sum(1 for habit in habits if is_completed_today(habit, now))
+        click.echo(f"User: '{user}', Habits: {len(habits)}, Completed Today: {completed}, Longest Current Streak: {longest}")
+    if not found:
+        click.echo("No users found")
+
 cli.add_command(add)
 cli.add_command(delete)
+cli.add_command(rename)
 cli.add_command(list_command)
 cli.add_command(complete)
+cli.add_command(compact)
+cli.add_command(batch)
+cli.add_command(recompute)
+cli.add_command(import_command)
+cli.add_command(export)
+cli.add_command(serve)
+cli.add_command(migrate)
+cli.add_command(convert)
+cli.add_command(archive_command)
+cli.add_command(users)
 cli.add_command(analyze)
 cli.add_command(median)
 cli.add_command(history)
+cli.add_command(trend)
+cli.add_command(calendar)
+cli.add_command(stats)
 cli.add_command(longest_streak)
+cli.add_command(leaderboard)
+cli.add_command(report)
 cli.add_command(list_by_periodicity)
 cli.add_command(longest_streak_of_all_habits)
 cli.add_command(longest_streak)
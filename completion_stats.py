@@ -0,0 +1,88 @@
+import numpy as np
+from habit_manager import find_habit
+
+SECONDS_PER_DAY = 86400
+DEFAULT_PERCENTILES = (25, 50, 75)
+
+def build_completion_arrays(habits):
+    """Pack the histories of habits, archived completions included, into one array of seconds since midnight.
+
+    Returns (tasks, seconds, starts, counts): the completions of tasks[i] are
+    seconds[starts[i]:starts[i] + counts[i]], sorted ascending.
+    """
+    habits = list(habits)
+    tasks = [habit.task for habit in habits]
+    histories = [habit.completion_timestamps() for habit in habits]
+    counts = np.array([len(history) for history in histories], dtype=np.int64)
+    starts = np.zeros(len(habits), dtype=np.int64)
+    if len(habits) > 1:
+        np.cumsum(counts[:-1], out=starts[1:])
+
+    timestamps = np.empty(int(counts.sum()), dtype=np.int64)
+    for history, start, count in zip(histories, starts, counts):
+        if count:
+            timestamps[start:start + count] = np.frombuffer(history, dtype=np.int64)
+
+    groups = np.repeat(np.arange(len(habits)), counts)
+    seconds = timestamps % SECONDS_PER_DAY
+    seconds = seconds[np.lexsort((seconds, groups))]
+    return tasks, seconds, starts, counts
+
+def _group_percentiles(seconds, starts, counts, percentile):
+    """Linearly interpolated percentile of every group, NaN for empty groups."""
+    result = np.full(len(counts), np.nan)
+    present = counts > 0
+    position = (counts[present] - 1) * (percentile / 100.0)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    low_values = seconds[starts[present] + lower]
+    high_values = seconds[starts[present] + upper]
+    result[present] = low_values + (high_values - low_values) * (position - lower)
+    return result
+
+def compute_completion_stats(habits, percentiles=DEFAULT_PERCENTILES):
+    """Compute time-of-day statistics for every habit in one vectorized pass.
+
+    Returns a dict keyed by task with the completion count, median, the
+    requested percentiles and the standard deviation (all in seconds since
+    midnight, None without completions) and a 24-bucket hour-of-day histogram.
+    """
+    tasks, seconds, starts, counts = build_completion_arrays(habits)
+    if not tasks:
+        return {}
+
+    groups = np.repeat(np.arange(len(tasks)), counts)
+    hour_histograms = np.bincount(groups * 24 + seconds // 3600, minlength=len(tasks) * 24).reshape(len(tasks), 24)
+
+    totals = np.bincount(groups, weights=seconds, minlength=len(tasks))
+    squares = np.bincount(groups, weights=seconds.astype(np.float64) ** 2, minlength=len(tasks))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = totals / counts
+        spreads = np.sqrt(np.maximum(squares / counts - means ** 2, 0.0))
+
+    medians = _group_percentiles(seconds, starts, counts, 50)
+    percentile_values = {percentile: _group_percentiles(seconds, starts, counts, percentile) for percentile in percentiles}
+
+    stats = {}
+    for index, task in enumerate(tasks):
+        present = bool(counts[index])
+        stats[task] = {
+            'count': int(counts[index]),
+            'median': float(medians[index]) if present else None,
+            'percentiles': {percentile: float(values[index]) if present else None for percentile, values in percentile_values.items()},
+            'spread': float(spreads[index]) if present else None,
+            'hour_histogram': hour_histograms[index].tolist(),
+        }
+    return stats
+
+def completion_stats_for_habit(habits, task, percentiles=DEFAULT_PERCENTILES):
+    """Compute the statistics of compute_completion_stats for a single habit."""
+    habit = find_habit(habits, task)
+    if habit is None:
+        return None
+    return compute_completion_stats([habit], percentiles)[habit.task]
+
+def format_time_of_day(seconds):
+    """Format seconds since midnight as 'HH:MM'."""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02}:{(seconds % 3600) // 60:02}"
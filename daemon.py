@@ -0,0 +1,284 @@
+import os
+import sys
+
+SOCKET_SUFFIX = '.sock'
+# Commands a client hands to a running daemon. The others take file
+# arguments or stdin that only make sense in the caller's process, so the
+# client has the daemon flush its queued writes first and runs them itself;
+# the daemon notices their writes and reloads.
+FORWARDED_COMMANDS = {'add', 'delete', 'rename', 'complete', 'list', 'list_by_periodicity', 'analyze', 'median',
+                      'history', 'stats', 'trend', 'calendar', 'longest_streak', 'longest_streak_of_all_habits', 'leaderboard'}
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+def socket_path_for(store_path):
+    """The socket a daemon serving store_path listens on."""
+    return os.path.abspath(store_path) + SOCKET_SUFFIX
+
+# Group options that take a value, which must not be mistaken for the command name
+VALUE_OPTIONS = {'--store', '--user', '--profile-format', '--profile-dump'}
+
+def _parse_cli_args(args):
+    """Find the store and the command name in cli arguments without importing click.
+
+    With --user the store is that user's shard of the --store value.
+    """
+    options, command, index = {'--store': 'habits.json'}, None, 0
+    while index < len(args):
+        arg = args[index]
+        name, _, value = arg.partition('=')
+        if arg in VALUE_OPTIONS and index + 1 < len(args):
+            options[arg] = args[index + 1]
+            index += 1
+        elif name in VALUE_OPTIONS and value:
+            options[name] = value
+        elif not arg.startswith('-'):
+            command = arg
+            break
+        index += 1
+    store = options['--store']
+    if '--user' in options:
+        from shards import shard_store
+
+        try:
+            store = shard_store(store, options['--user'])
+        except ValueError:
+            return store, None
+    return store, command
+
+def forward_to_daemon(args, timeout=30.0):
+    """Run the cli arguments on a daemon serving the same store, if one is listening.
+
+    Returns the command's exit code, or None if the caller should run the
+    command itself. A command the daemon does not run reads or writes the
+    store files directly, so the daemon is asked to flush its queued writes
+    before the caller runs it.
+    """
+    store, command = _parse_cli_args(args)
+    path = socket_path_for(store.split(':', 1)[1] if store.startswith('sqlite:') else store)
+    if not os.path.exists(path):
+        return None
+    # a watching command keeps running, so it watches the files itself
+    if command not in FORWARDED_COMMANDS or '--watch' in args:
+        _request(path, {'flush': True}, timeout)
+        return None
+    response = _request(path, {'args': list(args), 'cwd': os.getcwd()}, timeout)
+    if response is None:
+        return None
+
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    return response['exit_code']
+
+def _request(path, request, timeout):
+    """Send one request to the daemon listening on path and return its response, or None if it cannot be reached."""
+    # Only pay for these imports when a daemon is likely listening
+    import json
+    import socket
+
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall(json.dumps(request).encode() + b'\n')
+            response = b''
+            while not response.endswith(b'\n'):
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+        return json.loads(response)
+    except (OSError, ValueError):
+        return None
+
+class HabitDaemon:
+    """Keeps one store's habits in memory and runs cli commands against them.
+
+    Changes are applied to the resident habits immediately and written to the
+    store in the background, at most once per flush_interval seconds.
+    """
+
+    def __init__(self, cli_module, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.cli_module = cli_module
+        self.flush_interval = flush_interval
+        self.backend, self.path = cli_module.parse_store(cli_module.STORE)
+        self.path = os.path.abspath(self.path)
+        # the served user's shard is listed in the manifest of the base store when first written
+        self.user = cli_module.USER
+        base_backend, base_path = cli_module.parse_store(cli_module.BASE_STORE)
+        self.base_store = self._spec(base_backend, os.path.abspath(base_path))
+        self.socket_path = socket_path_for(self.path)
+        self.habits = None
+        self.pending_records = []
+        self.pending_snapshot = False
+        self._signature = None
+        self._loop = None
+        self._stopped = None
+        self._flush_handle = None
+
+    @staticmethod
+    def _spec(backend, path):
+        return f"sqlite:{path}" if backend == 'sqlite' else path
+
+    def resolve_store(self, args, cwd=None):
+        """The (backend, absolute path) the cli arguments select, relative paths taken from cwd."""
+        store, _ = _parse_cli_args(args)
+        backend, path = self.cli_module.parse_store(store)
+        return backend, os.path.abspath(os.path.join(cwd or os.getcwd(), path))
+
+    def _store_signature(self):
+        from data_manager import journal_path
+
+        signature = []
+        for path in (self.path, journal_path(self.path)):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload(self):
+        self.flush()
+        self.habits = self.cli_module.load_store(self._spec(self.backend, self.path))
+        self._signature = self._store_signature()
+
+    def save_records(self, records):
+        """Apply records the command has not applied itself and queue them for writing."""
+        from data_manager import apply_journal_record
+
+        for record in records:
+            # complete records describe a resident habit the command already updated
+            if record['op'] != 'complete':
+                apply_journal_record(self.habits, record)
+        self.pending_records.extend(records)
+        self._schedule_flush()
+
+    def save_habits(self, habits):
+        self.habits = habits
+        self.pending_records = []
+        self.pending_snapshot = True
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._loop is None:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Write every queued change to the served store in one go, holding the store lock like a cli writer."""
+        from data_manager import (journal_path, save_habits_to_file, append_to_journal, save_habits_to_sqlite,
+                                  write_change_to_sqlite)
+        from locking import FileLock, lock_path
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.pending_records and not self.pending_snapshot:
+            return
+        records, self.pending_records = self.pending_records, []
+        snapshot, self.pending_snapshot = self.pending_snapshot, False
+        with FileLock(lock_path(self.path)):
+            new_shard = self.user is not None and not (os.path.exists(self.path) or os.path.exists(journal_path(self.path)))
+            if self.backend == 'sqlite':
+                if snapshot:
+                    save_habits_to_sqlite(self.habits, self.path)
+                if records:
+                    write_change_to_sqlite(self.path, *records)
+            else:
+                if snapshot:
+                    save_habits_to_file(self.habits, self.path)
+                if records:
+                    append_to_journal(self.path, *records)
+            self._signature = self._store_signature()
+        if new_shard:
+            from shards import register_user
+
+            register_user(self.base_store, self.user)
+
+    def run_command(self, args, cwd=None):
+        """Run cli arguments against the resident habits and capture what they print.
+
+        cwd is the client's working directory, which relative --store values
+        are resolved against. Arguments selecting another store are refused.
+        """
+        import click
+        import io
+        import traceback
+        from contextlib import redirect_stdout, redirect_stderr
+
+        backend, path = self.resolve_store(args, cwd)
+        if (backend, path) != (self.backend, self.path):
+            return {'stdout': '', 'stderr': f"This daemon serves '{self._spec(self.backend, self.path)}', not '{self._spec(backend, path)}'\n",
+                    'exit_code': 2}
+        if self._store_signature() != self._signature:
+            self.reload()
+        cli_module = self.cli_module
+        # the group callback points these at the client's --store and --user
+        saved = cli_module.STORE, cli_module.BASE_STORE, cli_module.USER, cli_module.CACHE
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                exit_code = self.cli_module.cli.main(args=args, prog_name='cli.py', standalone_mode=False) or 0
+            except click.ClickException as e:
+                e.show()
+                exit_code = e.exit_code
+            except click.Abort:
+                click.echo("Aborted!", err=True)
+                exit_code = 1
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                cli_module.STORE, cli_module.BASE_STORE, cli_module.USER, cli_module.CACHE = saved
+        return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'exit_code': exit_code}
+
+    async def _handle_client(self, reader, writer):
+        import json
+
+        try:
+            request = json.loads(await reader.readline())
+            if request.get('flush'):
+                self.flush()
+                response = {'stdout': '', 'stderr': '', 'exit_code': 0}
+            else:
+                response = self.run_command([str(arg) for arg in request['args']], request.get('cwd'))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            response = {'stdout': '', 'stderr': f"Bad request: {e}\n", 'exit_code': 2}
+        writer.write(json.dumps(response).encode() + b'\n')
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Serve requests until stop() is called."""
+        import asyncio
+
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self.cli_module.RESIDENT = self
+        self.reload()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._loop = None
+            self.flush()
+            self.cli_module.RESIDENT = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        """Stop serving. Safe to call from any thread or a signal handler."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
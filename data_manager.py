@@ -1,47 +1,618 @@
 import json
-from habit_manager import Habit
-import logging
+import re
+import struct
+import sys
+from array import array
+from functools import partial
+from habit_manager import Habit, HabitStore, find_habit, delete_habit, rename_habit, from_timestamp, to_timestamp, history_to_timestamps
+from rollups import PERIODS, CompletionRollups, day_of_timestamp, period_key
+from profiling import phase
+from locking import FileLock, lock_path, atomic_write
+from analytics_cache import version_if_cached, invalidate as invalidate_analytics_cache
 import os
 
-logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+JOURNAL_SUFFIX = '.journal'
+# Snapshots whose name ends in BINARY_SUFFIX use the memory-mapped binary format
+BINARY_SUFFIX = '.hbin'
+BINARY_MAGIC = b'HABITBIN'
+BINARY_VERSION = 1
+# magic, version, habit count, table offset, table size, column offset
+BINARY_HEADER = struct.Struct('<8sIIQQQ')
+JOURNAL_COMPACT_THRESHOLD = 64 * 1024
+SYNC_SUFFIX = '.sync'
 
-def load_habits_from_file(filename: str) -> list:
-    """Load habits from a JSON file and convert them into Habit objects."""
-    habits = []
+def log_error(message):
+    """Log an error, setting up logging on first use so importing this module stays cheap."""
+    import logging
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.error(message)
+
+HISTORY_KEY = re.compile(r'"completion_history"\s*:\s*\[')
+# A JSON string or a bracket, to find the bracket closing a history
+HISTORY_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]]')
+
+def load_habits_from_file(filename: str, lazy=False) -> HabitStore:
+    """Load habits from a JSON file into a HabitStore indexed by task and periodicity.
+
+    With lazy=True only the habit headers are parsed up front and each
+    completion_history is parsed the first time it is accessed. The snapshot
+    and its journal are read under a shared lock, so a concurrent compaction
+    cannot pair the new snapshot with the old journal.
+    """
+    with FileLock(lock_path(filename), shared=True):
+        if is_binary_snapshot(filename):
+            habits = load_habits_from_binary(filename)
+        else:
+            text = _read_snapshot(filename)
+            habits = _parse_snapshot(text, filename, lazy) if text is not None else HabitStore()
+        replay_journal(habits, filename)
+    archived = [habit for habit in habits if habit.archive]
+    if archived:
+        from archive import attach_archives
+
+        attach_archives(archived, filename)
+    return habits
+
+def _snapshot_not_found(filename):
+    # a store whose changes are all still in its journal has no snapshot until the first compaction
+    if not os.path.exists(journal_path(filename)):
+        log_error(f"File '{filename}' not found.")
+
+def _read_snapshot(filename):
     try:
         with open(filename, 'r') as file:
-            habits_data = json.load(file)
-            for habit_data in habits_data:
-                habit = Habit(
-                    task=habit_data['task'],
-                    periodicity=habit_data['periodicity'],
-                    current_streak=habit_data['current_streak'],
-                    last_completed=habit_data['last_completed'],
-                    completed_today=habit_data['completed_today'],
-                    completed_at=habit_data['completed_at'],
-                    highest_streak=habit_data['highest_streak'],
-                    creation_date=habit_data['creation_date'],
-                    completion_history=habit_data.get('completion_history', [])
-                )
-                habits.append(habit)
+            with phase('load'):
+                return file.read()
     except FileNotFoundError:
-        logging.error(f"File '{filename}' not found.")
+        _snapshot_not_found(filename)
+    except Exception as e:
+        log_error(f"An error occurred while loading habits from file '{filename}': {e}")
+    return None
+
+def _parse_snapshot(text, filename, lazy):
+    habits = HabitStore()
+    try:
+        if lazy:
+            for habit in _parse_habits_lazily(text):
+                habits.append(habit)
+        else:
+            with phase('parse'):
+                habits_data = json.loads(text)
+            with phase('build'):
+                for habit_data in habits_data:
+                    habits.append(Habit.from_dict(habit_data))
     except json.JSONDecodeError:
-        logging.error(f"Error decoding JSON from file '{filename}'.")
+        log_error(f"Error decoding JSON from file '{filename}'.")
     except Exception as e:
-        logging.error(f"An error occurred while loading habits from file '{filename}': {e}")
-    
+        log_error(f"An error occurred while loading habits from file '{filename}': {e}")
     return habits
 
+def _parse_habits_lazily(text):
+    """Parse habit headers, keeping each completion_history as an offset range into text.
+
+    Falls back to parsing the whole text if the histories cannot be cut out.
+    """
+    with phase('parse'):
+        try:
+            headers, spans = _parse_headers(text)
+        except ValueError:
+            headers, spans = json.loads(text), []
+    for habit_data in headers:
+        span = habit_data.get('completion_history')
+        if isinstance(span, int):
+            del habit_data['completion_history']
+        with phase('build'):
+            habit = Habit.from_dict(habit_data)
+        if isinstance(span, int):
+            start, end = spans[span]
+            habit.defer_history(partial(_parse_history, text, start, end))
+        yield habit
+
+def _parse_headers(text):
+    pieces, spans, position = [], [], 0
+    for match in HISTORY_KEY.finditer(text):
+        if match.start() < position:
+            continue
+        start = match.end() - 1
+        end = _closing_bracket(text, start)
+        pieces.append(text[position:start])
+        pieces.append(str(len(spans)))
+        spans.append((start, end))
+        position = end
+    pieces.append(text[position:])
+    return json.loads(''.join(pieces)), spans
+
+def _closing_bracket(text, start):
+    """The position after the bracket closing the one at start, skipping brackets inside strings."""
+    depth = 0
+    for token in HISTORY_TOKEN.finditer(text, start):
+        if token.group() == '[':
+            depth += 1
+        elif token.group() == ']':
+            depth -= 1
+            if not depth:
+                return token.end()
+    raise ValueError("unterminated completion_history")
+
+def _parse_history(text, start, end):
+    with phase('parse'):
+        return json.loads(text[start:end])
+
+def deferred_history_json(habit):
+    """The JSON text of habit's completion history if a lazy load has not parsed it yet, else None."""
+    loader = habit.history_loader
+    if isinstance(loader, partial) and loader.func is _parse_history:
+        text, start, end = loader.args
+        return text[start:end]
+    return None
+
 def save_habits_to_file(habits, file_path_or_obj):
-    """Save a list of Habit objects to a JSON file or file-like object."""
+    """Save a list of Habit objects to a JSON file or file-like object.
+
+    A file is replaced atomically under the store's lock, so a crash leaves
+    either the old or the new snapshot and never a truncated one.
+    """
     try:
-        if isinstance(file_path_or_obj, (str, bytes, os.PathLike)):
-            with open(file_path_or_obj, 'w') as file:
-                habits_data = [habit.to_dict() for habit in habits]
-                json.dump(habits_data, file, indent=4)
-        else:
+        if is_binary_snapshot(file_path_or_obj):
+            save_habits_to_binary(habits, file_path_or_obj)
+            return
+        with phase('serialize'):
             habits_data = [habit.to_dict() for habit in habits]
-            json.dump(habits_data, file_path_or_obj, indent=4)
+            text = json.dumps(habits_data, indent=4)
+        with phase('write'):
+            if isinstance(file_path_or_obj, (str, bytes, os.PathLike)):
+                with FileLock(lock_path(file_path_or_obj)):
+                    before = version_if_cached(file_path_or_obj)
+                    atomic_write(file_path_or_obj, text)
+                    clear_journal(file_path_or_obj)
+                    invalidate_analytics_cache(file_path_or_obj, before, habits=habits)
+            else:
+                file_path_or_obj.write(text)
+    except Exception as e:
+        log_error(f"Error saving habits to file '{file_path_or_obj}': {e}")
+
+def is_binary_snapshot(filename):
+    """Whether the snapshot at filename uses the binary format, judged by its name."""
+    return isinstance(filename, (str, os.PathLike)) and os.fspath(filename).endswith(BINARY_SUFFIX)
+
+# Open mappings of binary snapshots by absolute path, dropped as their habits are freed
+_MAPPINGS = {}
+
+def _release_mappings(filename, habits):
+    """Close the mappings of filename before the file is replaced, which Windows refuses while it is mapped.
+
+    The histories habits share with a mapping are copied first. A mapping
+    that habits outside of habits still view stays open.
+    """
+    mappings = _MAPPINGS.get(os.path.abspath(filename))
+    if not mappings:
+        return
+    for habit in habits:
+        habit.detach_timestamps()
+    for mapped in list(mappings):
+        try:
+            mapped.close()
+        except BufferError:
+            continue
+        mappings.discard(mapped)
+
+def load_habits_from_binary(filename) -> HabitStore:
+    """Load habits from a binary snapshot through mmap.
+
+    The file holds a fixed header, a JSON table of habit fields with the
+    position of each history, and one column of packed little-endian int64
+    timestamps. Each habit's history is a slice of the mapped column, so no
+    completion is parsed or copied until a habit changes. The mapping stays
+    open while any history views it; saving to the same file copies the
+    histories of the saved habits and closes it (see _release_mappings).
+    """
+    import mmap
+    import weakref
+
+    habits = HabitStore()
+    try:
+        with phase('load'):
+            with open(filename, 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count, table_offset, table_size, column_offset = BINARY_HEADER.unpack_from(mapped)
+            if magic != BINARY_MAGIC or version != BINARY_VERSION:
+                raise ValueError(f"not a version {BINARY_VERSION} binary habit snapshot")
+            if sys.byteorder == 'little':
+                column = memoryview(mapped)[column_offset:].cast('q')
+                _MAPPINGS.setdefault(os.path.abspath(filename), weakref.WeakSet()).add(mapped)
+            else:
+                column = array('q', mapped[column_offset:])
+                column.byteswap()
+        with phase('parse'):
+            table = json.loads(mapped[table_offset:table_offset + table_size])
+            if sys.byteorder != 'little':
+                mapped.close()
+        with phase('build'):
+            for habit_data, (start, length) in zip(table['habits'], table['spans']):
+                habit = Habit.from_dict(habit_data)
+                habit.share_timestamps(column[start:start + length])
+                habits.append(habit)
+        if len(habits) != count:
+            raise ValueError(f"expected {count} habits, found {len(habits)}")
+    except FileNotFoundError:
+        _snapshot_not_found(filename)
+    except Exception as e:
+        log_error(f"An error occurred while loading habits from file '{filename}': {e}")
+    return habits
+
+def save_habits_to_binary(habits, filename):
+    """Write habits as a binary snapshot (see load_habits_from_binary), replacing the file atomically."""
+    with phase('serialize'):
+        headers, spans, columns, position = [], [], [], 0
+        for habit in habits:
+            timestamps = habit.timestamps
+            headers.append(habit.to_dict(history=False))
+            spans.append((position, len(timestamps)))
+            position += len(timestamps)
+            if sys.byteorder != 'little':
+                timestamps = array('q', timestamps)
+                timestamps.byteswap()
+            columns.append(timestamps)
+        table = json.dumps({'habits': headers, 'spans': spans}, separators=(',', ':')).encode()
+        table_offset = BINARY_HEADER.size
+        # Align the column so it can be viewed as int64 in place
+        column_offset = -(-(table_offset + len(table)) // 8) * 8
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(headers), table_offset, len(table), column_offset)
+        data = b''.join([header, table, bytes(column_offset - table_offset - len(table))] + [bytes(timestamps) for timestamps in columns])
+    with phase('write'), FileLock(lock_path(filename)):
+        before = version_if_cached(filename)
+        _release_mappings(filename, habits)
+        atomic_write(filename, data)
+        clear_journal(filename)
+        invalidate_analytics_cache(filename, before, habits=habits)
+
+def convert_snapshot(source, destination):
+    """Copy the habits of one snapshot file into another, each in the format its name selects.
+
+    The source's journal is applied first. A destination that does not
+    share the source's archive gets the archived completions back in its
+    histories. Returns the number of habits.
+    """
+    from archive import archive_dir, fold_archives
+
+    habits = load_habits_from_file(source, lazy=True)
+    if os.path.abspath(archive_dir(source)) != os.path.abspath(archive_dir(destination)):
+        fold_archives(habits)
+    save_habits_to_file(habits, destination)
+    return len(habits)
+
+def journal_path(filename):
+    return os.fspath(filename) + JOURNAL_SUFFIX
+
+def journal_record(op, habit, **fields):
+    """Build the compact journal record describing a change to a habit."""
+    record = {'op': op, 'task': habit.task}
+    if op == 'add':
+        record['habit'] = habit.to_dict()
+    elif op == 'complete':
+        record['datetime'] = habit.completed_at
+        record['current_streak'] = habit.current_streak
+        record['highest_streak'] = habit.highest_streak
+    record.update(fields)
+    return record
+
+def append_to_journal(filename, *records, sync=True):
+    """Append change records to the journal next to a habits file in a single write.
+
+    The cost of an append does not depend on how many habits or completions
+    the snapshot holds. Returns the journal position after the records, or
+    None if they could not be written. With sync=False the caller makes them
+    durable later with sync_journal, ideally after releasing the store lock.
+    """
+    try:
+        with phase('serialize'):
+            text = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        with phase('write'):
+            with FileLock(lock_path(filename)):
+                before = version_if_cached(filename)
+                with open(journal_path(filename), 'a') as file:
+                    file.write(text)
+                    file.flush()
+                    position = (os.fstat(file.fileno()).st_ino, file.tell())
+                tasks = {record[field] for record in records for field in ('task', 'new_task') if field in record}
+                invalidate_analytics_cache(filename, before, tasks)
     except Exception as e:
-        logging.error(f"Error saving habits to file '{file_path_or_obj}': {e}")
+        log_error(f"Error appending to journal of '{filename}': {e}")
+        return None
+    if sync:
+        sync_journal(filename, position)
+    return position
+
+def sync_journal(filename, position):
+    """Flush the journal to disk up to position, sharing one fsync between concurrent writers.
+
+    This is a group commit: writers queue on the sync lock, and the first
+    one flushes everything appended so far and records how far it got, so
+    the writers behind it find their records already durable. Returns True
+    if this call flushed the journal.
+    """
+    inode, offset = position
+    with phase('write'), FileLock(journal_path(filename) + SYNC_SUFFIX) as lock:
+        synced = lock.read().split()
+        if synced and int(synced[0]) == inode and int(synced[1]) >= offset:
+            return False
+        try:
+            descriptor = os.open(journal_path(filename), os.O_RDWR)
+        except FileNotFoundError:
+            # compacted into a snapshot, which atomic_write already flushed
+            return False
+        try:
+            status = os.fstat(descriptor)
+            if status.st_ino != inode:
+                return False
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+        lock.write(f"{inode} {status.st_size}")
+    return True
+
+def apply_journal_record(habits, record):
+    op = record['op']
+    if op == 'add':
+        if find_habit(habits, record['task']) is None:
+            habits.append(Habit.from_dict(record['habit']))
+    elif op == 'delete':
+        delete_habit(habits, record['task'])
+    elif op == 'rename':
+        rename_habit(habits, record['task'], record['new_task'])
+    elif op == 'complete':
+        habit = find_habit(habits, record['task'])
+        if habit is None:
+            return
+        habit.last_completed = record['datetime']
+        habit.completed_at = record['datetime']
+        habit.completed_today = True
+        habit.current_streak = record['current_streak']
+        habit.highest_streak = record['highest_streak']
+        habit.add_completion(record['datetime'])
+    else:
+        raise ValueError(f"unknown journal operation '{op}'")
+
+def replay_journal(habits, filename):
+    """Apply the journal of a habits file on top of the loaded snapshot."""
+    if not isinstance(filename, (str, bytes, os.PathLike)):
+        return habits
+    try:
+        with phase('journal'), open(journal_path(filename), 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    apply_journal_record(habits, json.loads(line))
+                except (ValueError, KeyError) as e:
+                    log_error(f"Skipping journal record {line_number} of '{filename}': {e}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_error(f"An error occurred while replaying the journal of '{filename}': {e}")
+    return habits
+
+def journal_size(filename):
+    try:
+        return os.path.getsize(journal_path(filename))
+    except OSError:
+        return 0
+
+def clear_journal(filename):
+    with FileLock(journal_path(filename) + SYNC_SUFFIX) as lock:
+        try:
+            os.remove(journal_path(filename))
+        except FileNotFoundError:
+            pass
+        lock.write('')
+
+def compact_journal(filename, threshold=JOURNAL_COMPACT_THRESHOLD):
+    """Fold the journal into the snapshot once it has grown past threshold bytes.
+
+    Returns True if the snapshot was rewritten.
+    """
+    with FileLock(lock_path(filename)):
+        if journal_size(filename) == 0 or journal_size(filename) < threshold:
+            return False
+        habits = load_habits_from_file(filename)
+        save_habits_to_file(habits, filename)
+    return True
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS habits (
+    task TEXT PRIMARY KEY,
+    periodicity TEXT NOT NULL,
+    current_streak INTEGER NOT NULL,
+    last_completed TEXT NOT NULL,
+    completed_today INTEGER NOT NULL,
+    completed_at TEXT NOT NULL,
+    highest_streak INTEGER NOT NULL,
+    creation_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS completion_history (
+    task TEXT NOT NULL REFERENCES habits(task) ON DELETE CASCADE ON UPDATE CASCADE,
+    datetime TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completion_history_task_datetime ON completion_history (task, datetime);
+CREATE TABLE IF NOT EXISTS completion_rollups (
+    task TEXT NOT NULL REFERENCES habits(task) ON DELETE CASCADE ON UPDATE CASCADE,
+    period TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (task, period, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS habits_periodicity ON habits (periodicity);
+"""
+
+HABIT_COLUMNS = ('task', 'periodicity', 'current_streak', 'last_completed', 'completed_today', 'completed_at', 'highest_streak', 'creation_date')
+
+def connect_sqlite(path):
+    """Open a habits database, creating the schema if needed."""
+    import sqlite3
+
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    has_rollups = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'completion_rollups'").fetchone()
+    connection.executescript(SQLITE_SCHEMA)
+    if not has_rollups:
+        _backfill_rollups(connection)
+    return connection
+
+def _backfill_rollups(connection):
+    """Fill the rollup table of a database created before it existed."""
+    histories = {}
+    for task, completed in connection.execute('SELECT task, datetime FROM completion_history'):
+        histories.setdefault(task, []).append({'datetime': completed})
+    with connection:
+        for task, completion_history in histories.items():
+            connection.executemany('INSERT INTO completion_rollups VALUES (?, ?, ?, ?)',
+                                   ((task, *row) for row in CompletionRollups.from_timestamps(history_to_timestamps(completion_history)).rows()))
+
+def _habit_from_row(row, completion_history):
+    habit_data = dict(zip(HABIT_COLUMNS, row))
+    habit_data['completed_today'] = bool(habit_data['completed_today'])
+    habit_data['completion_history'] = completion_history
+    return Habit.from_dict(habit_data)
+
+def _habit_row(habit):
+    return (habit.task, habit.periodicity, habit.current_streak, habit.last_completed,
+            int(bool(habit.completed_today)), habit.completed_at, habit.highest_streak, habit.creation_date)
+
+def load_habits_from_sqlite(path, lazy=False) -> HabitStore:
+    """Load every habit and its completion history from a SQLite database.
+
+    With lazy=True only the habits table is read; each history is queried
+    the first time it is accessed.
+    """
+    habits = HabitStore()
+    try:
+        connection = connect_sqlite(path)
+        try:
+            histories = {}
+            with phase('load'):
+                rows = connection.execute(f"SELECT {', '.join(HABIT_COLUMNS)} FROM habits ORDER BY rowid").fetchall()
+            if not lazy:
+                with phase('load'):
+                    for task, completed in connection.execute('SELECT task, datetime FROM completion_history ORDER BY task, datetime'):
+                        histories.setdefault(task, []).append({'datetime': completed})
+            for row in rows:
+                habit = _habit_from_row(row, histories.get(row[0], []))
+                if lazy:
+                    habit.defer_history(partial(_load_history_from_sqlite, path, habit.task))
+                habits.append(habit)
+        finally:
+            connection.close()
+    except Exception as e:
+        log_error(f"An error occurred while loading habits from database '{path}': {e}")
+    return habits
+
+def _query_history(connection, task):
+    return [{'datetime': completed} for (completed,) in connection.execute(
+        'SELECT datetime FROM completion_history WHERE task = ? ORDER BY datetime', (task,))]
+
+def _load_history_from_sqlite(path, task):
+    connection = connect_sqlite(path)
+    try:
+        with phase('load'):
+            return _query_history(connection, task)
+    finally:
+        connection.close()
+
+def load_habit_from_sqlite(path, task):
+    """Load a single habit with its history, reading only that habit's rows."""
+    task = task.strip().lower()
+    try:
+        connection = connect_sqlite(path)
+        try:
+            row = connection.execute(f"SELECT {', '.join(HABIT_COLUMNS)} FROM habits WHERE task = ?", (task,)).fetchone()
+            if row is None:
+                return None
+            return _habit_from_row(row, _query_history(connection, task))
+        finally:
+            connection.close()
+    except Exception as e:
+        log_error(f"An error occurred while loading habit '{task}' from database '{path}': {e}")
+        return None
+
+def save_habits_to_sqlite(habits, path):
+    """Replace the contents of a SQLite database with the given habits."""
+    try:
+        connection = connect_sqlite(path)
+        try:
+            with phase('write'), connection:
+                connection.execute('DELETE FROM completion_history')
+                connection.execute('DELETE FROM habits')
+                connection.executemany(f"INSERT INTO habits VALUES ({', '.join('?' * len(HABIT_COLUMNS))})",
+                                       (_habit_row(habit) for habit in habits))
+                connection.executemany('INSERT INTO completion_history (task, datetime) VALUES (?, ?)',
+                                       ((habit.task, from_timestamp(timestamp)) for habit in habits for timestamp in habit.timestamps))
+                connection.executemany('INSERT INTO completion_rollups VALUES (?, ?, ?, ?)',
+                                       ((habit.task, *row) for habit in habits for row in habit.rollups.rows()))
+        finally:
+            connection.close()
+    except Exception as e:
+        log_error(f"Error saving habits to database '{path}': {e}")
+
+def write_change_to_sqlite(path, *records):
+    """Apply journal records to a SQLite database in one transaction, touching only the affected rows."""
+    try:
+        connection = connect_sqlite(path)
+        try:
+            with phase('write'), connection:
+                for record in records:
+                    _write_record(connection, record)
+        finally:
+            connection.close()
+    except Exception as e:
+        log_error(f"Error writing change to database '{path}': {e}")
+
+def _write_record(connection, record):
+    op = record['op']
+    if op == 'add':
+        habit = Habit.from_dict(record['habit'])
+        connection.execute(f"INSERT OR IGNORE INTO habits VALUES ({', '.join('?' * len(HABIT_COLUMNS))})", _habit_row(habit))
+    elif op == 'delete':
+        connection.execute('DELETE FROM habits WHERE task = ?', (record['task'],))
+    elif op == 'rename':
+        connection.execute('UPDATE habits SET task = ? WHERE task = ?', (record['new_task'], record['task']))
+    elif op == 'complete':
+        connection.execute(
+            'UPDATE habits SET last_completed = ?, completed_at = ?, completed_today = 1, current_streak = ?, highest_streak = ? WHERE task = ?',
+            (record['datetime'], record['datetime'], record['current_streak'], record['highest_streak'], record['task']))
+        connection.execute('INSERT INTO completion_history (task, datetime) VALUES (?, ?)', (record['task'], record['datetime']))
+        day = day_of_timestamp(to_timestamp(record['datetime']))
+        connection.executemany('INSERT INTO completion_rollups VALUES (?, ?, ?, 1) ON CONFLICT (task, period, key) DO UPDATE SET count = count + 1',
+                               ((record['task'], period, period_key(period, day)) for period in PERIODS))
+    else:
+        raise ValueError(f"unknown journal operation '{op}'")
+
+def load_rollups_from_sqlite(path, task, period, keys):
+    """Read the completion counts of task for the periods keys from the rollup table.
+
+    Returns None if the habit does not exist. Only the rows inside the
+    window are read.
+    """
+    task = task.strip().lower()
+    try:
+        connection = connect_sqlite(path)
+        try:
+            with phase('load'):
+                if connection.execute('SELECT 1 FROM habits WHERE task = ?', (task,)).fetchone() is None:
+                    return None
+                counts = dict(connection.execute('SELECT key, count FROM completion_rollups WHERE task = ? AND period = ? AND key BETWEEN ? AND ?',
+                                                 (task, period, min(keys), max(keys))))
+        finally:
+            connection.close()
+    except Exception as e:
+        log_error(f"An error occurred while loading rollups from database '{path}': {e}")
+        return None
+    return [counts.get(key, 0) for key in keys]
+
+def migrate_json_to_sqlite(json_path, sqlite_path):
+    """Copy every habit from a JSON file (including its journal and archive) into a SQLite database."""
+    from archive import fold_archives
+
+    habits = fold_archives(load_habits_from_file(json_path))
+    save_habits_to_sqlite(habits, sqlite_path)
+    return len(habits)
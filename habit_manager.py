@@ -1,30 +1,233 @@
+import sys
+from array import array
+from bisect import bisect_left, insort
 from datetime import datetime, timedelta
+from profiling import phase
+from rollups import CompletionRollups, period_start, period_end, day_start
+
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+def to_timestamp(value):
+    """Convert a 'YYYY-mm-dd HH:MM:SS' string to whole seconds since the epoch, ignoring time zones."""
+    return (datetime.fromisoformat(value) - EPOCH) // ONE_SECOND
+
+def datetime_to_timestamp(moment):
+    """Convert a naive datetime to whole seconds since the epoch."""
+    return (moment - EPOCH) // ONE_SECOND
+
+def from_timestamp(timestamp):
+    """Convert seconds since the epoch back to a 'YYYY-mm-dd HH:MM:SS' string."""
+    return (EPOCH + timedelta(seconds=timestamp)).isoformat(' ')
+
+def history_to_timestamps(completion_history):
+    """Convert a list of {'datetime': ...} completions to a sorted array of timestamps, skipping invalid entries."""
+    try:
+        timestamps = [to_timestamp(completion['datetime']) for completion in completion_history]
+    except (KeyError, TypeError, ValueError):
+        timestamps = []
+        for completion in completion_history:
+            try:
+                timestamps.append(to_timestamp(completion['datetime']))
+            except (KeyError, TypeError, ValueError):
+                continue
+    timestamps.sort()
+    return array('q', timestamps)
 
 class Habit:
-    def __init__(self, task, periodicity, current_streak, last_completed, completed_today, completed_at, highest_streak, creation_date, completion_history=None):
+    __slots__ = ('task', 'periodicity', '_current_streak', '_last_completed', '_last_completed_at', 'completed_today', 'completed_at',
+                 '_highest_streak', 'creation_date', '_timestamps', '_history_loader', '_rollups', '_leaderboard', 'archive', '_archive_loader')
+
+    def __init__(self, task, periodicity, current_streak, last_completed, completed_today, completed_at, highest_streak, creation_date, completion_history=None,
+                 archive=None):
         self.task = task.strip().lower()
-        self.periodicity = periodicity.strip().lower()
-        self.current_streak = int(current_streak)
+        self.periodicity = sys.intern(periodicity.strip().lower())
+        self._leaderboard = None
+        self._current_streak = int(current_streak)
         self.last_completed = last_completed
         self.completed_today = completed_today
         self.completed_at = completed_at
-        self.highest_streak = highest_streak
+        self._highest_streak = highest_streak
         self.creation_date = creation_date
-        self.completion_history = completion_history if completion_history is not None else []
+        self._history_loader = None
+        self.completion_history = completion_history
+        # {'key': ..., 'before': 'YYYY-mm-dd HH:MM:SS', 'counts': {year: count}} once completions were archived
+        self.archive = archive
+        self._archive_loader = None
+
+    @property
+    def current_streak(self):
+        return self._current_streak
+
+    @current_streak.setter
+    def current_streak(self, current_streak):
+        self._current_streak = current_streak
+        if self._leaderboard is not None:
+            self._leaderboard.update(self)
+
+    @property
+    def highest_streak(self):
+        return self._highest_streak
+
+    @highest_streak.setter
+    def highest_streak(self, highest_streak):
+        self._highest_streak = highest_streak
+        if self._leaderboard is not None:
+            self._leaderboard.update(self)
+
+    @property
+    def last_completed(self):
+        return self._last_completed
+
+    @last_completed.setter
+    def last_completed(self, last_completed):
+        self._last_completed = last_completed
+        self._last_completed_at = None
+
+    @property
+    def last_completed_at(self):
+        """last_completed as a datetime, parsed once and cached. None if never completed."""
+        if self._last_completed_at is None and self._last_completed != "NA":
+            self._last_completed_at = datetime.fromisoformat(self._last_completed)
+        return self._last_completed_at
+
+    @property
+    def timestamps(self):
+        """Sorted array of completion times in seconds since the epoch."""
+        if self._history_loader is not None:
+            loader, self._history_loader = self._history_loader, None
+            completion_history = loader()
+            with phase('build'):
+                self._timestamps = history_to_timestamps(completion_history)
+        return self._timestamps
+
+    @property
+    def rollups(self):
+        """Completion counts per day, ISO week and month, built on first use and kept up to date by add_completion."""
+        if self._rollups is None:
+            self._rollups = CompletionRollups.from_timestamps(self.timestamps)
+        return self._rollups
+
+    @property
+    def completion_history(self):
+        """The completions as a new list of {'datetime': ...} dicts, oldest first."""
+        return [{'datetime': from_timestamp(timestamp)} for timestamp in self.timestamps]
+
+    @completion_history.setter
+    def completion_history(self, completion_history):
+        self._history_loader = None
+        self._rollups = None
+        self._timestamps = history_to_timestamps(completion_history or [])
+
+    @property
+    def history_loader(self):
+        """The callable that loads the completion history on first use, or None once it is loaded."""
+        return self._history_loader
+
+    def defer_history(self, loader):
+        """Load the completion history by calling loader the first time it is needed."""
+        self._history_loader = loader
+        self._rollups = None
+
+    def share_timestamps(self, timestamps):
+        """Use a sorted buffer of int64 timestamps, such as a slice of a memory-mapped snapshot, as the history.
+
+        The buffer is not copied until the history changes.
+        """
+        self._history_loader = None
+        self._rollups = None
+        self._timestamps = timestamps
+
+    def defer_archive(self, loader):
+        """Read archived completions by calling loader(years), which returns their sorted timestamps, when a query reaches them."""
+        self._archive_loader = loader
+
+    @property
+    def completion_count(self):
+        """The number of completions, archived ones included."""
+        archived = sum(self.archive['counts'].values()) if self.archive else 0
+        return len(self.timestamps) + archived
+
+    def completion_timestamps(self, since=None, until=None):
+        """Sorted timestamps of the completions, including the archived ones the range [since, until) reaches.
+
+        since and until are timestamps or None for no bound. The result may
+        hold completions outside the range; archived years are only read
+        when the range starts before the archive boundary.
+        """
+        timestamps = self.timestamps
+        if not self.archive or self._archive_loader is None:
+            return timestamps
+        before = to_timestamp(self.archive['before'])
+        if since is not None and since >= before:
+            return timestamps
+        years = [int(year) for year in self.archive['counts']
+                 if (since is None or since < to_timestamp(f"{int(year) + 1}-01-01 00:00:00"))
+                 and (until is None or until > to_timestamp(f"{year}-01-01 00:00:00"))]
+        if not years:
+            return timestamps
+        archived = self._archive_loader(sorted(years))
+        # the archive only holds completions before its boundary, the history the ones after it
+        archived = archived[:bisect_left(archived, before)]
+        if len(timestamps) and timestamps[0] < before:
+            # older completions merged into the history before they were routed to the archive
+            return array('q', sorted(set(archived).union(timestamps)))
+        return archived + array('q', timestamps)
+
+    def period_counts(self, period, keys):
+        """The number of completions in each period of keys, ascending, reading archived years only for periods before the boundary."""
+        counts = self.rollups.counts(period, keys)
+        if not keys or not self.archive or self._archive_loader is None:
+            return counts
+        since = day_start(period_start(period, keys[0]))
+        before = to_timestamp(self.archive['before'])
+        if since >= before:
+            return counts
+        until = min(before, day_start(period_end(period, keys[-1])))
+        timestamps = self.completion_timestamps(since, until)
+        archived = CompletionRollups.from_timestamps(timestamps[bisect_left(timestamps, since):bisect_left(timestamps, until)])
+        return [count + extra for count, extra in zip(counts, archived.counts(period, keys))]
+
+    def detach_timestamps(self):
+        """Copy a shared history buffer (see share_timestamps) into an array of the habit's own."""
+        if not isinstance(self.timestamps, array):
+            copy = array('q')
+            copy.frombytes(memoryview(self._timestamps).cast('B'))
+            self._timestamps = copy
+
+    def add_completion(self, completed_at):
+        """Record a completion at the 'YYYY-mm-dd HH:MM:SS' time completed_at, keeping the history sorted."""
+        timestamp = to_timestamp(completed_at)
+        self.detach_timestamps()
+        insort(self._timestamps, timestamp)
+        if self._rollups is not None:
+            self._rollups.add(timestamp)
+
+    def merge_completions(self, timestamps):
+        """Merge completion timestamps into the history, keeping it sorted and free of duplicates.
 
-    def get_streak(self):
+        Returns how many of them were new.
+        """
+        existing = set(self.timestamps)
+        merged = existing.union(timestamps)
+        self._timestamps = array('q', sorted(merged))
+        self._rollups = None
+        return len(merged) - len(existing)
+
+    def get_streak(self, now=None):
         """Return the current streak, after checking if the streak is broken."""
-        check_if_streak_broken(self)
+        check_if_streak_broken(self, now)
         return self.current_streak
 
-    def mark_as_completed(self):
+    def mark_as_completed(self, now=None):
         """Mark the habit as completed for the day."""
-        now = datetime.now()
+        now = now or datetime.now()
 
         if self.completed_today:
             return 0 
 
         self.last_completed = now.strftime('%Y-%m-%d %H:%M:%S')
+        self._last_completed_at = now.replace(microsecond=0)
         self.completed_today = True
         self.completed_at = now.strftime('%Y-%m-%d %H:%M:%S')
         self.current_streak += 1
@@ -32,11 +235,11 @@ class Habit:
         if self.current_streak > self.highest_streak:
             self.highest_streak = self.current_streak
 
-        self.completion_history.append({'datetime': self.completed_at})
+        self.add_completion(self.completed_at)
         return 1 
 
-    def to_dict(self):
-        return {
+    def to_dict(self, history=True):
+        habit_data = {
             'task': self.task,
             'periodicity': self.periodicity,
             'current_streak': self.current_streak,
@@ -45,17 +248,112 @@ class Habit:
             'completed_at': self.completed_at,
             'highest_streak': self.highest_streak,
             'creation_date': self.creation_date,
-            'completion_history': self.completion_history,
         }
+        if history:
+            habit_data['completion_history'] = self.completion_history
+        if self.archive:
+            habit_data['archive'] = self.archive
+        return habit_data
+
+    @classmethod
+    def from_dict(cls, habit_data):
+        return cls(
+            task=habit_data['task'],
+            periodicity=habit_data['periodicity'],
+            current_streak=habit_data['current_streak'],
+            last_completed=habit_data['last_completed'],
+            completed_today=habit_data['completed_today'],
+            completed_at=habit_data['completed_at'],
+            highest_streak=habit_data['highest_streak'],
+            creation_date=habit_data['creation_date'],
+            completion_history=habit_data.get('completion_history', []),
+            archive=habit_data.get('archive')
+        )
+
+class HabitStore:
+    """A collection of habits indexed by task name and by periodicity."""
+
+    def __init__(self, habits=None):
+        self._habits = {}
+        self._by_periodicity = {}
+        self._leaderboard = None
+        for habit in habits or []:
+            self.append(habit)
+
+    def __iter__(self):
+        return iter(self._habits.values())
+
+    def __len__(self):
+        return len(self._habits)
+
+    def __getitem__(self, index):
+        return list(self._habits.values())[index]
+
+    def __contains__(self, task):
+        return task.strip().lower() in self._habits
+
+    def __eq__(self, other):
+        if isinstance(other, (HabitStore, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def get(self, task):
+        return self._habits.get(task.strip().lower())
+
+    def append(self, habit):
+        """Add a habit, replacing any habit with the same task name."""
+        existing = self._habits.get(habit.task)
+        if existing is not None:
+            self.remove(existing)
+        self._habits[habit.task] = habit
+        self._by_periodicity.setdefault(habit.periodicity, {})[habit.task] = habit
+        if self._leaderboard is not None:
+            self._leaderboard.add(habit)
+
+    def remove(self, habit):
+        del self._habits[habit.task]
+        if self._leaderboard is not None:
+            self._leaderboard.discard(habit)
+        bucket = self._by_periodicity.get(habit.periodicity, {})
+        bucket.pop(habit.task, None)
+        if not bucket:
+            self._by_periodicity.pop(habit.periodicity, None)
+
+    def rename(self, task, new_task):
+        """Rename a habit and move it to its new key in both indexes. Returns None if it is missing or new_task is blank."""
+        habit = self.get(task)
+        if habit is None or not new_task.strip():
+            return None
+        self.remove(habit)
+        habit.task = new_task.strip().lower()
+        self.append(habit)
+        return habit
+
+    def by_periodicity(self, periodicity):
+        return list(self._by_periodicity.get(periodicity.strip().lower(), {}).values())
 
-def check_if_streak_broken(habit):
-    """Check if the streak is broken based on the periodicity and last completed date."""
-    now = datetime.now()
+    @property
+    def leaderboard(self):
+        """A leaderboard.StreakLeaderboard of the habits, built on first use and kept up to date as they change.
 
-    if habit.last_completed == "NA":
+        A habit is ranked by the leaderboard of at most one store.
+        """
+        if self._leaderboard is None:
+            from leaderboard import StreakLeaderboard
+
+            self._leaderboard = StreakLeaderboard(self)
+        return self._leaderboard
+
+def check_if_streak_broken(habit, now=None):
+    """Check if the streak is broken based on the periodicity and last completed date.
+
+    Pass now to evaluate many habits against the same clock reading.
+    """
+    last_completed_date = habit.last_completed_at
+    if last_completed_date is None:
         return False
 
-    last_completed_date = datetime.strptime(habit.last_completed, '%Y-%m-%d %H:%M:%S')
+    now = now or datetime.now()
 
     if habit.periodicity == "daily":
         if (now - last_completed_date).days > 1:
@@ -69,7 +367,34 @@ def check_if_streak_broken(habit):
 
     return False
 
+def streak_deadline(habit):
+    """The moment, in seconds since the epoch, from which check_if_streak_broken resets the current streak.
+
+    None if the streak cannot break: it is 0, the habit was never completed
+    or its periodicity has no break rule.
+    """
+    last_completed_date = habit.last_completed_at
+    if last_completed_date is None or not habit.current_streak:
+        return None
+    if habit.periodicity == "daily":
+        days = 2
+    elif habit.periodicity == "weekly":
+        days = 8
+    else:
+        return None
+    return datetime_to_timestamp(last_completed_date) + days * 86400
+
+def refresh_streaks(habits, now=None):
+    """Reset the broken streaks of all habits in one sweep against a single clock reading."""
+    now = now or datetime.now()
+    with phase('streaks'):
+        for habit in habits:
+            check_if_streak_broken(habit, now)
+    return now
+
 def find_habit(habits, task):
+    if isinstance(habits, HabitStore):
+        return habits.get(task)
     task = task.strip().lower()
     for habit in habits:
         if habit.task == task:
@@ -99,17 +424,30 @@ def delete_habit(habits, task):
     if habit:
         habits.remove(habit)
 
-def mark_habit_as_completed(habits, task):
+def rename_habit(habits, task, new_task):
+    """Rename a habit. Returns False if the task is missing or the new name is blank or taken."""
+    if not new_task.strip():
+        return False
+    if find_habit(habits, task) is None or find_habit(habits, new_task) is not None:
+        return False
+    if isinstance(habits, HabitStore):
+        habits.rename(task, new_task)
+    else:
+        find_habit(habits, task).task = new_task.strip().lower()
+    return True
+
+def mark_habit_as_completed(habits, task, now=None):
     habit = find_habit(habits, task)
     if habit is None:
         return None
 
-    streak_broken = check_if_streak_broken(habit)
+    now = now or datetime.now()
+    streak_broken = check_if_streak_broken(habit, now)
 
     if habit.completed_today:
         return False 
 
-    habit.mark_as_completed()
+    habit.mark_as_completed(now)
 
     if streak_broken:
         habit.current_streak = 1 
@@ -117,15 +455,13 @@ def mark_habit_as_completed(habits, task):
     
     return True  
 
-def is_completed_today(habit):
+def is_completed_today(habit, now=None):
     """Check if the habit was completed today."""
     if habit.completed_today:
         return True
     
-    today = datetime.now().strftime('%Y-%m-%d')
-    last_completed = habit.last_completed[:10]
-    
-    return today == last_completed
+    last_completed = habit.last_completed_at
+    return last_completed is not None and last_completed.date() == (now or datetime.now()).date()
 
 
 
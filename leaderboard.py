@@ -0,0 +1,102 @@
+"""Habits ranked by streak, kept sorted as their streaks change.
+
+A StreakLeaderboard holds one sorted list per streak kind ('current' or
+'highest') and scope (every habit, or one periodicity). Entries are
+(-streak, order, habit) tuples, where order is the position of the habit in
+its store, so ties rank like max() over the store would rank them. Habits
+report changes to their streaks (see Habit.current_streak), which move the
+changed entries with a bisect. Streaks that broke because time passed are
+only noticed when a query reaches them, so a top-k query costs O(k log n)
+plus one move per streak that broke since it was last looked at.
+"""
+from bisect import bisect_left
+from datetime import datetime
+from itertools import count
+from habit_manager import check_if_streak_broken
+
+KINDS = ('current', 'highest')
+
+def _streak(habit, kind):
+    return int(habit.current_streak if kind == 'current' else habit.highest_streak)
+
+class StreakLeaderboard:
+    """Every habit of a store, sorted by current and by highest streak."""
+
+    def __init__(self, habits=()):
+        self._order = count()
+        # habit -> (order, current streak, highest streak) it is filed under
+        self._keys = {}
+        self._entries = {kind: {None: []} for kind in KINDS}
+        for habit in habits:
+            order = next(self._order)
+            self._keys[habit] = (order, _streak(habit, 'current'), _streak(habit, 'highest'))
+            habit._leaderboard = self
+            for kind, streak in zip(KINDS, self._keys[habit][1:]):
+                for scope in (None, habit.periodicity):
+                    self._entries[kind].setdefault(scope, []).append((-streak, order, habit))
+        for scopes in self._entries.values():
+            for entries in scopes.values():
+                entries.sort(key=lambda entry: entry[:2])
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, habit):
+        order = next(self._order)
+        self._keys[habit] = (order, _streak(habit, 'current'), _streak(habit, 'highest'))
+        habit._leaderboard = self
+        self._file(habit)
+
+    def discard(self, habit):
+        if habit not in self._keys:
+            return
+        self._unfile(habit)
+        del self._keys[habit]
+        habit._leaderboard = None
+
+    def update(self, habit):
+        """Move habit to the place its current streaks rank at."""
+        order, current, highest = self._keys[habit]
+        if (current, highest) == (_streak(habit, 'current'), _streak(habit, 'highest')):
+            return
+        self._unfile(habit)
+        self._keys[habit] = (order, _streak(habit, 'current'), _streak(habit, 'highest'))
+        self._file(habit)
+
+    def _file(self, habit):
+        order, *streaks = self._keys[habit]
+        for kind, streak in zip(KINDS, streaks):
+            for scope in (None, habit.periodicity):
+                entries = self._entries[kind].setdefault(scope, [])
+                entries.insert(bisect_left(entries, (-streak, order)), (-streak, order, habit))
+
+    def _unfile(self, habit):
+        order, *streaks = self._keys[habit]
+        for kind, streak in zip(KINDS, streaks):
+            for scope in (None, habit.periodicity):
+                entries = self._entries[kind][scope]
+                del entries[bisect_left(entries, (-streak, order))]
+
+    def top(self, k, kind='current', periodicity=None, now=None):
+        """The k habits with the longest streaks of kind, optionally only those of one periodicity.
+
+        For current streaks, habits whose streak has broken by now are
+        reset on the way and drop to their new place.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"unknown streak kind '{kind}'")
+        scope = periodicity.strip().lower() if periodicity else None
+        entries = self._entries[kind].get(scope, [])
+        now = now or datetime.now()
+        ranked, index = [], 0
+        while len(ranked) < k and index < len(entries):
+            habit = entries[index][2]
+            if kind == 'current':
+                streak = self._keys[habit][1]
+                check_if_streak_broken(habit, now)
+                if self._keys[habit][1] != streak:
+                    # the reset moved habit further down, so index now holds the next entry
+                    continue
+            ranked.append(habit)
+            index += 1
+        return ranked
@@ -0,0 +1,132 @@
+"""Advisory file locks and crash-safe file replacement.
+
+Every process that reads or changes a store takes the lock file next to
+it: loads hold it shared, read-modify-write commands hold it exclusively,
+so a concurrent command can neither lose another's change nor see a
+snapshot without the journal that belongs to it.
+"""
+import os
+import sys
+from _thread import get_ident
+
+LOCK_SUFFIX = '.lock'
+
+if sys.platform == 'win32':
+    import msvcrt
+
+    def _lock(file, shared):
+        # msvcrt has no shared locks, so readers exclude each other too
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(file, shared):
+        fcntl.flock(file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def _unlock(file):
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+def lock_path(path):
+    """The lock file guarding the store at path."""
+    return os.fspath(path) + LOCK_SUFFIX
+
+class FileLock:
+    """Hold an advisory lock on path for the duration of a with block.
+
+    The lock is reentrant within a thread: a nested FileLock on the same
+    path keeps the mode of the outermost one. A shared lock that cannot
+    create its lock file, e.g. in a read-only directory, is skipped so
+    reading still works.
+    """
+    _held = {}
+
+    def __init__(self, path, shared=False):
+        self.path = os.fspath(path)
+        self.shared = shared
+        self.file = None
+        self._key = (get_ident(), os.path.abspath(self.path))
+
+    def __enter__(self):
+        held = FileLock._held.get(self._key)
+        if held is not None:
+            held[1] += 1
+            self.file = held[0]
+            return self
+        try:
+            file = open(self.path, 'a+')
+        except OSError:
+            if not self.shared:
+                raise
+            return self
+        try:
+            _lock(file, self.shared)
+        except BaseException:
+            file.close()
+            raise
+        FileLock._held[self._key] = [file, 1]
+        self.file = file
+        return self
+
+    def __exit__(self, *exc_info):
+        held = FileLock._held.get(self._key)
+        if held is None:
+            return False
+        held[1] -= 1
+        if not held[1]:
+            del FileLock._held[self._key]
+            _unlock(held[0])
+            held[0].close()
+        return False
+
+    def read(self):
+        """The text stored in the lock file."""
+        self.file.seek(0)
+        return self.file.read()
+
+    def write(self, text):
+        """Replace the text stored in the lock file."""
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(text)
+        self.file.flush()
+
+def atomic_write(path, text):
+    """Replace the file at path with text so readers and crashes see the old or the new file, never a mix.
+
+    text may be str or bytes. It goes to a temporary file in the same
+    directory, which is flushed to disk and then renamed over path.
+    """
+    path = os.fspath(path)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary, 'wb' if isinstance(text, bytes) else 'w') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        try:
+            os.chmod(temporary, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+    _sync_directory(os.path.dirname(os.path.abspath(path)))
+
+def _sync_directory(directory):
+    """Make a rename in directory durable; not possible, nor needed, on Windows."""
+    if sys.platform == 'win32':
+        return
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
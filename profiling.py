@@ -0,0 +1,105 @@
+"""Phase timing for the --profile option of the cli.
+
+Code marks expensive sections with `with phase('parse'):`. While profiling
+is off, phase() returns a shared no-op context manager, so a marked section
+costs one function call. While it is on, each phase collects its own time,
+excluding nested phases, so the phases add up to the command's total.
+"""
+import time
+
+ENABLED = False
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_PHASE = _NoPhase()
+
+class ProfileSession:
+    def __init__(self, dump_path=None):
+        self.dump_path = dump_path
+        self.timings = {}
+        self.stack = []
+        self.started = time.perf_counter()
+        self.total = None
+        self.profiler = None
+        if dump_path:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add(self, name, seconds):
+        entry = self.timings.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.dump_path)
+        self.total = time.perf_counter() - self.started
+
+    def metrics(self):
+        """Seconds and call counts per phase, with the unmarked remainder as 'command logic'."""
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        phases = {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in self.timings.items()}
+        phases['command logic'] = {'seconds': max(total - sum(seconds for seconds, _ in self.timings.values()), 0.0), 'calls': 1}
+        return {'total_seconds': total, 'phases': phases}
+
+class _Phase:
+    __slots__ = ('session', 'name', 'started', 'nested')
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.session.stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        stack = self.session.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        self.session.add(self.name, elapsed - self.nested)
+        return False
+
+_session = None
+
+def phase(name):
+    """Context manager timing the enclosed block as phase name while profiling is on."""
+    if not ENABLED:
+        return _NO_PHASE
+    return _Phase(_session, name)
+
+def start(dump_path=None):
+    """Turn profiling on, optionally recording a cProfile dump to dump_path."""
+    global ENABLED, _session
+    _session = ProfileSession(dump_path)
+    ENABLED = True
+    return _session
+
+def stop():
+    """Turn profiling off and return the finished session."""
+    global ENABLED, _session
+    session, _session = _session, None
+    ENABLED = False
+    if session is not None:
+        session.stop()
+    return session
+
+def format_metrics(metrics):
+    lines = [f"Profile: {metrics['total_seconds'] * 1000:.2f} ms total"]
+    for name, entry in sorted(metrics['phases'].items(), key=lambda item: item[1]['seconds'], reverse=True):
+        share = entry['seconds'] / metrics['total_seconds'] if metrics['total_seconds'] else 0.0
+        lines.append(f"  {name:<15} {entry['seconds'] * 1000:>10.2f} ms {share:>6.1%}  ({entry['calls']} calls)")
+    return "\n".join(lines)
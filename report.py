@@ -0,0 +1,102 @@
+"""Every analytic for every habit, computed in chunks across a process pool.
+
+The habits are split into chunks of plain data: the fields the report needs
+and the completion history, either as the JSON text a lazy load has not
+parsed yet or as packed int64 timestamps. Workers rebuild light Habit
+objects from a chunk, so parsing the histories, evaluating streaks and the
+vectorized completion statistics all run in parallel.
+"""
+import json
+import os
+from itertools import repeat
+from habit_manager import Habit, history_to_timestamps, from_timestamp
+from profiling import phase
+
+# Chunks per worker, so a slow chunk does not leave the other workers idle
+CHUNKS_PER_WORKER = 4
+# Habits per chunk at least, about a quarter second of work: starting a worker
+# process costs more than reporting a few hundred habits in this one
+MIN_CHUNK_SIZE = 2000
+COLUMNS = ('task', 'periodicity', 'current_streak', 'highest_streak', 'completions', 'median_time', 'first_completed', 'last_completed')
+
+def pack_habit(habit):
+    """Describe habit as plain data that is cheap to send to another process."""
+    from data_manager import deferred_history_json
+
+    # archived completions travel with the others, as workers cannot read the archive
+    history = None if habit.archive else deferred_history_json(habit)
+    if history is None:
+        history = memoryview(habit.completion_timestamps()).cast('B').tobytes()
+    return habit.task, habit.periodicity, habit.current_streak, habit.highest_streak, habit.last_completed, history
+
+def unpack_habit(packed):
+    task, periodicity, current_streak, highest_streak, last_completed, history = packed
+    habit = Habit(task, periodicity, current_streak, last_completed, False, "NA", highest_streak, "NA")
+    if isinstance(history, str):
+        habit.share_timestamps(history_to_timestamps(json.loads(history)))
+    else:
+        habit.share_timestamps(memoryview(history).cast('q'))
+    return habit
+
+def report_habits(habits, now=None):
+    """One report row per habit: its streaks, completion count, median completion time and first and last completion."""
+    from completion_stats import compute_completion_stats, format_time_of_day
+
+    habits = list(habits)
+    stats = compute_completion_stats(habits, percentiles=())
+    rows = []
+    for habit in habits:
+        timestamps = habit.completion_timestamps()
+        median = stats[habit.task]['median']
+        rows.append({
+            'task': habit.task,
+            'periodicity': habit.periodicity,
+            'current_streak': habit.get_streak(now),
+            'highest_streak': int(habit.highest_streak),
+            'completions': len(timestamps),
+            'median_time': None if median is None else format_time_of_day(median),
+            'first_completed': from_timestamp(timestamps[0]) if len(timestamps) else None,
+            'last_completed': from_timestamp(timestamps[-1]) if len(timestamps) else None,
+        })
+    return rows
+
+def report_chunk(chunk, now=None):
+    """report_habits for a chunk of pack_habit results; runs in a worker process."""
+    return report_habits([unpack_habit(packed) for packed in chunk], now)
+
+def build_report(habits, now=None, workers=None):
+    """Report rows for every habit, in store order, computed by up to workers processes.
+
+    workers defaults to the number of CPUs. With one worker, or no more
+    than MIN_CHUNK_SIZE habits, everything runs in this process.
+    """
+    from datetime import datetime
+
+    habits = list(habits)
+    now = now or datetime.now()
+    workers = max(1, workers or os.cpu_count() or 1)
+    chunk_size = max(MIN_CHUNK_SIZE, -(-len(habits) // (workers * CHUNKS_PER_WORKER)))
+    if workers == 1 or len(habits) <= chunk_size:
+        with phase('analytics'):
+            return report_habits(habits, now)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with phase('serialize'):
+        chunks = [[pack_habit(habit) for habit in habits[start:start + chunk_size]] for start in range(0, len(habits), chunk_size)]
+    with phase('analytics'), ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        return [row for rows in pool.map(report_chunk, chunks, repeat(now)) for row in rows]
+
+def longest(rows, column):
+    """The row with the largest value in column, the first one on ties, or None without rows."""
+    return max(rows, key=lambda row: row[column], default=None)
+
+def format_table(rows):
+    """The report rows as an aligned text table."""
+    headers = ['Task', 'Periodicity', 'Current', 'Highest', 'Completions', 'Median', 'First Completed', 'Last Completed']
+    cells = [[str('-' if row[column] is None else row[column]) for column in COLUMNS] for row in rows]
+    widths = [max([len(header)] + [len(line[index]) for line in cells]) for index, header in enumerate(headers)]
+    lines = ['  '.join(header.ljust(width) for header, width in zip(headers, widths)).rstrip()]
+    for line in cells:
+        lines.append('  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip())
+    return '\n'.join(lines)
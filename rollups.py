@@ -0,0 +1,105 @@
+"""Completion counts per day, ISO week and month.
+
+Each period is identified by an integer key: the date ordinal of the day,
+the date ordinal of the week's Monday, or year * 12 + month - 1. Keys of
+consecutive periods differ by one (by seven for weeks), so a window of
+periods is a range of keys and reading it costs one lookup per period,
+however long the history is.
+"""
+from bisect import bisect_left
+from datetime import date
+
+PERIODS = ('day', 'week', 'month')
+SECONDS_PER_DAY = 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def day_of_timestamp(timestamp):
+    """The date ordinal of a timestamp in seconds since the epoch."""
+    return EPOCH_ORDINAL + timestamp // SECONDS_PER_DAY
+
+def period_key(period, day):
+    """The key of the period containing the date ordinal day."""
+    if period == 'day':
+        return day
+    if period == 'week':
+        # ordinal 1, 0001-01-01, is a Monday
+        return day - (day - 1) % 7
+    if period == 'month':
+        first = date.fromordinal(day)
+        return first.year * 12 + first.month - 1
+    raise ValueError(f"unknown period '{period}'")
+
+def period_keys(period, day, count):
+    """The keys of count consecutive periods, oldest first, ending with the one containing day."""
+    last = period_key(period, day)
+    step = 7 if period == 'week' else 1
+    return [last - step * index for index in range(count - 1, -1, -1)]
+
+def period_start(period, key):
+    """The date ordinal of the first day of the period key."""
+    if period == 'month':
+        return date(key // 12, key % 12 + 1, 1).toordinal()
+    return key
+
+def period_end(period, key):
+    """The date ordinal of the first day after the period key."""
+    if period == 'month':
+        return period_start(period, key + 1)
+    return key + (7 if period == 'week' else 1)
+
+def day_start(day):
+    """The timestamp of midnight starting the date ordinal day."""
+    return (day - EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+def count_in_periods(timestamps, period, keys):
+    """The number of the sorted timestamps in each period of keys, two bisections per period."""
+    return [bisect_left(timestamps, day_start(period_end(period, key))) - bisect_left(timestamps, day_start(period_start(period, key)))
+            for key in keys]
+
+def period_label(period, key):
+    """A readable name for a period: 2024-09-16, 2024-W38 or 2024-09."""
+    if period == 'day':
+        return date.fromordinal(key).isoformat()
+    if period == 'week':
+        year, week, _ = date.fromordinal(key).isocalendar()
+        return f"{year}-W{week:02}"
+    return f"{key // 12}-{key % 12 + 1:02}"
+
+class CompletionRollups:
+    """Completion counts of one habit keyed by day, week and month."""
+    __slots__ = PERIODS
+
+    def __init__(self):
+        self.day = {}
+        self.week = {}
+        self.month = {}
+
+    @classmethod
+    def from_timestamps(cls, timestamps):
+        rollups = cls()
+        day_counts = {}
+        for timestamp in timestamps:
+            day = day_of_timestamp(timestamp)
+            day_counts[day] = day_counts.get(day, 0) + 1
+        for day, count in day_counts.items():
+            rollups.add_day(day, count)
+        return rollups
+
+    def add(self, timestamp):
+        """Count one completion at timestamp."""
+        self.add_day(day_of_timestamp(timestamp), 1)
+
+    def add_day(self, day, count):
+        for period in PERIODS:
+            counts = getattr(self, period)
+            key = period_key(period, day)
+            counts[key] = counts.get(key, 0) + count
+
+    def counts(self, period, keys):
+        """The number of completions in each period of keys."""
+        counts = getattr(self, period)
+        return [counts.get(key, 0) for key in keys]
+
+    def rows(self):
+        """(period, key, count) for every period with completions."""
+        return [(period, key, count) for period in PERIODS for key, count in getattr(self, period).items()]
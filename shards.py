@@ -0,0 +1,81 @@
+"""One store per user, found through a manifest next to the base store.
+
+With `--store habits.json --user alice` the cli reads and writes
+`habits.alice.json` only, so a command costs the same however many users
+there are. `habits.manifest.json` lists the users that have a shard, which
+lets cross-user reports visit the shards one at a time.
+"""
+import json
+import os
+import re
+
+MANIFEST_SUFFIX = '.manifest.json'
+USER_NAME = re.compile(r'[a-z0-9][a-z0-9_-]*')
+
+def normalize_user(user):
+    """The canonical form of a user name; raises ValueError for names unsafe in a file name."""
+    user = user.strip().lower()
+    if not USER_NAME.fullmatch(user):
+        raise ValueError(f"Invalid user name '{user}': use letters, digits, '-' and '_'")
+    return user
+
+def _split_store(store):
+    if store.startswith('sqlite:'):
+        return 'sqlite:', store[len('sqlite:'):]
+    return '', store
+
+def shard_store(store, user):
+    """The store of user next to the base store, e.g. habits.json -> habits.alice.json.
+
+    Raises ValueError for a user whose shard would be the manifest itself.
+    """
+    prefix, path = _split_store(store)
+    root, extension = os.path.splitext(path)
+    user = normalize_user(user)
+    shard = f"{root}.{user}{extension}"
+    if shard == manifest_path(store):
+        raise ValueError(f"Invalid user name '{user}': its shard would overwrite the manifest")
+    return prefix + shard
+
+def manifest_path(store):
+    """The manifest listing the user shards of the base store."""
+    root, _ = os.path.splitext(_split_store(store)[1])
+    return root + MANIFEST_SUFFIX
+
+def load_manifest(store):
+    """Map each user with a shard of store to the shard's file name, empty if the manifest is missing or unreadable."""
+    try:
+        with open(manifest_path(store), 'r') as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        from data_manager import log_error
+
+        log_error(f"Error reading the manifest '{manifest_path(store)}': {e}")
+        return {}
+    users = manifest.get('users') if isinstance(manifest, dict) else None
+    if not isinstance(users, dict):
+        from data_manager import log_error
+
+        log_error(f"Ignoring the manifest '{manifest_path(store)}': it does not list users")
+        return {}
+    return users
+
+def register_user(store, user):
+    """Add user to the manifest of store; returns False if it was already listed."""
+    from locking import FileLock, lock_path, atomic_write
+
+    user = normalize_user(user)
+    with FileLock(lock_path(manifest_path(store))):
+        users = load_manifest(store)
+        if user in users:
+            return False
+        users[user] = os.path.basename(_split_store(shard_store(store, user))[1])
+        atomic_write(manifest_path(store), json.dumps({'users': dict(sorted(users.items()))}, indent=4))
+    return True
+
+def iter_shards(store):
+    """Yield (user, shard store) for every user in the manifest of store, in name order."""
+    for user in sorted(load_manifest(store)):
+        yield user, shard_store(store, user)
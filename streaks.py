@@ -0,0 +1,88 @@
+import numpy as np
+from habit_manager import check_if_streak_broken, from_timestamp, datetime_to_timestamp
+from completion_stats import SECONDS_PER_DAY
+
+# A streak breaks when two completions are further apart than
+# check_if_streak_broken allows: more than 1 (daily) or 7 (weekly) whole days
+BREAK_AFTER_DAYS = {'daily': 1, 'weekly': 7}
+
+def compute_streaks(habits):
+    """Derive the streaks of every habit from its completion history in one vectorized pass.
+
+    Completions on the same day count once, and a streak continues while
+    consecutive completions are no further apart than BREAK_AFTER_DAYS
+    allows for the periodicity. Returns (last, highest, last_timestamps):
+    per habit, the length of the streak ending with its latest completion,
+    the longest streak, and the latest completion (-1 without completions).
+    Habits of other periodicities get zeros. Archived completions count too,
+    so archiving never shortens a longest streak.
+    """
+    habits = list(habits)
+    known = np.array([habit.periodicity in BREAK_AFTER_DAYS for habit in habits], dtype=bool)
+    histories = [habit.completion_timestamps() if habit.periodicity in BREAK_AFTER_DAYS else () for habit in habits]
+    counts = np.array([len(history) for history in histories], dtype=np.int64)
+    limits = np.array([(BREAK_AFTER_DAYS.get(habit.periodicity, 0) + 1) * SECONDS_PER_DAY for habit in habits], dtype=np.int64)
+
+    timestamps = np.empty(int(counts.sum()), dtype=np.int64)
+    position = 0
+    for history, count in zip(histories, counts):
+        if count:
+            timestamps[position:position + count] = np.frombuffer(history, dtype=np.int64)
+            position += count
+    groups = np.repeat(np.arange(len(habits)), counts)
+
+    # Keep the first completion of each day; histories are already sorted
+    days = timestamps // SECONDS_PER_DAY
+    keep = np.ones(len(timestamps), dtype=bool)
+    keep[1:] = (groups[1:] != groups[:-1]) | (days[1:] != days[:-1])
+    timestamps, groups = timestamps[keep], groups[keep]
+
+    new_streak = np.ones(len(timestamps), dtype=bool)
+    new_streak[1:] = (groups[1:] != groups[:-1]) | (timestamps[1:] - timestamps[:-1] >= limits[groups[1:]])
+    streak_ids = np.cumsum(new_streak) - 1
+    streak_lengths = np.bincount(streak_ids)
+
+    highest = np.zeros(len(habits), dtype=np.int64)
+    np.maximum.at(highest, groups[new_streak], streak_lengths)
+
+    last = np.zeros(len(habits), dtype=np.int64)
+    last_timestamps = np.full(len(habits), -1, dtype=np.int64)
+    kept_counts = np.bincount(groups, minlength=len(habits))
+    present = kept_counts > 0
+    ends = np.cumsum(kept_counts)[present] - 1
+    last[present] = streak_lengths[streak_ids[ends]]
+    last_timestamps[present] = timestamps[ends]
+    last[~known] = 0
+    return last, highest, last_timestamps
+
+def recompute_streaks(habits, now):
+    """Rebuild the streak fields of every daily and weekly habit from its history.
+
+    current_streak, highest_streak, last_completed, completed_at and
+    completed_today are overwritten with what the history implies at now.
+    Returns a list of (habit, old fields, new fields) for the habits that
+    changed.
+    """
+    habits = list(habits)
+    last, highest, last_timestamps = compute_streaks(habits)
+    today = datetime_to_timestamp(now) // SECONDS_PER_DAY
+    changes = []
+    for habit, last_streak, highest_streak, last_timestamp in zip(habits, last.tolist(), highest.tolist(), last_timestamps.tolist()):
+        if habit.periodicity not in BREAK_AFTER_DAYS:
+            continue
+        before = _streak_fields(habit)
+        completed = from_timestamp(last_timestamp) if last_timestamp >= 0 else "NA"
+        habit.current_streak = last_streak
+        habit.highest_streak = highest_streak
+        habit.last_completed = completed
+        habit.completed_at = completed
+        habit.completed_today = last_timestamp >= 0 and last_timestamp // SECONDS_PER_DAY == today
+        check_if_streak_broken(habit, now)
+        after = _streak_fields(habit)
+        if after != before:
+            changes.append((habit, before, after))
+    return changes
+
+def _streak_fields(habit):
+    return {'current_streak': habit.current_streak, 'highest_streak': habit.highest_streak, 'last_completed': habit.last_completed,
+            'completed_at': habit.completed_at, 'completed_today': bool(habit.completed_today)}
@@ -1,13 +1,14 @@
 import pytest
 from click.testing import CliRunner
 from unittest.mock import patch, mock_open
-from habit_manager import Habit, find_habit, add_habit, delete_habit, mark_habit_as_completed
+from habit_manager import Habit, HabitStore, find_habit, add_habit, delete_habit, rename_habit, mark_habit_as_completed, refresh_streaks, is_completed_today
 from analytics import list_completion_history, list_all_habits, find_habits_by_periodicity, get_longest_streak_for_habit, calculate_median_completion_time, get_longest_streak_of_all_habits
-from data_manager import load_habits_from_file, save_habits_to_file
+from data_manager import load_habits_from_file, save_habits_to_file, journal_record, append_to_journal, journal_path, compact_journal, load_habits_from_sqlite, load_habit_from_sqlite, save_habits_to_sqlite, migrate_json_to_sqlite
 from cli import cli
 import json
+import os
 from io import StringIO
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 # Test adding a habit with missing arguments
 def test_add_missing_arguments():
@@ -227,6 +228,1122 @@ def test_delete_nonexistent_habit(predefined_habits):
     delete_habit(predefined_habits, 'nonexistent_task')
     assert len(predefined_habits) == initial_habit_count
 
+# Test that a HabitStore finds habits by normalized task name
+def test_habit_store_find_habit(predefined_habits):
+    habits = HabitStore(predefined_habits)
+    assert find_habit(habits, "  Exercise ") is predefined_habits[0]
+    assert find_habit(habits, "nonexistent_task") is None
+    assert len(habits) == 2
+
+# Test that the periodicity index follows adds and deletes
+def test_habit_store_periodicity_index(predefined_habits):
+    habits = HabitStore(predefined_habits)
+    add_habit(habits, "meditate", "Daily")
+    assert [habit.task for habit in find_habits_by_periodicity(habits, "daily")] == ["exercise", "meditate"]
+    delete_habit(habits, "exercise")
+    assert [habit.task for habit in find_habits_by_periodicity(habits, "daily")] == ["meditate"]
+    delete_habit(habits, "reading")
+    assert find_habits_by_periodicity(habits, "weekly") == []
+
+# Test renaming a habit keeps the store indexes in sync
+def test_habit_store_rename(predefined_habits):
+    habits = HabitStore(predefined_habits)
+    assert rename_habit(habits, "exercise", "running") is True
+    assert find_habit(habits, "exercise") is None
+    assert find_habit(habits, "running").task == "running"
+    assert find_habits_by_periodicity(habits, "daily")[0].task == "running"
+    assert rename_habit(habits, "running", "reading") is False
+    assert rename_habit(habits, "running", "  ") is False
+    assert habits.rename("running", "") is None
+    assert find_habit(habits, "running").task == "running"
+
+# Test that the rename command rejects a blank new name
+def test_rename_blank_name(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    result = CliRunner().invoke(cli, ['--store', path, 'rename', 'exercise', '  '])
+    assert result.exit_code == 0
+    assert "Habit name cannot be blank. Cannot rename 'exercise'" in result.output
+    assert [habit.task for habit in load_habits_from_file(path)] == ['exercise', 'reading']
+
+# Test that loading from a file returns an indexed HabitStore
+def test_load_habits_returns_store(tmp_path, predefined_habits):
+    path = tmp_path / "habits.json"
+    save_habits_to_file(predefined_habits, str(path))
+    habits = load_habits_from_file(str(path))
+    assert isinstance(habits, HabitStore)
+    assert find_habit(habits, "reading").periodicity == "weekly"
+
+# Test that journal records are replayed over the last snapshot
+def test_journal_replayed_on_load(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+
+    habits = load_habits_from_file(path)
+    predefined_habits[0].completed_today = False
+    mark_habit_as_completed(habits, "reading")
+    append_to_journal(path, journal_record('complete', find_habit(habits, "reading")))
+    add_habit(habits, "meditate", "daily")
+    append_to_journal(path, journal_record('add', find_habit(habits, "meditate")))
+    append_to_journal(path, journal_record('delete', find_habit(habits, "exercise")))
+
+    reloaded = load_habits_from_file(path)
+    assert [habit.task for habit in reloaded] == ["reading", "meditate"]
+    assert find_habit(reloaded, "reading").completed_today is True
+    assert len(find_habit(reloaded, "reading").completion_history) == 3
+
+# Test that a truncated journal line is skipped instead of failing the load
+def test_journal_truncated_record(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    with open(journal_path(path), 'w') as file:
+        file.write('{"op":"delete","task":"exercise"}\n{"op":"delete","ta')
+    habits = load_habits_from_file(path)
+    assert [habit.task for habit in habits] == ["reading"]
+
+# Test that completing through the CLI appends to the journal and leaves the snapshot alone
+def test_cli_complete_appends_to_journal(tmp_path, monkeypatch, predefined_habits):
+    monkeypatch.chdir(tmp_path)
+    runner = CliRunner()
+    predefined_habits[1].completed_today = False
+    save_habits_to_file(predefined_habits, 'habits.json')
+    snapshot = open('habits.json').read()
+
+    result = runner.invoke(cli, ['complete', 'reading'])
+    assert result.exit_code == 0
+    assert open('habits.json').read() == snapshot
+    assert len(open(journal_path('habits.json')).readlines()) == 1
+
+    result = runner.invoke(cli, ['compact', '--force'])
+    assert "Compacted" in result.output
+    assert not os.path.exists(journal_path('habits.json'))
+    assert find_habit(load_habits_from_file('habits.json'), 'reading').completed_today is True
+
+# Test that compaction waits until the journal passes the threshold
+def test_compact_journal_threshold(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    append_to_journal(path, journal_record('delete', predefined_habits[0]))
+    assert compact_journal(path, threshold=1024 * 1024) is False
+    assert compact_journal(path, threshold=1) is True
+    assert [habit.task for habit in load_habits_from_file(path)] == ["reading"]
+
+# Test that habits and their history round-trip through the SQLite backend
+def test_sqlite_round_trip(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.db")
+    save_habits_to_sqlite(predefined_habits, path)
+    habits = load_habits_from_sqlite(path)
+    assert [habit.to_dict() for habit in habits] == [habit.to_dict() for habit in predefined_habits]
+    assert load_habit_from_sqlite(path, "Reading").completion_history == predefined_habits[1].completion_history
+    assert load_habit_from_sqlite(path, "nonexistent_task") is None
+
+# Test migrating a JSON file and driving the sqlite store through the CLI
+def test_cli_sqlite_store(tmp_path, predefined_habits):
+    json_path = str(tmp_path / "habits.json")
+    store = f"sqlite:{tmp_path / 'habits.db'}"
+    predefined_habits[1].completed_today = False
+    save_habits_to_file(predefined_habits, json_path)
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['--store', store, 'migrate', json_path])
+    assert "Migrated 2 habits" in result.output
+
+    result = runner.invoke(cli, ['--store', store, 'complete', 'reading'])
+    assert "Marked habit 'reading' as completed" in result.output
+    assert len(load_habit_from_sqlite(str(tmp_path / 'habits.db'), 'reading').completion_history) == 3
+
+    runner.invoke(cli, ['--store', store, 'add', 'meditate', 'daily'])
+    runner.invoke(cli, ['--store', store, 'delete', 'exercise'])
+    result = runner.invoke(cli, ['--store', store, 'list'])
+    assert "meditate" in result.output
+    assert "exercise" not in result.output
+
+    result = runner.invoke(cli, ['--store', store, 'history', 'reading'])
+    assert "2024-09-01 18:00:00" in result.output
+
+# Test that lazy loading parses histories only when they are accessed
+def test_load_habits_lazily(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    predefined_habits[0].task = 'say "completion_history": [ ]'
+    save_habits_to_file(predefined_habits, path)
+    habits = load_habits_from_file(path, lazy=True)
+    assert all(habit._history_loader is not None for habit in habits)
+    assert habits[0].task == predefined_habits[0].task
+    assert habits[1].completion_history == predefined_habits[1].completion_history
+    assert habits[0]._history_loader is not None
+    assert [habit.to_dict() for habit in habits] == [habit.to_dict() for habit in predefined_habits]
+
+# Test that a lazy load finds the end of a history past brackets inside its entries
+def test_load_habits_lazily_nested_brackets(tmp_path, predefined_habits):
+    path = tmp_path / "habits.json"
+    save_habits_to_file(predefined_habits, str(path))
+    data = json.loads(path.read_text())
+    data[0]['completion_history'][0]['note'] = 'done ] "early" \\]'
+    data[0]['completion_history'][1]['tags'] = [['a', ']'], []]
+    path.write_text(json.dumps(data))
+    expected = [habit.to_dict() for habit in load_habits_from_file(str(path))]
+    habits = load_habits_from_file(str(path), lazy=True)
+    assert habits[0]._history_loader is not None
+    assert [habit.to_dict() for habit in habits] == expected
+    assert len(habits) == len(predefined_habits)
+
+# Test that migrating to SQLite keeps journaled changes and archived completions
+def test_migrate_json_to_sqlite(tmp_path, predefined_habits):
+    path, database = str(tmp_path / "habits.json"), str(tmp_path / "habits.db")
+    save_habits_to_file(predefined_habits, path)
+    habits = HabitStore(predefined_habits)
+    add_habit(habits, "meditate", "daily")
+    append_to_journal(path, journal_record('add', find_habit(habits, "meditate")))
+    CliRunner().invoke(cli, ['--store', path, 'archive', '--older-than', '1'])
+    expected = {habit.task: habit.completion_timestamps().tolist() for habit in load_habits_from_file(path)}
+    assert expected['exercise']
+    assert migrate_json_to_sqlite(path, database) == 3
+    migrated = load_habits_from_sqlite(database)
+    assert {habit.task: habit.completion_timestamps().tolist() for habit in migrated} == expected
+    assert all(habit.archive is None for habit in migrated)
+
+# Test that lazily loaded SQLite habits query their history on first access
+def test_load_habits_from_sqlite_lazily(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.db")
+    save_habits_to_sqlite(predefined_habits, path)
+    habits = load_habits_from_sqlite(path, lazy=True)
+    assert habits[0]._history_loader is not None
+    assert habits[0].completion_history == predefined_habits[0].completion_history
+
+# Test that completion history is stored as sorted epoch seconds and serialized unchanged
+def test_habit_compact_history():
+    habit = Habit("exercise", "Daily", 0, "NA", False, "NA", 0, "2024-08-20 07:00:00",
+                  completion_history=[{'datetime': '2024-09-12 07:00:00'}, {'datetime': '2024-09-10 07:00:00'}])
+    assert not hasattr(habit, '__dict__')
+    assert list(habit.timestamps) == [1725951600, 1726124400]
+    habit.add_completion('2024-09-11 21:30:00')
+    assert habit.to_dict()['completion_history'] == [
+        {'datetime': '2024-09-10 07:00:00'},
+        {'datetime': '2024-09-11 21:30:00'},
+        {'datetime': '2024-09-12 07:00:00'},
+    ]
+    assert habit.periodicity is Habit("reading", "daily", 0, "NA", False, "NA", 0, "NA").periodicity
+
+# Test calculating the median completion time from the stored timestamps
+def test_calculate_median_completion_time(predefined_habits):
+    predefined_habits[0].add_completion('2024-09-13 09:30:00')
+    predefined_habits[0].add_completion('2024-09-14 08:00:00')
+    assert calculate_median_completion_time(predefined_habits, 'exercise') == "07:00"
+    predefined_habits[0].add_completion('2024-09-15 09:00:00')
+    assert calculate_median_completion_time(predefined_habits, 'exercise') == "07:30"
+
+# Test that the vectorized statistics match per-habit numpy results
+def test_compute_completion_stats(predefined_habits):
+    import numpy as np
+    from completion_stats import compute_completion_stats
+    predefined_habits[0].add_completion('2024-09-13 09:30:00')
+    predefined_habits[0].add_completion('2024-09-14 06:15:00')
+    predefined_habits.append(Habit("idle", "daily", 0, "NA", False, "NA", 0, "2024-08-20 07:00:00"))
+
+    stats = compute_completion_stats(predefined_habits, percentiles=(10, 90))
+    seconds = np.array([7 * 3600] * 3 + [9 * 3600 + 1800, 6 * 3600 + 900])
+    assert stats['exercise']['count'] == 5
+    assert stats['exercise']['median'] == 7 * 3600
+    assert stats['exercise']['percentiles'][90] == pytest.approx(np.percentile(seconds, 90))
+    assert stats['exercise']['spread'] == pytest.approx(np.std(seconds))
+    assert stats['exercise']['hour_histogram'][7] == 3
+    assert stats['reading']['median'] == 18 * 3600
+    assert stats['idle']['median'] is None
+    assert sum(stats['idle']['hour_histogram']) == 0
+
+# Test the stats command for one habit and for all habits
+def test_cli_stats(predefined_habits):
+    runner = CliRunner()
+    with patch('cli.load_habits', return_value=HabitStore(predefined_habits)):
+        result = runner.invoke(cli, ['stats', 'exercise', '-p', '90'])
+        assert "Habit 'exercise': 3 completions, median 07:00, p90: 07:00" in result.output
+        result = runner.invoke(cli, ['stats', '--all'])
+        assert "Habit 'reading': 2 completions, median 18:00" in result.output
+        result = runner.invoke(cli, ['stats'])
+        assert result.exit_code != 0
+
+# Test that last_completed is parsed once and re-parsed only after it changes
+def test_last_completed_parsed_once(predefined_habits):
+    habit = predefined_habits[0]
+    parsed = habit.last_completed_at
+    assert parsed == datetime(2024, 9, 16, 7, 0, 0)
+    assert habit.last_completed_at is parsed
+    habit.last_completed = "2024-09-17 08:00:00"
+    assert habit.last_completed_at == datetime(2024, 9, 17, 8, 0, 0)
+
+# Test refreshing every streak against one clock reading
+def test_refresh_streaks_single_clock(predefined_habits):
+    now = datetime(2024, 9, 17, 12, 0, 0)
+    assert refresh_streaks(predefined_habits, now) is now
+    assert predefined_habits[0].current_streak == 5
+    assert predefined_habits[1].current_streak == 2
+    refresh_streaks(predefined_habits, datetime(2024, 9, 18, 12, 0, 0))
+    assert predefined_habits[0].current_streak == 0
+    assert predefined_habits[1].current_streak == 2
+
+# Test checking today's completion against a given clock reading
+def test_is_completed_today_with_clock(predefined_habits):
+    assert is_completed_today(predefined_habits[1], datetime(2024, 9, 10, 23, 0, 0)) is True
+    assert is_completed_today(predefined_habits[1], datetime(2024, 9, 11, 0, 0, 1)) is False
+
+# Test applying a mixed batch of line and NDJSON operations
+def test_run_batch(predefined_habits):
+    from batch import run_batch
+    habits = HabitStore(predefined_habits)
+    lines = [
+        'add meditate daily',
+        '{"op": "complete", "task": "meditate"}',
+        '',
+        'complete exercise',
+        'analyze "reading"',
+        'delete nonexistent_task',
+        'jump exercise',
+        '{"op": "complete", "task": 5}',
+        '{"op": "add", "task": "x", "periodicity": 3}',
+        '{"op": "delete", "task": " "}',
+    ]
+    results = list(run_batch(habits, lines, datetime(2024, 9, 16, 8, 0, 0)))
+    assert [result['status'] for result, record in results] == ['ok', 'ok', 'error', 'ok', 'error', 'error', 'error', 'error', 'error']
+    assert "needs text for periodicity" in results[7][0]['message']
+    assert [record['op'] for result, record in results if record] == ['add', 'complete']
+    assert results[4][0]['line'] == 6
+    assert results[3][0]['highest_streak'] == 2
+    assert find_habit(habits, 'meditate').current_streak == 1
+
+# Test the batch command saves once and honours --dry-run
+def test_cli_batch(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    predefined_habits[1].completed_today = False
+    save_habits_to_file(predefined_habits, path)
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['--store', path, 'batch', '--dry-run'], input='complete reading\nadd walk daily\n')
+    assert [json.loads(line)['status'] for line in result.output.splitlines()] == ['ok', 'ok']
+    assert not os.path.exists(journal_path(path))
+
+    result = runner.invoke(cli, ['--store', path, 'batch'], input='complete reading\nadd walk daily\n')
+    assert result.exit_code == 0
+    habits = load_habits_from_file(path)
+    assert find_habit(habits, 'walk') is not None
+    assert find_habit(habits, 'reading').completed_today is True
+
+# Test that a running daemon answers forwarded commands from memory and persists changes
+def test_daemon_serves_forwarded_commands(tmp_path, monkeypatch, capsys, predefined_habits):
+    import asyncio
+    import threading
+    import time
+    import cli as cli_module
+    from daemon import HabitDaemon, forward_to_daemon
+
+    monkeypatch.chdir(tmp_path)
+    predefined_habits[1].completed_today = False
+    save_habits_to_file(predefined_habits, 'habits.json')
+    monkeypatch.setattr(cli_module, 'STORE', 'habits.json')
+    daemon = HabitDaemon(cli_module, flush_interval=0)
+    thread = threading.Thread(target=asyncio.run, args=(daemon.serve(),))
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(daemon.socket_path):
+                break
+            time.sleep(0.01)
+
+        assert forward_to_daemon(['complete', 'reading']) == 0
+        assert forward_to_daemon(['add', 'walk', 'daily']) == 0
+        assert forward_to_daemon(['list']) == 0
+        assert forward_to_daemon(['batch']) is None
+        output = capsys.readouterr().out
+        assert "Marked habit 'reading' as completed" in output
+        assert "Task: 'walk'" in output
+    finally:
+        daemon.stop()
+        thread.join()
+
+    assert cli_module.RESIDENT is None
+    assert not os.path.exists(daemon.socket_path)
+    habits = load_habits_from_file('habits.json')
+    assert find_habit(habits, 'walk') is not None
+    assert len(find_habit(habits, 'reading').timestamps) == 3
+
+# Test that a command run outside the daemon first has it flush its queued writes, under the store lock
+def test_daemon_flushes_for_local_commands(tmp_path, monkeypatch, predefined_habits):
+    import asyncio
+    import threading
+    import time
+    import cli as cli_module
+    import data_manager
+    from daemon import HabitDaemon, forward_to_daemon
+    from locking import FileLock, lock_path
+
+    monkeypatch.chdir(tmp_path)
+    save_habits_to_file(predefined_habits, 'habits.json')
+    monkeypatch.setattr(cli_module, 'STORE', 'habits.json')
+    monkeypatch.setattr(cli_module, 'BASE_STORE', 'habits.json')
+    locked = []
+    append = data_manager.append_to_journal
+    def append_to_journal(filename, *records):
+        locked.append(any(key[1] == os.path.abspath(lock_path(filename)) for key in FileLock._held))
+        return append(filename, *records)
+    monkeypatch.setattr(data_manager, 'append_to_journal', append_to_journal)
+    daemon = HabitDaemon(cli_module, flush_interval=60)
+    thread = threading.Thread(target=asyncio.run, args=(daemon.serve(),))
+    thread.start()
+    try:
+        for _ in range(100):
+            if os.path.exists(daemon.socket_path):
+                break
+            time.sleep(0.01)
+
+        assert forward_to_daemon(['add', 'walk', 'daily']) == 0
+        assert find_habit(load_habits_from_file('habits.json'), 'walk') is None
+        assert forward_to_daemon(['export', 'out.csv']) is None
+        assert find_habit(load_habits_from_file('habits.json'), 'walk') is not None
+        assert locked == [True]
+    finally:
+        daemon.stop()
+        thread.join()
+
+# Test that a daemon started elsewhere writes to the store it serves, whatever the client's --store looks like
+def test_daemon_resolves_client_store(tmp_path, monkeypatch, predefined_habits):
+    import cli as cli_module
+    from daemon import HabitDaemon
+    store, elsewhere = tmp_path / "store", tmp_path / "elsewhere"
+    store.mkdir()
+    elsewhere.mkdir()
+    path = str(store / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    monkeypatch.chdir(elsewhere)
+    monkeypatch.setattr(cli_module, 'STORE', path)
+    monkeypatch.setattr(cli_module, 'BASE_STORE', path)
+    daemon = HabitDaemon(cli_module, flush_interval=0)
+    monkeypatch.setattr(cli_module, 'RESIDENT', daemon)
+
+    assert daemon.run_command(['add', 'fromclient', 'daily'], cwd=str(store))['exit_code'] == 0
+    assert cli_module.STORE == path
+    assert not os.path.exists(elsewhere / "habits.json.journal")
+    assert find_habit(load_habits_from_file(path), 'fromclient') is not None
+
+    response = daemon.run_command(['add', 'stray', 'daily'], cwd=str(elsewhere))
+    assert response['exit_code'] == 2
+    assert "This daemon serves" in response['stderr']
+    assert daemon.run_command(['--store', 'sqlite:habits.json', 'list'], cwd=str(store))['exit_code'] == 2
+    assert find_habit(load_habits_from_file(path), 'stray') is None
+
+# Test that the help path does not import the storage or analytics modules
+def test_cli_help_imports_lazily():
+    import subprocess
+    import sys
+    code = "import sys, cli; cli.cli.main(['--help'], standalone_mode=False); print(sorted({'data_manager', 'analytics', 'habit_manager', 'sqlite3', 'logging', 'statistics'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    assert result.stdout.strip().endswith("[]")
+
+# Test that profiling records exclusive phase times that add up to the total
+def test_profiling_phases():
+    import profiling
+    assert profiling.phase('load') is profiling.phase('parse')
+    session = profiling.start()
+    try:
+        with profiling.phase('load'):
+            with profiling.phase('parse'):
+                pass
+        with profiling.phase('parse'):
+            pass
+    finally:
+        profiling.stop()
+    metrics = session.metrics()
+    assert metrics['phases']['parse']['calls'] == 2
+    assert sum(entry['seconds'] for entry in metrics['phases'].values()) == pytest.approx(metrics['total_seconds'])
+    assert not profiling.ENABLED
+
+# Test the --profile report of a CLI command and the forwarding parser
+def test_cli_profile(tmp_path, predefined_habits):
+    from daemon import _parse_cli_args
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    dump = str(tmp_path / "list.prof")
+    result = CliRunner().invoke(cli, ['--store', path, '--profile', '--profile-format', 'json', '--profile-dump', dump, 'list'])
+    assert result.exit_code == 0
+    assert "Task: 'exercise'" in result.output
+    metrics = json.loads(result.output[result.output.index('{'):result.output.rindex('}') + 1])
+    assert {'load', 'parse', 'streaks', 'output', 'command logic'} <= set(metrics['phases'])
+    assert os.path.exists(dump)
+    assert _parse_cli_args(['--profile-format', 'json', '--store', path, 'list']) == (path, 'list')
+
+# Test the naming of user shards and their manifest
+def test_shard_store_and_manifest(tmp_path):
+    from shards import shard_store, manifest_path, register_user, iter_shards
+    base = str(tmp_path / "habits.json")
+    assert shard_store(base, " Alice ") == str(tmp_path / "habits.alice.json")
+    assert shard_store("sqlite:habits.db", "bob") == "sqlite:habits.bob.db"
+    assert manifest_path("sqlite:habits.db") == "habits.manifest.json"
+    with pytest.raises(ValueError):
+        shard_store(base, "../eve")
+    with pytest.raises(ValueError):
+        shard_store(base, "Manifest")
+    assert shard_store("sqlite:habits.db", "manifest") == "sqlite:habits.manifest.db"
+    assert register_user(base, "bob") is True
+    assert register_user(base, "alice") is True
+    assert register_user(base, "bob") is False
+    assert list(iter_shards(base)) == [("alice", shard_store(base, "alice")), ("bob", shard_store(base, "bob"))]
+    for broken in ('[{"task": "walk"}]', '{"users": [1]}', '{"users": '):
+        with open(manifest_path(base), 'w') as file:
+            file.write(broken)
+        assert list(iter_shards(base)) == []
+
+# Test that --user keeps each user's habits in their own shard
+def test_cli_user_shards(tmp_path):
+    from daemon import _parse_cli_args
+    base = str(tmp_path / "habits.json")
+    runner = CliRunner()
+    runner.invoke(cli, ['--store', base, '--user', 'alice', 'add', 'exercise', 'daily'])
+    runner.invoke(cli, ['--store', base, '--user', 'alice', 'complete', 'exercise'])
+    runner.invoke(cli, ['--store', base, '--user', 'bob', 'add', 'reading', 'weekly'])
+
+    assert "reading" not in runner.invoke(cli, ['--store', base, '--user', 'alice', 'list']).output
+    assert not os.path.exists(base)
+    result = runner.invoke(cli, ['--store', base, 'users'])
+    assert result.output.splitlines() == [
+        "User: 'alice', Habits: 1, Completed Today: 1, Longest Current Streak: 'exercise' with a streak of 1",
+        "User: 'bob', Habits: 1, Completed Today: 0, Longest Current Streak: 'reading' with a streak of 0",
+    ]
+    assert runner.invoke(cli, ['--user', '../x', 'list']).exit_code != 0
+    assert runner.invoke(cli, ['--store', base, '--user', 'manifest', 'add', 'walk', 'daily']).exit_code == 2
+    assert "User: 'alice'" in runner.invoke(cli, ['--store', base, 'users']).output
+    assert _parse_cli_args(['--store', base, '--user=alice', 'list']) == (str(tmp_path / "habits.alice.json"), 'list')
+
+# Test that a store whose changes are all in its journal loads without reporting a missing snapshot
+def test_journal_only_store(tmp_path, caplog):
+    path = str(tmp_path / "habits.json")
+    runner = CliRunner()
+    runner.invoke(cli, ['--store', path, 'add', 'walk', 'daily'])
+    assert not os.path.exists(path)
+    caplog.clear()
+    assert "Task: 'walk'" in runner.invoke(cli, ['--store', path, 'list']).output
+    assert "not found" not in caplog.text
+    load_habits_from_file(str(tmp_path / "missing.json"))
+    assert "not found" in caplog.text
+
+# Test that a failed atomic write leaves the previous file intact
+def test_atomic_write_keeps_old_file(tmp_path, monkeypatch):
+    from locking import atomic_write
+    path = tmp_path / "habits.json"
+    atomic_write(path, "old")
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        atomic_write(path, "new")
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["habits.json"]
+
+# Test that one journal flush covers every record appended before it
+def test_journal_group_commit(tmp_path, predefined_habits):
+    from data_manager import sync_journal
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    first = append_to_journal(path, journal_record('delete', predefined_habits[0]), sync=False)
+    second = append_to_journal(path, journal_record('delete', predefined_habits[1]), sync=False)
+    assert sync_journal(path, second) is True
+    assert sync_journal(path, first) is False
+    save_habits_to_file([], path)
+    assert sync_journal(path, second) is False
+    third = append_to_journal(path, journal_record('add', predefined_habits[0]), sync=False)
+    assert sync_journal(path, third) is True
+
+# Test that concurrent commands and a compaction do not lose each other's changes
+def test_concurrent_cli_writers(tmp_path):
+    import subprocess
+    import sys
+    path = str(tmp_path / "habits.json")
+    tasks = [f"habit{index}" for index in range(8)]
+    habits = HabitStore()
+    for task in tasks:
+        add_habit(habits, task, "daily")
+    save_habits_to_file(habits, path)
+    cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+    commands = [['complete', task] for task in tasks] + [['compact', '--force']] * 3
+    processes = [subprocess.Popen([sys.executable, cli_path, '--store', path, *command], stdout=subprocess.DEVNULL) for command in commands]
+    assert all(process.wait() == 0 for process in processes)
+    habits = load_habits_from_file(path)
+    assert [len(find_habit(habits, task).timestamps) for task in tasks] == [1] * len(tasks)
+
+# Test the period keys and labels of completion rollups
+def test_rollup_periods():
+    from datetime import date
+    from rollups import period_key, period_keys, period_label
+    day = date(2024, 9, 18).toordinal()
+    assert period_label('week', period_key('week', day)) == "2024-W38"
+    assert date.fromordinal(period_key('week', day)) == date(2024, 9, 16)
+    assert period_label('month', period_key('month', day)) == "2024-09"
+    assert [period_label('month', key) for key in period_keys('month', date(2024, 1, 5).toordinal(), 3)] == ["2023-11", "2023-12", "2024-01"]
+    assert [period_label('week', key) for key in period_keys('week', day, 2)] == ["2024-W37", "2024-W38"]
+
+    from habit_manager import to_timestamp
+    from rollups import count_in_periods
+    timestamps = [to_timestamp(moment) for moment in ('2024-08-31 23:59:59', '2024-09-01 00:00:00', '2024-09-30 12:00:00', '2024-10-01 00:00:00')]
+    assert count_in_periods(timestamps, 'month', period_keys('month', day, 3)) == [0, 1, 2]
+    assert count_in_periods(timestamps, 'day', [date(2024, 9, 1).toordinal(), date(2024, 9, 2).toordinal()]) == [1, 0]
+
+# Test that rollups follow completions recorded after they were built
+def test_habit_rollups_follow_completions(predefined_habits):
+    from datetime import date
+    from rollups import period_key
+    habit = predefined_habits[0]
+    week = period_key('week', date(2024, 9, 16).toordinal())
+    assert habit.rollups.counts('week', [week - 7, week]) == [3, 0]
+    habit.completed_today = False
+    habit.mark_as_completed(datetime(2024, 9, 17, 8, 0))
+    assert habit.rollups.counts('week', [week - 7, week]) == [3, 1]
+    assert habit.rollups.counts('day', [date(2024, 9, 17).toordinal()]) == [1]
+    assert habit.rollups.counts('month', [period_key('month', date(2024, 9, 1).toordinal())]) == [4]
+
+# Test that the sqlite rollup table is filled on save, kept up to date and backfilled
+def test_sqlite_rollups(tmp_path, predefined_habits):
+    import sqlite3
+    from datetime import date
+    from data_manager import load_rollups_from_sqlite, write_change_to_sqlite
+    path = str(tmp_path / "habits.db")
+    save_habits_to_sqlite(predefined_habits, path)
+    days = [date(2024, 9, 12).toordinal(), date(2024, 9, 17).toordinal()]
+    assert load_rollups_from_sqlite(path, "exercise", 'day', days) == [1, 0]
+    habit = predefined_habits[0]
+    habit.completed_today = False
+    habit.mark_as_completed(datetime(2024, 9, 17, 8, 0))
+    write_change_to_sqlite(path, journal_record('complete', habit))
+    assert load_rollups_from_sqlite(path, "exercise", 'day', days) == [1, 1]
+    assert load_rollups_from_sqlite(path, "nonexistent_task", 'day', days) is None
+
+    connection = sqlite3.connect(path)
+    connection.execute('DROP TABLE completion_rollups')
+    connection.close()
+    assert load_rollups_from_sqlite(path, "exercise", 'day', days) == [1, 1]
+
+# Test the trend and calendar commands
+def test_cli_trend_and_calendar(tmp_path):
+    path = str(tmp_path / "habits.json")
+    runner = CliRunner()
+    runner.invoke(cli, ['--store', path, 'add', 'exercise', 'daily'])
+    runner.invoke(cli, ['--store', path, 'complete', 'exercise'])
+    result = runner.invoke(cli, ['--store', path, 'trend', 'exercise', '--period', 'month', '--last', '2'])
+    assert result.output.splitlines()[1].endswith(" 0")
+    assert result.output.splitlines()[2].split()[1:] == ["#", "1"]
+    result = runner.invoke(cli, ['--store', path, 'calendar', 'exercise', '--weeks', '3'])
+    assert result.exit_code == 0
+    assert sum(line.count('#') for line in result.output.splitlines()[1:8]) == 1
+    assert "not found" in runner.invoke(cli, ['--store', path, 'trend', 'nothing']).output
+
+# Test selecting a window of the completion history by time and page
+def test_iter_completion_history(predefined_habits):
+    from analytics import iter_completion_history
+    habit = predefined_habits[0]
+    assert list(iter_completion_history(habit, since=datetime(2024, 9, 11), until=datetime(2024, 9, 12, 7, 0))) == ['2024-09-11 07:00:00']
+    assert list(iter_completion_history(habit, offset=1, limit=1)) == ['2024-09-11 07:00:00']
+    assert list(iter_completion_history(habit, since=datetime(2024, 9, 13))) == []
+    assert len(list(iter_completion_history(habit, offset=5))) == 0
+
+# Test the range and paging options of the history command
+@patch('cli.load_habits')
+def test_cli_history_range(mock_load_habits, predefined_habits):
+    mock_load_habits.return_value = predefined_habits
+    runner = CliRunner()
+    result = runner.invoke(cli, ['history', 'exercise', '--since', '2024-09-11', '--until', '2024-09-12'])
+    assert result.output.splitlines()[1:] == ['2024-09-11 07:00:00', '2024-09-12 07:00:00']
+    result = runner.invoke(cli, ['history', 'exercise', '--until', '2024-09-11 06:59:59'])
+    assert result.output.splitlines()[1:] == ['2024-09-10 07:00:00']
+    result = runner.invoke(cli, ['history', 'exercise', '--offset', '1', '--limit', '1'])
+    assert result.output.splitlines()[1:] == ['2024-09-11 07:00:00']
+    assert "in the requested range" in runner.invoke(cli, ['history', 'exercise', '--since', '2025-01-01']).output
+    assert runner.invoke(cli, ['history', 'exercise', '--since', 'yesterday']).exit_code != 0
+
+# Test deriving streaks from histories with gaps, same-day repeats and no completions
+def test_compute_streaks():
+    from streaks import compute_streaks
+    def habit(task, periodicity, dates):
+        return Habit(task, periodicity, 0, "NA", False, "NA", 0, "2024-08-01 07:00:00", [{'datetime': d} for d in dates])
+    habits = [
+        habit("a", "daily", ['2024-09-01 07:00:00', '2024-09-02 07:00:00', '2024-09-02 09:00:00', '2024-09-03 23:00:00', '2024-09-06 07:00:00', '2024-09-07 07:00:00']),
+        habit("b", "weekly", ['2024-08-01 07:00:00', '2024-08-08 07:00:00', '2024-08-20 07:00:00']),
+        habit("c", "daily", []),
+        habit("d", "monthly", ['2024-08-01 07:00:00']),
+    ]
+    last, highest, last_timestamps = compute_streaks(habits)
+    assert last.tolist() == [2, 1, 0, 0]
+    assert highest.tolist() == [3, 2, 0, 0]
+    assert last_timestamps[2] == -1
+
+# Test that recompute repairs wrong streak counters in the store
+def test_cli_recompute(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    predefined_habits[0].current_streak = 40
+    predefined_habits[0].highest_streak = 40
+    save_habits_to_file(predefined_habits, path)
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--store', path, 'recompute', '--dry-run'])
+    assert "Habit 'exercise': current_streak 40 -> 0, highest_streak 40 -> 3" in result.output
+    assert load_habits_from_file(path)[0].highest_streak == 40
+    runner.invoke(cli, ['--store', path, 'recompute'])
+    habit = find_habit(load_habits_from_file(path), 'exercise')
+    assert (habit.current_streak, habit.highest_streak, habit.last_completed) == (0, 3, '2024-09-12 07:00:00')
+    assert "0 changed" in runner.invoke(cli, ['--store', path, 'recompute']).output
+
+# Test merging imported completions into existing and new habits
+def test_import_completions(predefined_habits):
+    from transfer import import_completions
+    habits = HabitStore()
+    for habit in predefined_habits:
+        habits.append(habit)
+    rows = enumerate([
+        {'task': 'Exercise', 'datetime': '2024-09-09 07:00:00'},
+        {'task': 'exercise', 'datetime': '2024-09-10 07:00:00'},
+        {'task': 'walk', 'datetime': '2024-09-02T08:00:00', 'periodicity': 'weekly'},
+        {'task': 'walk', 'datetime': '2024-09-01 08:00:00'},
+        {'task': 'walk', 'datetime': 'soon'},
+        None,
+        {'task': 'swim', 'datetime': '2024-09-01 08:00:00', 'periodicity': 5},
+    ], 2)
+    result = import_completions(habits, rows)
+    assert (result['rows'], result['added'], result['duplicates'], result['skipped']) == (7, 3, 1, 3)
+    assert result['errors'][-1] == (8, "invalid periodicity 5")
+    assert find_habit(habits, 'swim') is None
+    assert result['created'] == ['walk']
+    assert predefined_habits[0].completion_history[0] == {'datetime': '2024-09-09 07:00:00'}
+    walk = find_habit(habits, 'walk')
+    assert (walk.periodicity, walk.creation_date) == ('weekly', '2024-09-01 08:00:00')
+    assert walk.completion_history == [{'datetime': '2024-09-01 08:00:00'}, {'datetime': '2024-09-02 08:00:00'}]
+
+# Test that export and import round-trip through CSV and NDJSON
+@pytest.mark.parametrize("extension", ["csv", "ndjson"])
+def test_cli_export_import_round_trip(tmp_path, predefined_habits, extension):
+    source = str(tmp_path / "source.json")
+    target = str(tmp_path / "target.json")
+    rows = str(tmp_path / f"rows.{extension}")
+    save_habits_to_file(predefined_habits, source)
+    runner = CliRunner()
+    assert runner.invoke(cli, ['--store', source, 'export', rows]).exit_code == 0
+    result = runner.invoke(cli, ['--store', target, 'import', rows])
+    assert "5 completions added, 0 duplicates, 0 skipped, 2 habits created" in result.output
+    imported = load_habits_from_file(target)
+    assert [habit.completion_history for habit in imported] == [habit.completion_history for habit in predefined_habits]
+    assert find_habit(imported, 'reading').periodicity == 'weekly'
+    assert find_habit(imported, 'exercise').highest_streak == 3
+    assert "0 completions added, 5 duplicates" in runner.invoke(cli, ['--store', target, 'import', rows]).output
+
+    assert runner.invoke(cli, ['--store', target, 'import', str(tmp_path / "missing.csv")]).exit_code == 2
+    headerless = str(tmp_path / "headerless.csv")
+    with open(headerless, 'w') as file:
+        file.write("walk,2024-09-16 07:00:00,daily\n")
+    result = runner.invoke(cli, ['--store', target, 'import', headerless])
+    assert result.exit_code == 1
+    assert "The CSV header must name the columns" in result.output
+
+# Test that the binary snapshot round-trips and shares its history column until a change
+def test_binary_snapshot_round_trip(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.hbin")
+    save_habits_to_file(predefined_habits, path)
+    with open(path, 'rb') as file:
+        assert file.read(8) == b'HABITBIN'
+    habits = load_habits_from_file(path)
+    assert [habit.to_dict() for habit in habits] == [habit.to_dict() for habit in predefined_habits]
+    exercise = find_habit(habits, 'exercise')
+    assert isinstance(exercise.timestamps, memoryview)
+    exercise.add_completion('2024-09-13 07:00:00')
+    assert exercise.completion_history[-1] == {'datetime': '2024-09-13 07:00:00'}
+
+    append_to_journal(path, journal_record('delete', predefined_habits[1]))
+    assert [habit.task for habit in load_habits_from_file(path)] == ['exercise']
+    assert not os.path.exists(str(tmp_path / "habits.json"))
+
+# Test that saving over a loaded binary snapshot copies the histories and closes the mapping first, as Windows requires
+def test_binary_save_releases_mapping(tmp_path, monkeypatch, predefined_habits):
+    import data_manager
+    path = str(tmp_path / "habits.hbin")
+    save_habits_to_file(predefined_habits, path)
+    replace = os.replace
+    def replace_unmapped(source, target):
+        assert not data_manager._MAPPINGS.get(os.path.abspath(target))
+        replace(source, target)
+    monkeypatch.setattr(os, 'replace', replace_unmapped)
+    habits = load_habits_from_file(path)
+    assert data_manager._MAPPINGS[os.path.abspath(path)]
+    save_habits_to_file(habits, path)
+    assert not data_manager._MAPPINGS[os.path.abspath(path)]
+    assert [habit.completion_history for habit in habits] == [habit.completion_history for habit in predefined_habits]
+    assert [habit.completion_history for habit in load_habits_from_file(path)] == [habit.completion_history for habit in predefined_habits]
+
+# Test converting between JSON and binary snapshots and using a binary store from the CLI
+def test_cli_convert_binary(tmp_path, predefined_habits):
+    json_path = str(tmp_path / "habits.json")
+    binary_path = str(tmp_path / "habits.hbin")
+    back_path = str(tmp_path / "back.json")
+    predefined_habits[1].completed_today = False
+    save_habits_to_file(predefined_habits, json_path)
+    runner = CliRunner()
+    assert "Converted 2 habits" in runner.invoke(cli, ['convert', json_path, binary_path]).output
+    assert "Marked habit 'reading' as completed" in runner.invoke(cli, ['--store', binary_path, 'complete', 'reading']).output
+    assert runner.invoke(cli, ['--store', binary_path, 'history', 'reading']).output.count('\n') == 4
+    runner.invoke(cli, ['--store', binary_path, 'compact', '--force'])
+    runner.invoke(cli, ['convert', binary_path, back_path])
+    assert open(back_path).read().startswith('[')
+    assert len(find_habit(load_habits_from_file(back_path), 'reading').timestamps) == 3
+
+# Test that the leaderboard follows completions, breaks, renames and deletions
+def test_streak_leaderboard(predefined_habits):
+    habits = HabitStore(predefined_habits)
+    now = datetime(2024, 9, 16, 20, 0, 0)
+    assert [habit.task for habit in habits.leaderboard.top(5, 'current', now=now)] == ['exercise', 'reading']
+    assert [habit.task for habit in habits.leaderboard.top(5, 'highest', 'weekly', now)] == ['reading']
+
+    add_habit(habits, 'meditate', 'daily')
+    find_habit(habits, 'meditate').current_streak = 9
+    find_habit(habits, 'meditate').highest_streak = 9
+    assert [habit.task for habit in habits.leaderboard.top(2, 'current', 'daily', now)] == ['meditate', 'exercise']
+
+    # meditate was never completed, exercise breaks two days later
+    later = datetime(2024, 9, 18, 12, 0, 0)
+    assert [habit.task for habit in habits.leaderboard.top(3, 'current', now=later)] == ['meditate', 'reading', 'exercise']
+    assert find_habit(habits, 'exercise').current_streak == 0
+    mark_habit_as_completed(habits, 'exercise', later)
+    rename_habit(habits, 'meditate', 'breathing')
+    delete_habit(habits, 'reading')
+    assert [(habit.task, habit.highest_streak) for habit in habits.leaderboard.top(5, 'highest', now=later)] == [('breathing', 9), ('exercise', 5)]
+    assert [habit.task for habit in habits.leaderboard.top(5, 'current', now=later)] == ['breathing', 'exercise']
+
+# Test the leaderboard command
+def test_cli_leaderboard(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--store', path, 'leaderboard', '--by', 'highest', '--top', '1'])
+    assert result.output == "1. Task: 'exercise', Periodicity: 'daily', Highest Streak: 5\n"
+    result = runner.invoke(cli, ['--store', path, 'leaderboard', '--by', 'highest', '--periodicity', 'weekly'])
+    assert result.output == "1. Task: 'reading', Periodicity: 'weekly', Highest Streak: 2\n"
+    assert "No habits found with periodicity: monthly" in runner.invoke(cli, ['--store', path, 'leaderboard', '--periodicity', 'monthly']).output
+
+# Test that cached analytics survive writes to other habits and are dropped by writes to theirs
+def test_analytics_cache_invalidation(tmp_path, predefined_habits):
+    from analytics import analyze_habit, calculate_median_completion_time, get_longest_streak_of_all_habits
+    from analytics_cache import cached_call
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return load_habits_from_file(path, lazy=True)
+
+    def call(function, task, *args):
+        return cached_call(path, function, task, args, load)
+
+    assert call(calculate_median_completion_time, 'exercise') == '07:00'
+    assert call(calculate_median_completion_time, 'reading') == '18:00'
+    assert call(get_longest_streak_of_all_habits, None) == ['exercise', 5]
+    assert len(loads) == 3
+    assert call(calculate_median_completion_time, 'exercise') == '07:00'
+    assert call(get_longest_streak_of_all_habits, None) == ['exercise', 5]
+    assert len(loads) == 3
+
+    habits = load_habits_from_file(path)
+    mark_habit_as_completed(habits, 'reading', datetime(2024, 9, 16, 20, 0, 0))
+    append_to_journal(path, journal_record('complete', find_habit(habits, 'reading')))
+    assert call(calculate_median_completion_time, 'exercise') == '07:00'
+    assert len(loads) == 3
+    assert call(calculate_median_completion_time, 'reading') == '18:00'
+    assert call(get_longest_streak_of_all_habits, None) == ['exercise', 5]
+    assert len(loads) == 5
+
+    find_habit(habits, 'exercise').add_completion('2024-09-13 09:00:00')
+    save_habits_to_file(habits, path)
+    assert call(calculate_median_completion_time, 'reading') == '18:00'
+    assert len(loads) == 5
+    assert call(calculate_median_completion_time, 'exercise') == '07:00'
+    assert len(loads) == 6
+
+    # a write that bypasses data_manager drops every entry
+    with open(path, 'a') as file:
+        file.write('\n')
+    assert call(calculate_median_completion_time, 'reading') == '18:00'
+    assert len(loads) == 7
+
+# Test that cached streaks expire when they would break and that old entries are evicted
+def test_analytics_cache_expiry_and_eviction(tmp_path, predefined_habits):
+    from analytics import analyze_habit, completion_history_page
+    from analytics_cache import AnalyticsCache, cached_call, store_version
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return load_habits_from_file(path, lazy=True)
+
+    before = datetime(2024, 9, 17, 12, 0, 0)
+    after = datetime(2024, 9, 18, 7, 0, 0)
+    assert cached_call(path, analyze_habit, 'exercise', (), load, before) == ['exercise', 'daily', 5, 5]
+    assert cached_call(path, analyze_habit, 'exercise', (), load, before) == ['exercise', 'daily', 5, 5]
+    assert cached_call(path, analyze_habit, 'exercise', (), load, after) == ['exercise', 'daily', 0, 5]
+    assert len(loads) == 2
+
+    with AnalyticsCache(path, max_bytes=60) as cache:
+        version = store_version(path)
+        for offset in range(3):
+            page = completion_history_page(load_habits_from_file(path), 'exercise', offset=offset, limit=1)
+            assert cache.store(f'page {offset}', 'exercise', page, version)
+        assert not cache.lookup('page 0', version, before)[0]
+        assert cache.lookup('page 2', version, before) == (True, [3, ['2024-09-12 07:00:00']])
+
+# Test that analytics commands answer from the cache and see changes made through the CLI
+def test_cli_analytics_cache(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    predefined_habits[1].completed_today = False
+    save_habits_to_file(predefined_habits, path)
+    runner = CliRunner()
+    for _ in range(2):
+        assert "Longest Streak: 2" in runner.invoke(cli, ['--store', path, 'analyze', 'reading']).output
+        assert "'18:00'" in runner.invoke(cli, ['--store', path, 'median', 'reading']).output
+        assert runner.invoke(cli, ['--store', path, 'history', 'reading', '--limit', '5']).output.count('\n') == 3
+    assert os.path.exists(path + '.cache')
+    runner.invoke(cli, ['--store', path, 'complete', 'reading'])
+    assert runner.invoke(cli, ['--store', path, 'history', 'reading', '--limit', '5']).output.count('\n') == 4
+    assert "Current Streak: 1" in runner.invoke(cli, ['--store', path, 'analyze', 'reading']).output
+    assert "Habit 'nothing' not found" in runner.invoke(cli, ['--store', path, 'median', 'nothing']).output
+    assert "Current Streak: 1" in runner.invoke(cli, ['--store', path, '--no-cache', 'analyze', 'reading']).output
+
+# Test that the report gives the same rows in process and across a process pool
+def test_build_report(tmp_path, monkeypatch, predefined_habits):
+    import concurrent.futures
+    import report
+    from report import build_report
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    now = datetime(2024, 9, 18, 12, 0, 0)
+    rows = build_report(load_habits_from_file(path), now, workers=1)
+    # small stores are reported in this process whatever the number of workers
+    with monkeypatch.context() as patch:
+        patch.setattr(concurrent.futures, 'ProcessPoolExecutor', None)
+        assert build_report(load_habits_from_file(path), now, workers=8) == rows
+    monkeypatch.setattr(report, 'MIN_CHUNK_SIZE', 1)
+    assert rows == build_report(load_habits_from_file(path, lazy=True), now, workers=2)
+    assert rows[0] == {'task': 'exercise', 'periodicity': 'daily', 'current_streak': 0, 'highest_streak': 5, 'completions': 3,
+                       'median_time': '07:00', 'first_completed': '2024-09-10 07:00:00', 'last_completed': '2024-09-12 07:00:00'}
+    assert [row['current_streak'] for row in rows] == [0, 2]
+
+# Test the report command in both formats
+def test_cli_report(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--store', path, 'report', '--workers', '2', '--format', 'json'])
+    report = json.loads(result.output)
+    assert [row['task'] for row in report['habits']] == ['exercise', 'reading']
+    assert report['longest_streak'] == {'task': 'exercise', 'streak': 5}
+    result = runner.invoke(cli, ['--store', path, 'report', '--workers', '1'])
+    assert result.output.splitlines()[0].split() == ['Task', 'Periodicity', 'Current', 'Highest', 'Completions', 'Median', 'First', 'Completed', 'Last', 'Completed']
+    assert "The habit with the longest streak is 'exercise' with a streak of 5" in result.output
+
+# Test that archived completions leave the store but stay visible to queries that reach them
+def test_archive_completions(tmp_path, predefined_habits):
+    from archive import archive_completions, archive_dir
+    from analytics import iter_completion_history
+    from habit_manager import to_timestamp
+    from transfer import iter_export_rows
+    path = str(tmp_path / "habits.json")
+    predefined_habits[0].completion_history = [{'datetime': '2023-12-30 07:00:00'}, {'datetime': '2023-12-31 07:00:00'},
+                                               {'datetime': '2024-09-10 07:00:00'}, {'datetime': '2024-09-11 07:00:00'}]
+    predefined_habits[0].highest_streak = 2
+    habits = HabitStore(predefined_habits)
+    assert archive_completions(habits, path, to_timestamp('2024-09-11 00:00:00')) == {'exercise': 3, 'reading': 2}
+    save_habits_to_file(habits, path)
+    assert archive_completions(load_habits_from_file(path), path, to_timestamp('2024-09-11 00:00:00')) == {}
+    assert sorted(os.listdir(os.path.join(archive_dir(path), 'exercise'))) == ['2023.gz', '2024.gz']
+
+    with open(path) as file:
+        saved = json.load(file)[0]
+    assert saved['completion_history'] == [{'datetime': '2024-09-11 07:00:00'}]
+    assert saved['archive'] == {'key': 'exercise', 'before': '2024-09-11 00:00:00', 'counts': {'2023': 2, '2024': 1}}
+
+    habits = load_habits_from_file(path)
+    exercise = find_habit(habits, 'exercise')
+    assert exercise.completion_count == 4
+    assert list(iter_completion_history(exercise, datetime(2023, 12, 31))) == ['2023-12-31 07:00:00', '2024-09-10 07:00:00', '2024-09-11 07:00:00']
+    assert calculate_median_completion_time(habits, 'exercise') == '07:00'
+    assert len(list(iter_export_rows(habits))) == 6
+
+    # queries after the boundary never open the archive
+    exercise.defer_archive(None)
+    assert list(iter_completion_history(exercise, datetime(2024, 9, 11))) == ['2024-09-11 07:00:00']
+
+    rename_habit(habits, 'exercise', 'running')
+    save_habits_to_file(habits, path)
+    from streaks import recompute_streaks
+    habits = load_habits_from_file(path)
+    recompute_streaks(habits, datetime(2024, 9, 11, 20, 0, 0))
+    assert find_habit(habits, 'running').highest_streak == 2
+    assert find_habit(habits, 'running').current_streak == 2
+
+# Test the archive command and that history and median still see archived completions
+def test_cli_archive(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    runner = CliRunner()
+    history = runner.invoke(cli, ['--store', path, 'history', 'exercise']).output
+    assert "Archived 5 completions of 2 habits" in runner.invoke(cli, ['--store', path, 'archive', '--older-than', '1']).output
+    assert "Archived 0 completions of 0 habits" in runner.invoke(cli, ['--store', path, 'archive', '--older-than', '1']).output
+    assert find_habit(load_habits_from_file(path), 'exercise').timestamps.tolist() == []
+    assert runner.invoke(cli, ['--store', path, 'history', 'exercise']).output == history
+    assert "'07:00'" in runner.invoke(cli, ['--store', path, 'median', 'exercise']).output
+    assert "3 completions, median 07:00" in runner.invoke(cli, ['--store', path, 'stats', 'exercise']).output
+    report = json.loads(runner.invoke(cli, ['--store', path, 'report', '--format', 'json']).output)
+    assert [row['completions'] for row in report['habits']] == [3, 2]
+    today = date.today()
+    months = today.year * 12 + today.month - (2024 * 12 + 9) + 1
+    assert find_habit(load_habits_from_file(path), 'exercise').period_counts('month', [2024 * 12 + 7, 2024 * 12 + 8]) == [0, 3]
+    assert "2024-09    ###     3" in runner.invoke(cli, ['--store', path, 'trend', 'exercise', '--period', 'month', '--last', str(months)]).output
+    assert "nothing to archive" in runner.invoke(cli, ['--store', 'sqlite:' + str(tmp_path / "habits.db"), 'archive', '--older-than', '1']).output
+
+    # stores that cannot reach habits.archive get the archived completions back in their histories
+    other = str(tmp_path / "other.hbin")
+    runner.invoke(cli, ['convert', path, other])
+    assert find_habit(load_habits_from_file(other), 'exercise').archive is None
+    assert "Exported 5 rows" in runner.invoke(cli, ['--store', other, 'export', str(tmp_path / "rows.csv")]).output
+    database = 'sqlite:' + str(tmp_path / "migrated.db")
+    runner.invoke(cli, ['--store', database, 'migrate', path])
+    assert runner.invoke(cli, ['--store', database, 'history', 'exercise']).output == history
+
+    os.remove(os.path.join(tmp_path, "habits.archive", "exercise", "2024.gz"))
+    with pytest.raises(FileNotFoundError, match="missing"):
+        find_habit(load_habits_from_file(path), 'exercise').completion_timestamps()
+
+# Test that a watcher applies only the journal tail when it can and diffs habits after a full reload
+def test_store_watcher(tmp_path, predefined_habits):
+    from watch import StoreWatcher
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    watcher = StoreWatcher(path, lambda: load_habits_from_file(path))
+    assert watcher.poll() is None
+
+    append_to_journal(path, {'op': 'complete', 'task': 'reading', 'datetime': '2024-09-17 21:00:00', 'current_streak': 4, 'highest_streak': 4})
+    assert watcher.poll() == {'reading'}
+    assert find_habit(watcher.habits, 'reading').last_completed == '2024-09-17 21:00:00'
+    assert watcher.poll() is None
+
+    habits = load_habits_from_file(path)
+    rename_habit(habits, 'exercise', 'running')
+    save_habits_to_file(habits, path)
+    assert watcher.poll() == {'exercise', 'running'}
+    assert sorted(habit.task for habit in watcher.habits) == ['reading', 'running']
+
+# Test that redraw rewrites changed rows in place on a terminal and prints them again elsewhere
+def test_watch_redraw():
+    from watch import redraw
+    assert redraw([], ['a', 'b'], True) == "a\nb\n"
+    assert redraw(['a', 'b'], ['a', 'c'], True) == "\x1b[1F\x1b[2Kc\x1b[1E"
+    assert redraw(['a', 'b'], ['a', 'c'], False) == "c\n"
+    assert redraw(['a', 'b'], ['a'], True) == "\x1b[2F\x1b[Ja\n"
+    assert redraw(['a'], ['a'], False) == ""
+
+# Test that list --watch prints the habits and then only the row a journal append changed
+def test_cli_list_watch(tmp_path, monkeypatch, predefined_habits):
+    import watch
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    completed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 1:
+            append_to_journal(path, {'op': 'complete', 'task': 'reading', 'datetime': completed, 'current_streak': 4, 'highest_streak': 4})
+        elif len(sleeps) >= 3:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(watch.time, 'sleep', sleep)
+
+    result = CliRunner().invoke(cli, ['--store', path, 'list', '--watch', '--interval', '0.5'])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert len(lines) == 3
+    assert lines[0].startswith("Task: 'exercise'") and lines[1].startswith("Task: 'reading'")
+    assert lines[2] == f"Task: 'reading', Periodicity: 'weekly', Streak: 4, Last Completed: {completed}"
+    assert sleeps == [0.5, 0.5, 0.5]
+
+    result = CliRunner().invoke(cli, ['--store', path, 'analyze', 'missing', '--watch'])
+    assert result.exit_code == 0
+    assert result.output == "Habit 'missing' not found\n"
+
+# Test that iter_habits pages and sorts stores and plain lists the same way
+def test_iter_habits(predefined_habits):
+    from analytics import iter_habits
+    now = datetime(2024, 9, 16, 20, 0, 0)
+    for habits in (predefined_habits, HabitStore(predefined_habits)):
+        assert [habit.task for habit in iter_habits(habits, now=now)] == ['exercise', 'reading']
+        assert [habit.task for habit in iter_habits(habits, 'task', now=now)] == ['exercise', 'reading']
+        assert [habit.task for habit in iter_habits(habits, 'streak', limit=1, now=now)] == ['exercise']
+        assert [habit.task for habit in iter_habits(habits, 'last_completed', offset=1, limit=5, now=now)] == ['reading']
+        assert [habit.task for habit in iter_habits(habits, periodicity='Weekly', now=now)] == ['reading']
+        assert list(iter_habits(habits, 'highest', offset=2, now=now)) == []
+
+    never = Habit("stretch", "daily", 0, "NA", False, "NA", 0, "2024-09-01 07:00:00")
+    habits = [never] + predefined_habits
+    assert [habit.task for habit in iter_habits(habits, 'last_completed', now=now)] == ['exercise', 'reading', 'stretch']
+    assert [habit.task for habit in iter_habits(habits, 'last_completed', limit=2, now=now)] == ['exercise', 'reading']
+
+# Test list paging, sorting and ndjson output
+def test_cli_list_pages(tmp_path, predefined_habits):
+    path = str(tmp_path / "habits.json")
+    save_habits_to_file(predefined_habits, path)
+    runner = CliRunner()
+    result = runner.invoke(cli, ['--store', path, 'list', '--sort', 'task', '--offset', '1', '--format', 'ndjson'])
+    assert result.exit_code == 0
+    assert [json.loads(line)['task'] for line in result.output.splitlines()] == ['reading']
+    assert set(json.loads(result.output)) == {'task', 'periodicity', 'current_streak', 'highest_streak', 'last_completed'}
+    assert runner.invoke(cli, ['--store', path, 'list', '--limit', '1']).output.startswith("Task: 'exercise'")
+    assert runner.invoke(cli, ['--store', path, 'list', '--offset', '2']).output == "No habits found.\n"
+    assert runner.invoke(cli, ['--store', path, 'list', '--offset', '2', '--format', 'ndjson']).output == ""
+    assert runner.invoke(cli, ['--store', path, 'list_by_periodicity', 'weekly', '--limit', '1']).output == "Task: 'reading', Periodicity: 'weekly', Streak: 0\n"
+    assert runner.invoke(cli, ['--store', path, 'list', '--sort', 'size']).exit_code == 2
+
+# Test that importing completions from before the archive boundary merges them into the archive
+def test_import_into_archive(tmp_path):
+    from archive import archive_dir
+    from streaks import recompute_streaks
+    path = str(tmp_path / "habits.json")
+    rows = str(tmp_path / "rows.csv")
+    with open(rows, 'w') as file:
+        file.write("task,datetime,periodicity\nwalk,2023-02-01 08:00:00,daily\nwalk,2023-03-01 08:00:00,daily\nwalk,2023-03-02 08:00:00,daily\n")
+    runner = CliRunner()
+    runner.invoke(cli, ['--store', path, 'import', rows])
+    runner.invoke(cli, ['--store', path, 'archive', '--older-than', '30'])
+    with open(rows, 'w') as file:
+        file.write("task,datetime\nwalk,2023-03-01 08:00:00\nwalk,2023-03-03 08:00:00\n")
+    assert "1 completions added, 1 duplicates" in runner.invoke(cli, ['--store', path, 'import', rows, '--dry-run']).output
+    assert find_habit(load_habits_from_file(path), 'walk').archive['counts'] == {'2023': 3}
+    assert "1 completions added, 1 duplicates" in runner.invoke(cli, ['--store', path, 'import', rows]).output
+    assert "0 completions added, 2 duplicates" in runner.invoke(cli, ['--store', path, 'import', rows]).output
+
+    walk = find_habit(load_habits_from_file(path), 'walk')
+    assert walk.archive['counts'] == {'2023': 4}
+    assert len(walk.timestamps) == 0
+    assert os.listdir(os.path.join(archive_dir(path), 'walk')) == ['2023.gz']
+    assert runner.invoke(cli, ['--store', path, 'history', 'walk']).output.splitlines()[1:] == [
+        '2023-02-01 08:00:00', '2023-03-01 08:00:00', '2023-03-02 08:00:00', '2023-03-03 08:00:00']
+    recompute_streaks([walk], datetime(2023, 3, 3, 20, 0, 0))
+    assert walk.highest_streak == 3
+
+# Test that the benchmark generator writes files in the format save_habits_to_file produces
+def test_benchmark_generator_round_trip(tmp_path):
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+    from generate import write_habits_file
+
+    path = str(tmp_path / "habits.json")
+    assert write_habits_file(path, 5, 20, seed=1) == 100
+    habits = load_habits_from_file(path)
+    written = StringIO()
+    save_habits_to_file(habits, written)
+    assert written.getvalue() == open(path).read()
+    assert all(habit.highest_streak >= habit.current_streak for habit in habits)
+    write_habits_file(str(tmp_path / "again.json"), 5, 20, seed=1)
+    assert open(tmp_path / "again.json").read() == open(path).read()
+
 @pytest.fixture
 def predefined_habits():
     return [
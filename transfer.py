@@ -0,0 +1,131 @@
+"""Bulk import and export of completions as CSV or NDJSON rows.
+
+Each row is one completion with the fields task, datetime and optionally
+periodicity: a CSV row under a header naming the columns, e.g.
+
+    task,datetime,periodicity
+    exercise,2024-09-16 07:00:00,daily
+
+or an NDJSON object such as {"task": "exercise", "datetime": "2024-09-16 07:00:00"}.
+Rows are read and written one at a time, so files of any length stream through.
+"""
+import csv
+import json
+import os
+from array import array
+from habit_manager import add_habit, find_habit, from_timestamp, to_timestamp
+
+FORMATS = ('csv', 'ndjson')
+FIELDS = ('task', 'datetime', 'periodicity')
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+def detect_format(filename, default='csv'):
+    """The row format implied by a file name's extension."""
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower(), default)
+
+def read_rows(file, file_format):
+    """Yield (line number, row dict) for every non-blank row of file.
+
+    A row that is not valid JSON is yielded as None so the caller can count
+    it as skipped. Raises ValueError for a CSV file whose header does not
+    name the task and datetime columns.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        if reader.fieldnames is not None and not {'task', 'datetime'} <= set(reader.fieldnames):
+            raise ValueError(f"The CSV header must name the columns {', '.join(FIELDS)} (periodicity is optional), "
+                             f"found: {','.join(reader.fieldnames)}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+def import_completions(habits, rows, default_periodicity='daily'):
+    """Merge the completions of rows into habits, creating habits that do not exist yet.
+
+    Completions are collected per habit and merged into each history once,
+    sorted and without duplicates. Completions from before a habit's archive
+    boundary are checked against the archive instead and reported under
+    'archived' ({task: sorted new timestamps}) for archive.archive_imported
+    to store. Returns a dict with the number of rows, completions added,
+    duplicates and skipped rows, the habits created, the changed habits,
+    the archived completions, and (line number, reason) for the first
+    skipped rows.
+    """
+    pending = {}
+    created = []
+    result = {'rows': 0, 'added': 0, 'duplicates': 0, 'skipped': 0, 'errors': []}
+    for line_number, row in rows:
+        result['rows'] += 1
+        try:
+            task = row['task'].strip().lower()
+            if not task:
+                raise ValueError("empty task")
+            timestamp = to_timestamp(row['datetime'].strip())
+            periodicity = row.get('periodicity') or default_periodicity
+            if not isinstance(periodicity, str) or not periodicity.strip():
+                raise ValueError(f"invalid periodicity {periodicity!r}")
+        except (KeyError, AttributeError, TypeError, ValueError) as e:
+            result['skipped'] += 1
+            if len(result['errors']) < 10:
+                result['errors'].append((line_number, f"missing field {e}" if isinstance(e, KeyError) else str(e) or type(e).__name__))
+            continue
+        timestamps = pending.get(task)
+        if timestamps is None:
+            if find_habit(habits, task) is None:
+                add_habit(habits, task, periodicity)
+                created.append(task)
+            timestamps = pending[task] = array('q')
+        timestamps.append(timestamp)
+
+    changed, new_tasks, archived = [], set(created), {}
+    for task, timestamps in pending.items():
+        habit = find_habit(habits, task)
+        recent = timestamps
+        if habit.archive:
+            before = to_timestamp(habit.archive['before'])
+            recent = array('q', (timestamp for timestamp in timestamps if timestamp >= before))
+            old = {timestamp for timestamp in timestamps if timestamp < before}
+            if old:
+                old.difference_update(habit.completion_timestamps(None, before))
+                if old:
+                    archived[task] = array('q', sorted(old))
+        added = habit.merge_completions(recent) + len(archived.get(task, ()))
+        result['added'] += added
+        result['duplicates'] += len(timestamps) - added
+        if task in new_tasks:
+            habit.creation_date = from_timestamp(min(timestamps))
+        if added:
+            changed.append(habit)
+    result['created'] = created
+    result['changed'] = changed
+    result['archived'] = archived
+    return result
+
+def iter_export_rows(habits):
+    """Yield (task, datetime, periodicity) for every completion of habits, archived ones included, oldest first per habit."""
+    for habit in habits:
+        for timestamp in habit.completion_timestamps():
+            yield habit.task, from_timestamp(timestamp), habit.periodicity
+
+def write_rows(file, rows, file_format):
+    """Write rows from iter_export_rows to file, returning how many were written."""
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    for row in rows:
+        file.write(json.dumps(dict(zip(FIELDS, row))) + '\n')
+        count += 1
+    return count
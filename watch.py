@@ -0,0 +1,155 @@
+"""Keep a store's habits in memory for `--watch` and reload only what changed.
+
+A StoreWatcher remembers the inode, modification time and size of the
+snapshot and of its journal. While the snapshot is unchanged and the journal
+only grew, a poll reads the records appended since the last one and applies
+them to the habits in memory. Any other change reloads the store and
+compares each habit's fingerprint with the previous one. Either way it
+reports which habits changed, so watch_rows rebuilds and redraws only their
+rows.
+"""
+import json
+import os
+import time
+import zlib
+from datetime import datetime
+from locking import FileLock, lock_path
+
+DEFAULT_INTERVAL = 1.0
+
+def _stat(path):
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return status.st_ino, status.st_mtime_ns, status.st_size
+
+def header_fingerprint(habit):
+    """A checksum of the fields of a habit that its rows show."""
+    return zlib.crc32(json.dumps(habit.to_dict(history=False), sort_keys=True).encode())
+
+class StoreWatcher:
+    """The habits of the store at path, kept up to date by poll().
+
+    load() loads the whole store. journal says whether the store has a
+    change journal to follow (JSON and binary stores do, sqlite does not).
+    """
+
+    def __init__(self, path, load, journal=True):
+        self.path = os.fspath(path)
+        self.load = load
+        self.journal = journal
+        self.habits = None
+        self.fingerprints = {}
+        self.snapshot_version = None
+        self.journal_version = None
+        self.reload()
+
+    def _journal_path(self):
+        from data_manager import journal_path
+
+        return journal_path(self.path)
+
+    def _versions(self):
+        return _stat(self.path), _stat(self._journal_path()) if self.journal else None
+
+    def reload(self):
+        """Load the whole store. Returns the tasks whose habits differ from the ones held before."""
+        with FileLock(lock_path(self.path), shared=True):
+            habits = self.load()
+            self.snapshot_version, self.journal_version = self._versions()
+        fingerprints = {habit.task: header_fingerprint(habit) for habit in habits}
+        changed = {task for task in fingerprints.keys() | self.fingerprints.keys() if fingerprints.get(task) != self.fingerprints.get(task)}
+        self.habits, self.fingerprints = habits, fingerprints
+        return changed
+
+    def poll(self):
+        """Bring the habits up to date. Returns the tasks that changed, or None if the store did not change."""
+        with FileLock(lock_path(self.path), shared=True):
+            snapshot_version, journal_version = self._versions()
+            if (snapshot_version, journal_version) == (self.snapshot_version, self.journal_version):
+                return None
+            if (snapshot_version == self.snapshot_version and journal_version is not None and self.journal_version is not None
+                    and journal_version[0] == self.journal_version[0] and journal_version[2] > self.journal_version[2]):
+                return self._replay_tail()
+            return self.reload()
+
+    def _replay_tail(self):
+        """Apply the journal records appended since the last poll."""
+        from data_manager import apply_journal_record, log_error
+        from habit_manager import find_habit
+
+        with open(self._journal_path(), 'rb') as file:
+            file.seek(self.journal_version[2])
+            text = file.read()
+            status = os.fstat(file.fileno())
+        self.journal_version = status.st_ino, status.st_mtime_ns, self.journal_version[2] + len(text)
+        changed = set()
+        for line in text.decode().splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                apply_journal_record(self.habits, record)
+            except (ValueError, KeyError) as e:
+                log_error(f"Skipping journal record of '{self.path}': {e}")
+                continue
+            changed.update(record[field] for field in ('task', 'new_task') if field in record)
+        for task in changed:
+            habit = find_habit(self.habits, task)
+            if habit is None:
+                self.fingerprints.pop(task, None)
+            else:
+                self.fingerprints[task] = header_fingerprint(habit)
+        return changed
+
+def redraw(old, new, terminal):
+    """The text that turns the rows old, already printed, into the rows new.
+
+    On a terminal only the changed rows are rewritten in place, and the
+    whole block when the number of rows changes. Elsewhere the changed rows
+    are printed again below.
+    """
+    if len(old) != len(new):
+        clear = f"\x1b[{len(old)}F\x1b[J" if terminal and old else ''
+        return clear + ''.join(line + '\n' for line in new)
+    parts = []
+    for index, (before, after) in enumerate(zip(old, new)):
+        if before == after:
+            continue
+        if terminal:
+            up = len(old) - index
+            parts.append(f"\x1b[{up}F\x1b[2K{after}\x1b[{up}E")
+        else:
+            parts.append(after + '\n')
+    return ''.join(parts)
+
+def watch_rows(watcher, select, row, echo, terminal, empty, interval=DEFAULT_INTERVAL):
+    """Print row(habit) for each habit select(habits) picks, then keep the rows current until interrupted.
+
+    Rows are rebuilt only for the habits a poll reports as changed, and for
+    every habit once a shown streak is due to break. empty is the row shown
+    when no habit is picked.
+    """
+    from habit_manager import check_if_streak_broken, streak_deadline, datetime_to_timestamp
+
+    lines, shown, rebuild, changed = {}, [], True, set()
+    while True:
+        now = datetime.now()
+        habits = select(watcher.habits)
+        for habit in habits:
+            check_if_streak_broken(habit, now)
+        lines = {habit.task: row(habit) if rebuild or habit.task in changed or habit.task not in lines else lines[habit.task]
+                 for habit in habits}
+        rows = [lines[habit.task] for habit in habits] or [empty]
+        echo(redraw(shown, rows, terminal))
+        shown = rows
+        current = datetime_to_timestamp(now)
+        deadline = min((deadline for deadline in map(streak_deadline, habits) if deadline is not None and deadline > current), default=None)
+
+        rebuild, changed = False, None
+        while changed is None and not rebuild:
+            time.sleep(interval)
+            changed = watcher.poll()
+            rebuild = deadline is not None and datetime_to_timestamp(datetime.now()) >= deadline
+        changed = changed or set()